@@ -89,12 +89,18 @@ class BlockHeader(rlp.Serializable):
             fields['coinbase'] = decode_hex(fields['coinbase'])
         assert len(fields['coinbase']) == 20
         self.block = None
+        # headers are immutable, so their hashes are computed once
+        self._hash = None
+        self._mining_hash = None
+        self._signing_hash = None
         super(BlockHeader, self).__init__(**fields)
 
     @property
     def hash(self):
         """The binary block hash"""
-        return utils.sha3(rlp.encode(self))
+        if self._hash is None:
+            self._hash = utils.sha3(rlp.encode(self))
+        return self._hash
 
     @property
     def hex_hash(self):
@@ -102,37 +108,19 @@ class BlockHeader(rlp.Serializable):
 
     @property
     def mining_hash(self):
-
-        # exclude mixhash and nonce
-        fields2 = [
-            (field, sedes) for field, sedes in BlockHeader._meta.fields
-            if field not in ["mixhash", "nonce"]
-        ]
-
-        class BlockHeader2(rlp.Serializable):
-            fields = fields2
-
-        _self = BlockHeader2(**{f:getattr(self, f) for (f, sedes) in fields2})
-
-        return utils.sha3(rlp.encode(
-            _self, BlockHeader2))
+        if self._mining_hash is None:
+            self._mining_hash = utils.sha3(rlp.encode(
+                [getattr(self, f) for f, _ in MiningHeader._meta.fields],
+                MiningHeader._meta.sedes))
+        return self._mining_hash
 
     @property
     def signing_hash(self):
-
-        # exclude extra_data
-        fields3 = [
-            (field, sedes) for field, sedes in BlockHeader._meta.fields
-            if field not in ["extra_data"]
-        ]
-
-        class BlockHeader3(rlp.Serializable):
-            fields = fields3
-
-        _self = BlockHeader3(**{f:getattr(self, f) for (f, sedes) in fields3})
-
-        return utils.sha3(rlp.encode(
-            _self, BlockHeader3))
+        if self._signing_hash is None:
+            self._signing_hash = utils.sha3(rlp.encode(
+                [getattr(self, f) for f, _ in SigningHeader._meta.fields],
+                SigningHeader._meta.sedes))
+        return self._signing_hash
 
     def to_dict(self):
         """Serialize the header to a readable dictionary."""
@@ -165,6 +153,18 @@ class BlockHeader(rlp.Serializable):
         return not self.__eq__(other)
 
 
+class MiningHeader(rlp.Serializable):
+    """The fields of a header hashed for the proof of work"""
+    fields = [(field, sedes) for field, sedes in BlockHeader._meta.fields
+              if field not in ('mixhash', 'nonce')]
+
+
+class SigningHeader(rlp.Serializable):
+    """The fields of a header hashed for signing"""
+    fields = [(field, sedes) for field, sedes in BlockHeader._meta.fields
+              if field != 'extra_data']
+
+
 class Block(rlp.Serializable):
 
     """A block.
@@ -207,6 +207,10 @@ class Block(rlp.Serializable):
         except AttributeError:
             return getattr(self.header, name)
 
+    @property
+    def hash(self):
+        return self.header.hash
+
     @property
     def transaction_count(self):
         return len(self.transactions)
@@ -0,0 +1,89 @@
+from collections import OrderedDict
+from ethereum.utils import sha3
+
+# Default bound on the total size of the code whose analysis is cached
+CODE_ANALYSIS_CACHE_BYTES = 32 * 1024 * 1024
+
+
+class CodeAnalysisCache(object):
+    """LRU cache of the results of analysing contract code.
+
+    Entries are keyed by code hash and weighed by the length of the
+    analysed code, which is roughly what the analysis itself takes up, so
+    the bound is in bytes rather than in number of contracts. If the
+    analysis can be serialized (encode/decode given) and a database is
+    passed to get(), results are also stored there and survive restarts.
+
+    :param name: identifies the analysis in database keys; change it when
+                 the format of the results changes
+    :param analyze: function computing the analysis of a piece of code
+    :param max_bytes: bound on the total length of the cached code
+    :param encode: optional function serializing a result to bytes
+    :param decode: inverse of encode
+    """
+
+    def __init__(self, name, analyze, max_bytes=CODE_ANALYSIS_CACHE_BYTES,
+                 encode=None, decode=None):
+        self.name = name
+        self.analyze = analyze
+        self.max_bytes = max_bytes
+        self.encode = encode
+        self.decode = decode
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.db_hits = 0
+        self.evictions = 0
+
+    def db_key(self, code_hash):
+        return b'code_analysis:' + self.name + b':' + code_hash
+
+    def get(self, code, code_hash=None, db=None):
+        """get the analysis of code, computing it on a miss
+
+        :param code: the code
+        :param code_hash: sha3 of the code, computed if not given
+        :param db: optional database to read and store analyses in
+        """
+        if code_hash is None:
+            code_hash = sha3(code)
+        entry = self.entries.pop(code_hash, None)
+        if entry is not None:
+            self.hits += 1
+            self.entries[code_hash] = entry
+            return entry[1]
+        self.misses += 1
+        result = None
+        persist = db is not None and self.encode is not None
+        if persist:
+            try:
+                result = self.decode(db.get(self.db_key(code_hash)))
+                self.db_hits += 1
+            except KeyError:
+                pass
+        if result is None:
+            result = self.analyze(code)
+            if persist:
+                db.put(self.db_key(code_hash), self.encode(result))
+        self.put(code_hash, len(code), result)
+        return result
+
+    def put(self, code_hash, size, result):
+        if size > self.max_bytes:
+            return
+        self.entries[code_hash] = (size, result)
+        self.size += size
+        while self.size > self.max_bytes:
+            _, (evicted_size, _) = self.entries.popitem(last=False)
+            self.size -= evicted_size
+            self.evictions += 1
+
+    def clear(self):
+        self.entries.clear()
+        self.size = 0
+
+    def stats(self):
+        return dict(entries=len(self.entries), size=self.size,
+                    hits=self.hits, misses=self.misses,
+                    db_hits=self.db_hits, evictions=self.evictions)
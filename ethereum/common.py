@@ -7,7 +7,7 @@ import rlp
 from ethereum.slogging import get_logger
 from ethereum.exceptions import InsufficientBalance, BlockGasLimitReached, \
     InsufficientStartGas, InvalidNonce, UnsignedTransaction
-from ethereum.messages import apply_transaction
+from ethereum.messages import apply_transaction, VMExt
 log = get_logger('eth.block')
 
 
@@ -129,13 +129,14 @@ def add_transactions(state, block, txqueue, min_gasprice=0):
     pre_txs = len(block.transactions)
     log.info('Adding transactions, %d in txqueue, %d dunkles' %
              (len(txqueue.txs), pre_txs))
+    ext = VMExt(state, None)
     while True:
         tx = txqueue.pop_transaction(max_gas=state.gas_limit - state.gas_used,
                                      min_gasprice=min_gasprice)
         if tx is None:
             break
         try:
-            apply_transaction(state, tx)
+            apply_transaction(state, tx, ext=ext)
             block = block.copy(
                 transactions=block.transactions + (tx,)
             )
@@ -193,10 +194,8 @@ def verify_execution_results(state, block):
 
 # Make the root of a receipt tree
 def mk_receipt_sha(receipts):
-    t = trie.Trie(EphemDB())
-    for i, receipt in enumerate(receipts):
-        t.update(rlp.encode(i), rlp.encode(receipt))
-    return t.root_hash
+    return trie.mk_root_hash([(rlp.encode(i), rlp.encode(receipt))
+                              for i, receipt in enumerate(receipts)])
 
 
 # Make the root of a transaction tree
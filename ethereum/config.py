@@ -92,6 +92,13 @@ default_config = dict(
     SERENITY_HEADER_POST_FINALIZER=utils.int_to_addr(254),
     SERENITY_GETTER_CODE=decode_hex(
         '60ff331436604014161560155760203560003555005b6000355460205260206020f3'),
+    # Store the results of code analysis in the database
+    PERSIST_CODE_ANALYSIS=False,
+    # Interpreter running contract code: 'vm', 'fastvm' or 'fastvm_fused'
+    VM_ENGINE='vm',
+    # Processes recovering the senders of large blocks in apply_block: 1 to
+    # recover them in the calling process, None for one per CPU
+    SENDER_RECOVERY_PROCESSES=1,
     # Custom specials
     CUSTOM_SPECIALS={},
 )
@@ -99,6 +106,34 @@ assert default_config['NEPHEW_REWARD'] == \
     default_config['BLOCK_REWARD'] // 32
 
 
+# Forks switched on by a <NAME>_FORK_BLKNUM config entry
+FORKS = ('homestead', 'dao', 'anti_dos', 'spurious_dragon', 'metropolis',
+         'constantinople', 'serenity')
+
+
+class ForkRules(object):
+    """The forks active at a block number, resolved once from a config.
+
+    Has a boolean attribute per entry of FORKS, equal to the matching
+    State.is_<FORK>() check, and is immutable.
+    """
+    __slots__ = ('config', 'block_number') + FORKS
+
+    def __init__(self, config, block_number):
+        object.__setattr__(self, 'config', config)
+        object.__setattr__(self, 'block_number', block_number)
+        for fork in FORKS:
+            object.__setattr__(self, fork, block_number >=
+                               config[fork.upper() + '_FORK_BLKNUM'])
+
+    def __setattr__(self, key, value):
+        raise AttributeError('ForkRules are immutable')
+
+    def __repr__(self):
+        return '<ForkRules(#%d %s)>' % (self.block_number, ' '.join(
+            fork for fork in FORKS if getattr(self, fork)))
+
+
 class Env(object):
 
     def __init__(self, db=None, config=None, global_config=None):
@@ -1,6 +1,8 @@
 from ethereum import utils
 from ethereum.slogging import get_logger
 from ethereum.utils import str_to_bytes
+from repoze.lru import LRUCache
+import sqlite3
 import sys
 if sys.version_info.major == 2:
     from repoze.lru import lru_cache
@@ -51,6 +53,91 @@ class _EphemDB(BaseDB):
 DB = EphemDB = _EphemDB
 
 
+# Persistent database backed by a single SQLite file. Writes are buffered
+# in memory and flushed to disk in one transaction on commit(), so a
+# Chain that commits once per block writes each block atomically. Reads
+# check the pending writes first, then a bounded LRU cache, then disk.
+class SQLiteDB(BaseDB):
+
+    def __init__(self, path, cache_size=100000):
+        self.path = path
+        self.kv = None
+        self.conn = sqlite3.connect(path)
+        self.conn.execute('CREATE TABLE IF NOT EXISTS kv '
+                          '(key BLOB PRIMARY KEY, value BLOB NOT NULL)')
+        self.conn.commit()
+        self.uncommitted = {}
+        self.cache = LRUCache(cache_size)
+        self.commit_counter = 0
+
+    def get(self, key):
+        if key in self.uncommitted:
+            if self.uncommitted[key] is None:
+                raise KeyError(key)
+            return self.uncommitted[key]
+        o = self.cache.get(key)
+        if o is not None:
+            return o
+        row = self.conn.execute(
+            'SELECT value FROM kv WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            raise KeyError(key)
+        o = bytes(row[0])
+        self.cache.put(key, o)
+        return o
+
+    def put(self, key, value):
+        self.uncommitted[key] = str_to_bytes(value)
+
+    def delete(self, key):
+        if not self._has_key(key):
+            raise KeyError(key)
+        self.uncommitted[key] = None
+
+    def commit(self):
+        if not self.uncommitted:
+            return
+        puts = []
+        deletes = []
+        for k, v in self.uncommitted.items():
+            if v is None:
+                deletes.append((k,))
+                self.cache.invalidate(k)
+            else:
+                puts.append((k, v))
+                self.cache.put(k, v)
+        with self.conn:
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO kv (key, value) VALUES (?, ?)', puts)
+            self.conn.executemany('DELETE FROM kv WHERE key = ?', deletes)
+        log.debug('Committed batch', puts=len(puts), deletes=len(deletes))
+        self.uncommitted = {}
+        self.commit_counter += 1
+
+    def revert(self):
+        self.uncommitted = {}
+
+    def close(self):
+        self.conn.close()
+
+    def _has_key(self, key):
+        if key in self.uncommitted:
+            return self.uncommitted[key] is not None
+        if self.cache.get(key) is not None:
+            return True
+        return self.conn.execute(
+            'SELECT 1 FROM kv WHERE key = ?', (key,)).fetchone() is not None
+
+    def __contains__(self, key):
+        return self._has_key(key)
+
+    def __eq__(self, other):
+        return isinstance(other, self.__class__) and self.path == other.path
+
+    def __hash__(self):
+        return hash(self.path)
+
+
 # Used for SPV proof creation
 class ListeningDB(BaseDB):
 
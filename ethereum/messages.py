@@ -17,6 +17,7 @@ from ethereum import opcodes
 from ethereum.transactions import Transaction
 from ethereum.consensus_strategy import get_consensus_strategy
 from ethereum import vm
+from ethereum import fastvm
 from ethereum.specials import specials as default_specials
 from ethereum.config import Env, default_config
 from ethereum.db import BaseDB, EphemDB
@@ -181,7 +182,9 @@ def apply_message(state, msg=None, **kwargs):
     return bytearray_to_bytestr(data) if result else None
 
 
-def apply_transaction(state, tx):
+# ext: a VMExt built for the current block of the state, to reuse across
+# its transactions; one is made for the transaction if not given
+def apply_transaction(state, tx, tracer=None, ext=None):
     state.logs = []
     state.suicides = []
     state.refunds = 0
@@ -197,6 +200,7 @@ def apply_transaction(state, tx):
                     rp(tx, 'startgas', tx.startgas, intrinsic_gas))
 
     log_tx.debug('TX NEW', txdict=tx.to_dict())
+    journal_start = len(state.journal)
 
     # start transacting #################
     if tx.sender != null_address:
@@ -206,7 +210,7 @@ def apply_transaction(state, tx):
     assert state.get_balance(tx.sender) >= tx.startgas * tx.gasprice
     state.delta_balance(tx.sender, -tx.startgas * tx.gasprice)
 
-    message_data = vm.CallData([safe_ord(x) for x in tx.data], 0, len(tx.data))
+    message_data = vm.CallData(tx.data, 0, len(tx.data))
     message = vm.Message(
         tx.sender,
         tx.to,
@@ -217,7 +221,10 @@ def apply_transaction(state, tx):
         code_address=tx.to)
 
     # MESSAGE
-    ext = VMExt(state, tx)
+    if ext is None:
+        ext = VMExt(state, tx, tracer)
+    else:
+        ext.set_tx(tx, tracer)
 
     if tx.to != b'':
         result, gas_remained, data = apply_msg(ext, message)
@@ -270,6 +277,10 @@ def apply_transaction(state, tx):
         state.set_balance(s, 0)
         state.del_account(s)
 
+    state.tx_journal_length = len(state.journal) - journal_start
+    log_tx.debug('TX JOURNAL', entries=state.tx_journal_length,
+                 reverted_total=state.journal_reverted)
+
     # Pre-Metropolis: commit state after every tx
     if not state.is_METROPOLIS() and not SKIP_MEDSTATES:
         state.commit()
@@ -285,15 +296,30 @@ def apply_transaction(state, tx):
     return success, output
 
 
-# VM interface
+# Interpreters selectable with the VM_ENGINE config option
+vm_engines = {
+    'vm': vm.vm_execute,
+    'fastvm': fastvm.vm_execute,
+    'fastvm_fused': fastvm.vm_execute_fused,
+}
+
+
+# VM interface. Block-level values and fork rules are read from the state
+# when the VMExt is built, so one VMExt serves all transactions of a block,
+# switched to each with set_tx
+
 class VMExt():
 
-    def __init__(self, state, tx):
-        self.specials = {k: v for k, v in default_specials.items()}
-        for k, v in state.config['CUSTOM_SPECIALS']:
-            self.specials[k] = v
+    def __init__(self, state, tx, tracer=None):
+        if state.config['CUSTOM_SPECIALS']:
+            self.specials = {k: v for k, v in default_specials.items()}
+            for k, v in state.config['CUSTOM_SPECIALS']:
+                self.specials[k] = v
+        else:
+            self.specials = default_specials
         self._state = state
         self.get_code = state.get_code
+        self.get_code_hash = state.get_code_hash
         self.set_code = state.set_code
         self.get_balance = state.get_balance
         self.set_balance = state.set_balance
@@ -316,29 +342,37 @@ class VMExt():
         self.log = lambda addr, topics, data: \
             state.add_log(Log(addr, topics, data))
         self.create = lambda msg: create_contract(self, msg)
-        self.msg = lambda msg: _apply_msg(
-            self, msg, self.get_code(msg.code_address))
+        self.msg = lambda msg: apply_msg(self, msg)
         self.account_exists = state.account_exists
-        self.post_homestead_hardfork = lambda: state.is_HOMESTEAD()
-        self.post_metropolis_hardfork = lambda: state.is_METROPOLIS()
-        self.post_constantinople_hardfork = lambda: state.is_CONSTANTINOPLE()
-        self.post_serenity_hardfork = lambda: state.is_SERENITY()
-        self.post_anti_dos_hardfork = lambda: state.is_ANTI_DOS()
-        self.post_spurious_dragon_hardfork = lambda: state.is_SPURIOUS_DRAGON()
+        rules = self.fork_rules = state.fork_rules
+        self.post_homestead_hardfork = lambda: rules.homestead
+        self.post_metropolis_hardfork = lambda: rules.metropolis
+        self.post_constantinople_hardfork = lambda: rules.constantinople
+        self.post_serenity_hardfork = lambda: rules.serenity
+        self.post_anti_dos_hardfork = lambda: rules.anti_dos
+        self.post_spurious_dragon_hardfork = lambda: rules.spurious_dragon
         self.blockhash_store = state.config['METROPOLIS_BLOCKHASH_STORE']
         self.snapshot = state.snapshot
         self.revert = state.revert
         self.transfer_value = state.transfer_value
         self.reset_storage = state.reset_storage
+        self.code_analysis_db = state.db \
+            if state.config['PERSIST_CODE_ANALYSIS'] else None
+        self.vm_execute = vm_engines[state.config['VM_ENGINE']]
+        self.set_tx(tx, tracer)
+
+    def set_tx(self, tx, tracer=None):
         self.tx_origin = tx.sender if tx else b'\x00' * 20
         self.tx_gasprice = tx.gasprice if tx else 0
+        self.tracer = tracer
 
 
 def apply_msg(ext, msg):
-    return _apply_msg(ext, msg, ext.get_code(msg.code_address))
+    return _apply_msg(ext, msg, ext.get_code(msg.code_address),
+                      ext.get_code_hash(msg.code_address))
 
 
-def _apply_msg(ext, msg, code):
+def _apply_msg(ext, msg, code, code_hash=None):
     trace_msg = log_msg.is_active('trace')
     if trace_msg:
         log_msg.debug("MSG APPLY", sender=encode_hex(msg.sender), to=encode_hex(msg.to),
@@ -350,19 +384,28 @@ def _apply_msg(ext, msg, code):
             pre_storage=ext.log_storage(msg.to),
             static=msg.static, depth=msg.depth)
 
+    tracer = ext.tracer
+    if tracer is not None:
+        special = msg.code_address in ext.specials
+        if code_hash is None and not special:
+            code_hash = utils.sha3(code)
+        tracer.enter(msg, code, code_hash, special)
+
     # Transfer value, instaquit if not enough
     snapshot = ext.snapshot()
     if msg.transfers_value:
         if not ext.transfer_value(msg.sender, msg.to, msg.value):
             log_msg.debug('MSG TRANSFER FAILED', have=ext.get_balance(msg.to),
                           want=msg.value)
+            if tracer is not None:
+                tracer.exit(msg, 1, msg.gas, [])
             return 1, msg.gas, []
 
     # Main loop
     if msg.code_address in ext.specials:
         res, gas, dat = ext.specials[msg.code_address](ext, msg)
     else:
-        res, gas, dat = vm.vm_execute(ext, msg, code)
+        res, gas, dat = ext.vm_execute(ext, msg, code, code_hash)
 
     if trace_msg:
         log_msg.debug('MSG APPLIED', gas_remained=gas,
@@ -374,6 +417,9 @@ def _apply_msg(ext, msg, code):
         log_msg.debug('REVERTING')
         ext.revert(snapshot)
 
+    if tracer is not None:
+        tracer.exit(msg, res, gas, dat)
+
     return res, gas, dat
 
 
@@ -406,7 +452,7 @@ def create_contract(ext, msg):
 
     msg.is_create = True
     # assert not ext.get_code(msg.to)
-    msg.data = vm.CallData([], 0, 0)
+    msg.data = vm.CallData(b'', 0, 0)
     snapshot = ext.snapshot()
 
     ext.set_nonce(msg.to, 1 if ext.post_spurious_dragon_hardfork() else 0)
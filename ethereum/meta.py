@@ -5,14 +5,16 @@ from ethereum.common import mk_block_from_prevstate, validate_header, \
     verify_execution_results, validate_transaction_tree, \
     set_execution_results, add_transactions, post_finalize
 from ethereum.consensus_strategy import get_consensus_strategy
-from ethereum.messages import apply_transaction
+from ethereum.messages import apply_transaction, VMExt
 from ethereum.state import State
+from ethereum.transactions import recover_senders
 from ethereum.utils import sha3, encode_hex
 import rlp
 
 
 # Applies the block-level state transition function
-def apply_block(state, block):
+# prevalidated skips the context-free checks done by Chain.import_blocks
+def apply_block(state, block, tracer=None, prevalidated=False):
     # Pre-processing and verification
     snapshot = state.snapshot()
     cs = get_consensus_strategy(state.config)
@@ -21,12 +23,15 @@ def apply_block(state, block):
         cs.initialize(state, block)
         # Basic validation
         assert validate_header(state, block.header)
-        assert cs.check_seal(state, block.header)
+        assert prevalidated or cs.check_seal(state, block.header)
         assert cs.validate_uncles(state, block)
-        assert validate_transaction_tree(state, block)
+        assert prevalidated or validate_transaction_tree(state, block)
         # Process transactions
+        recover_senders(block.transactions,
+                        state.config['SENDER_RECOVERY_PROCESSES'])
+        ext = VMExt(state, None)
         for tx in block.transactions:
-            apply_transaction(state, tx)
+            apply_transaction(state, tx, tracer, ext)
         # Finalize (incl paying block rewards)
         cs.finalize(state, block)
         # Verify state root, tx list root, receipt root
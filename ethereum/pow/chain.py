@@ -4,13 +4,16 @@ import json
 import random
 import time
 import itertools
+from collections import OrderedDict, deque
 from ethereum import utils
 from ethereum.utils import parse_as_bin, big_endian_to_int, is_string
 from ethereum.meta import apply_block
-from ethereum.common import update_block_env_variables
+from ethereum.common import update_block_env_variables, \
+    validate_transaction_tree
 from ethereum.messages import apply_transaction
 import rlp
-from ethereum.utils import encode_hex
+from rlp.sedes import CountableList, List, big_endian_int
+from ethereum.utils import encode_hex, hash32
 from ethereum.exceptions import InvalidNonce, InsufficientStartGas, UnsignedTransaction, \
     BlockGasLimitReached, InsufficientBalance, InvalidTransaction, VerificationFailed
 from ethereum.slogging import get_logger, configure_logging
@@ -18,6 +21,8 @@ from ethereum.config import Env
 from ethereum.state import State, dict_to_prev_header
 from ethereum.block import Block, BlockHeader, BLANK_UNCLES_HASH, FakeHeader
 from ethereum.pow.consensus import initialize
+from ethereum.pow import ethpow
+from ethereum.transactions import get_recovery_pool
 from ethereum.genesis_helpers import mk_basic_state, state_from_genesis_declaration, \
     initialize_genesis_keys
 from ethereum.db import RefcountDB
@@ -28,16 +33,79 @@ config_string = ':info'  #,eth.chain:debug'
 #config_string = ':info,eth.vm.log:trace,eth.vm.op:trace,eth.vm.stack:trace,eth.vm.exit:trace,eth.pb.msg:trace,eth.pb.tx:debug'
 configure_logging(config_string=config_string)
 
+# Default number of decoded blocks kept in memory by a chain
+BLOCK_CACHE_SIZE = 512
+# Default number of decoded headers kept in memory by a chain; more than
+# PREV_HEADER_DEPTH so that building a post-state hits the cache
+HEADER_CACHE_SIZE = 4096
+
+# Stored under b'header:' + blockhash next to every block: its header, the
+# hashes of its uncles, which is all an ancestor walk needs, and its score
+header_entry = List([BlockHeader, CountableList(hash32), big_endian_int])
+
+
+# Number of recent reorgs whose metrics a chain keeps in reorgs
+REORG_HISTORY = 100
+
+# Blocks imported by import_blocks between two database commits
+IMPORT_BATCH_SIZE = 256
+# Blocks checked ahead of execution by import_blocks, per worker process
+IMPORT_LOOKAHEAD = 16
+
+
+def prevalidate_block(block_rlp):
+    """Runs the checks of an encoded block that need no state: the seal,
+    the transaction root and the transaction signatures. Used by
+    Chain.import_blocks in worker processes.
+
+    :return: (error, senders), error being None for a valid block
+    """
+    try:
+        block = rlp.decode(block_rlp, Block)
+        header = block.header
+        if not ethpow.check_pow(header.number, header.mining_hash,
+                                header.mixhash, header.nonce,
+                                header.difficulty):
+            return 'Invalid PoW', None
+        validate_transaction_tree(None, block)
+        return None, [tx.sender for tx in block.transactions]
+    except Exception as e:
+        return str(e) or e.__class__.__name__, None
+
+
+def cache_put(cache, key, value, max_size):
+    if max_size <= 0:
+        return
+    cache[key] = value
+    while len(cache) > max_size:
+        cache.popitem(last=False)
+
 
 class Chain(object):
 
     def __init__(self, genesis=None, env=None,
-                 new_head_cb=None, reset_genesis=False, localtime=None, max_history=1000, **kwargs):
+                 new_head_cb=None, reset_genesis=False, localtime=None, max_history=1000,
+                 block_cache_size=BLOCK_CACHE_SIZE,
+                 header_cache_size=HEADER_CACHE_SIZE, **kwargs):
         self.env = env or Env()
+        # Decoded blocks by hash, least recently used first
+        self.block_cache = OrderedDict()
+        self.block_cache_size = block_cache_size
+        # (header, uncle hashes, score) by block hash, least recently used
+        # first
+        self.header_cache = OrderedDict()
+        self.header_cache_size = header_cache_size
+        # Scores of blocks without a header entry, e.g. saved before scores
+        # were stored with headers
+        self.scores = OrderedDict()
+        # add_block commits each block unless import_blocks batches them
+        self.autocommit = True
+        # Metrics of the most recent reorgs, oldest first
+        self.reorgs = deque(maxlen=REORG_HISTORY)
         # Initialize the state
         if b'head_hash' in self.db:  # new head tag
             self.state = self.mk_poststate_of_blockhash(
-                self.db.get('head_hash'))
+                self.db.get(b'head_hash'))
             self.state.executing_on_head = True
             print('Initializing chain from saved head, #%d (%s)' %
                   (self.state.prev_headers[0].number, encode_hex(self.state.prev_headers[0].hash)))
@@ -77,11 +145,8 @@ class Chain(object):
 
         initialize(self.state)
         self.new_head_cb = new_head_cb
-        
-        if self.state.block_number == 0:
-            assert self.state.block_number == self.state.prev_headers[0].number
-        else:
-            assert self.state.block_number - 1 == self.state.prev_headers[0].number
+
+        assert self.state.block_number == self.state.prev_headers[0].number
 
         if reset_genesis:
             if isinstance(self.state.prev_headers[0], FakeHeader):
@@ -104,11 +169,10 @@ class Chain(object):
     @property
     def head(self):
         try:
-            block_rlp = self.db.get(self.head_hash)
-            if block_rlp == b'GENESIS':
+            if self.head_hash not in self.block_cache and \
+                    self.db.get(self.head_hash) == b'GENESIS':
                 return self.genesis
-            else:
-                return rlp.decode(block_rlp, Block)
+            return self.load_block(self.head_hash)
         except Exception as e:
             log.error(e)
             return None
@@ -118,11 +182,13 @@ class Chain(object):
         if blockhash not in self.db:
             raise Exception("Block hash %s not found" % encode_hex(blockhash))
 
-        block_rlp = self.db.get(blockhash)
-        if block_rlp == b'GENESIS':
-            return State.from_snapshot(json.loads(
-                self.db.get(b'GENESIS_STATE')), self.env)
-        block = rlp.decode(block_rlp, Block)
+        block_rlp = None
+        if blockhash not in self.block_cache:
+            block_rlp = self.db.get(blockhash)
+            if block_rlp == b'GENESIS':
+                return State.from_snapshot(json.loads(
+                    self.db.get(b'GENESIS_STATE')), self.env)
+        block = self.load_block(blockhash, block_rlp)
 
         state = State(env=self.env)
         state.trie.root_hash = block.header.state_root
@@ -131,20 +197,19 @@ class Chain(object):
         state.txindex = len(block.transactions)
         state.recent_uncles = {}
         state.prev_headers = []
-        b = block
+        # Ancestors only contribute their headers and uncle hashes
+        header, uncles = block.header, [u.hash for u in block.uncles]
         header_depth = state.config['PREV_HEADER_DEPTH']
         for i in range(header_depth + 1):
-            state.prev_headers.append(b.header)
+            state.prev_headers.append(header)
             if i < 6:
-                state.recent_uncles[state.block_number - i] = []
-                for u in b.uncles:
-                    state.recent_uncles[state.block_number - i].append(u.hash)
+                state.recent_uncles[state.block_number - i] = list(uncles)
             try:
-                b = rlp.decode(state.db.get(b.header.prevhash), Block)
+                header, uncles, _ = self.load_header(header.prevhash)
             except BaseException:
                 break
         if i < header_depth:
-            if state.db.get(b.header.prevhash) == b'GENESIS':
+            if state.db.get(header.prevhash) == b'GENESIS':
                 jsondata = json.loads(state.db.get(b'GENESIS_STATE'))
                 for h in jsondata["prev_headers"][:header_depth - i]:
                     state.prev_headers.append(dict_to_prev_header(h))
@@ -167,6 +232,8 @@ class Chain(object):
     # Gets the block with a given blockhash
     def get_block(self, blockhash):
         try:
+            if blockhash in self.block_cache:
+                return self.load_block(blockhash)
             block_rlp = self.db.get(blockhash)
             if block_rlp == b'GENESIS':
                 if not hasattr(self, 'genesis'):
@@ -174,11 +241,59 @@ class Chain(object):
                         self.db.get(b'GENESIS_RLP'), sedes=Block)
                 return self.genesis
             else:
-                return rlp.decode(block_rlp, Block)
+                return self.load_block(blockhash, block_rlp)
         except Exception as e:
             log.debug("Failed to get block", hash=blockhash, error=e)
             return None
 
+    # Gets a stored (non-genesis) block, decoding it only if it is not in
+    # the block cache. Blocks are immutable, so cached ones are shared.
+    def load_block(self, blockhash, block_rlp=None):
+        block = self.block_cache.pop(blockhash, None)
+        if block is None:
+            if block_rlp is None:
+                block_rlp = self.db.get(blockhash)
+            block = rlp.decode(block_rlp, Block)
+        self.cache_block(block, blockhash)
+        return block
+
+    def cache_block(self, block, blockhash=None):
+        cache_put(self.block_cache, blockhash or block.hash, block,
+                  self.block_cache_size)
+
+    # Gets the header of a block with a given blockhash, or None
+    def get_header(self, blockhash):
+        try:
+            return self.load_header(blockhash)[0]
+        except Exception:
+            block = self.get_block(blockhash)
+            return block.header if block is not None else None
+
+    # Gets the header, uncle hashes and score of a stored (non-genesis)
+    # block without decoding its transactions. Blocks saved before headers
+    # were stored separately are decoded in full, and have a score of None.
+    def load_header(self, blockhash):
+        entry = self.header_cache.pop(blockhash, None)
+        if entry is None:
+            try:
+                entry = rlp.decode(self.db.get(b'header:' + blockhash),
+                                   header_entry)
+            except KeyError:
+                block = self.load_block(blockhash)
+                entry = (block.header, [u.hash for u in block.uncles], None)
+        cache_put(self.header_cache, blockhash, entry,
+                  self.header_cache_size)
+        return entry
+
+    # Stores the header entry of a block, holding its header, uncle hashes
+    # and score
+    def store_header(self, block, score):
+        entry = (block.header, [u.hash for u in block.uncles], score)
+        self.db.put(b'header:' + block.hash, rlp.encode(entry, header_entry))
+        cache_put(self.header_cache, block.hash, entry,
+                  self.header_cache_size)
+        self.scores.pop(block.hash, None)
+
     # Add a record allowing you to later look up the provided block's
     # parent hash and see that it is one of its children
     def add_child(self, child):
@@ -224,23 +339,46 @@ class Chain(object):
             block = block.hash
         return [self.get_block(h) for h in self.get_child_hashes(block)]
 
-    # Get the score (AKA total difficulty in PoW) of a given block
+    # Get the score (AKA total difficulty in PoW) of a given block. Stored
+    # blocks have theirs in their header entry, so this is a lookup for
+    # them and for children of stored blocks.
     def get_score(self, block):
         if not block:
             return 0
-        key = b'score:' + block.header.hash
-
+        score = self.lookup_score(block.header.hash)
         fills = []
-        while key not in self.db:
-            fills.insert(0, (block.header.hash, block.difficulty))
-            key = b'score:' + block.header.prevhash
-            block = self.get_parent(block)
-        score = int(self.db.get(key))
-        for h, d in fills:
-            key = b'score:' + h
+        while score is None:
+            fills.append(block)
+            score = self.lookup_score(block.header.prevhash)
+            if score is None:
+                block = self.get_parent(block)
+        for b in reversed(fills):
+            d = b.header.difficulty
             score = score + d + random.randrange(d // 10**6 + 1)
-            self.db.put(key, str(score))
+            # blocks stored without a score keep the one drawn here
+            if b.header.hash in self.db:
+                self.store_header(b, score)
+            else:
+                cache_put(self.scores, b.header.hash, score,
+                          self.header_cache_size)
+        return score
 
+    # Gets the known score of a block, or None
+    def lookup_score(self, blockhash):
+        score = self.scores.get(blockhash)
+        if score is not None:
+            return score
+        try:
+            score = self.load_header(blockhash)[2]
+        except Exception:
+            pass
+        if score is None:
+            # scores of blocks stored before they went into the header entry
+            key = b'score:' + blockhash
+            if key in self.db:
+                score = int(self.db.get(key))
+                cache_put(self.scores, blockhash, score,
+                          self.header_cache_size)
         return score
 
     # This function should be called periodically so as to
@@ -257,8 +395,16 @@ class Chain(object):
             if len(self.time_queue) == pre_len:
                 i += 1
 
-    # Call upon receiving a block
-    def add_block(self, block):
+    # Stores the accounts of a head state under b'address:' keys, so that
+    # reads from the head state skip the trie walk
+    def update_account_index(self, state, addrs):
+        addrs = list(addrs)
+        for addr, data in zip(addrs, state.trie.get_many(addrs)):
+            self.db.put(b'address:' + addr, data)
+
+    # Call upon receiving a block; prevalidated blocks have been through
+    # prevalidate_block
+    def add_block(self, block, prevalidated=False):
         now = self.localtime
         # Are we receiving the block too early?
         if block.header.timestamp > now:
@@ -277,13 +423,12 @@ class Chain(object):
             self.state.deletes = []
             self.state.changed = {}
             try:
-                apply_block(self.state, block)
+                apply_block(self.state, block, prevalidated=prevalidated)
             except (AssertionError, KeyError, ValueError, InvalidTransaction, VerificationFailed) as e:
                 log.info('Block %d (%s) with parent %s invalid, reason: %s' %
                          (block.number, encode_hex(block.header.hash[:4]), encode_hex(block.header.prevhash[:4]), str(e)))
                 return False
             self.db.put(b'block:%d' % block.header.number, block.header.hash)
-            # side effect: put 'score:' cache in db
             block_score = self.get_score(block)
             self.head_hash = block.header.hash
             for i, tx in enumerate(block.transactions):
@@ -293,6 +438,7 @@ class Chain(object):
                 block.header.number) == block.header.hash
             deletes = self.state.deletes
             changed = self.state.changed
+            self.update_account_index(self.state, changed.keys())
         # Or is the block being added to a chain that is not currently the
         # head?
         elif block.header.prevhash in self.env.db:
@@ -301,7 +447,7 @@ class Chain(object):
                       encode_hex(self.head_hash[:4]), encode_hex(block.header.prevhash[:4])))
             temp_state = self.mk_poststate_of_blockhash(block.header.prevhash)
             try:
-                apply_block(temp_state, block)
+                apply_block(temp_state, block, prevalidated=prevalidated)
             except (AssertionError, KeyError, ValueError, InvalidTransaction, VerificationFailed) as e:
                 log.info('Block %s with parent %s invalid, reason: %s' %
                     (encode_hex(block.header.hash[:4]), encode_hex(block.header.prevhash[:4]), str(e)))
@@ -310,90 +456,11 @@ class Chain(object):
             block_score = self.get_score(block)
             changed = temp_state.changed
             # If the block should be the new head, replace the head
-            if block_score > self.get_score(self.head):
-                b = block
-                new_chain = {}
-                # Find common ancestor
-                while b.header.number >= int(self.db.get(b'GENESIS_NUMBER')):
-                    new_chain[b.header.number] = b
-                    key = b'block:%d' % b.header.number
-                    orig_at_height = self.db.get(
-                        key) if key in self.db else None
-                    if orig_at_height == b.header.hash:
-                        break
-                    if b.prevhash not in self.db or self.db.get(
-                            b.prevhash) == b'GENESIS':
-                        break
-                    b = self.get_parent(b)
-                replace_from = b.header.number
-                # Replace block index and tx indices, and edit the state cache
-
-                # Get a list of all accounts that have been edited along the old and
-                # new chains
-                changed_accts = {}
-                # Read: for i in range(common ancestor block number...new block
-                # number)
-                for i in itertools.count(replace_from):
-                    log.info('Rewriting height %d' % i)
-                    key = b'block:%d' % i
-                    # Delete data for old blocks
-                    orig_at_height = self.db.get(
-                        key) if key in self.db else None
-                    if orig_at_height:
-                        orig_block_at_height = self.get_block(orig_at_height)
-                        log.info(
-                            '%s no longer in main chain' %
-                            encode_hex(
-                                orig_block_at_height.header.hash))
-                        # Delete from block index
-                        self.db.delete(key)
-                        # Delete from txindex
-                        for tx in orig_block_at_height.transactions:
-                            if b'txindex:' + tx.hash in self.db:
-                                self.db.delete(b'txindex:' + tx.hash)
-                        # Add to changed list
-                        acct_list = self.db.get(
-                            b'changed:' + orig_block_at_height.hash)
-                        for j in range(0, len(acct_list), 20):
-                            changed_accts[acct_list[j: j + 20]] = True
-                    # Add data for new blocks
-                    if i in new_chain:
-                        new_block_at_height = new_chain[i]
-                        log.info(
-                            '%s now in main chain' %
-                            encode_hex(
-                                new_block_at_height.header.hash))
-                        # Add to block index
-                        self.db.put(key, new_block_at_height.header.hash)
-                        # Add to txindex
-                        for j, tx in enumerate(
-                                new_block_at_height.transactions):
-                            self.db.put(b'txindex:' + tx.hash,
-                                        rlp.encode([new_block_at_height.number, j]))
-                        # Add to changed list
-                        if i < b.number:
-                            acct_list = self.db.get(
-                                b'changed:' + new_block_at_height.hash)
-                            for j in range(0, len(acct_list), 20):
-                                changed_accts[acct_list[j: j + 20]] = True
-                    if i not in new_chain and not orig_at_height:
-                        break
-                # Add changed list from new head to changed list
-                for c in changed.keys():
-                    changed_accts[c] = True
-                # Update the on-disk state cache
-                for addr in changed_accts.keys():
-                    data = temp_state.trie.get(addr)
-                    if data:
-                        self.state.db.put(b'address:' + addr, data)
-                    else:
-                        try:
-                            self.state.db.delete(b'address:' + addr)
-                        except KeyError:
-                            pass
-                self.head_hash = block.header.hash
-                self.state = temp_state
-                self.state.executing_on_head = True
+            head_score = self.lookup_score(self.head_hash)
+            if head_score is None:
+                head_score = self.get_score(self.head)
+            if block_score > head_score:
+                self.reorganize(block, temp_state, changed)
         # Block has no parent yet
         else:
             if block.header.prevhash not in self.parent_queue:
@@ -407,6 +474,8 @@ class Chain(object):
         self.db.put(b'head_hash', self.head_hash)
 
         self.db.put(block.hash, rlp.encode(block))
+        self.store_header(block, block_score)
+        self.cache_block(block)
         self.db.put(b'changed:' + block.hash,
                     b''.join([k.encode() if not is_string(k) else k for k in list(changed.keys())]))
         print('Saved %d address change logs' % len(changed.keys()))
@@ -430,7 +499,8 @@ class Chain(object):
             except KeyError as e:
                 print(e)
                 pass
-        self.db.commit()
+        if self.autocommit:
+            self.db.commit()
         assert (b'deletes:' + block.hash) in self.db
         log.info('Added block %d (%s) with %d txs and %d gas' %
                  (block.header.number, encode_hex(block.header.hash)[:8],
@@ -446,10 +516,181 @@ class Chain(object):
             del self.parent_queue[block.header.hash]
         return True
 
+    # Finds where a block not on the main chain branches off it. Returns
+    # the number of the last common block and the (number, hash) of the
+    # blocks from there to the given block, oldest first.
+    def find_fork_point(self, block):
+        genesis_number = int(self.db.get(b'GENESIS_NUMBER'))
+        genesis_hash = self.db.get(b'GENESIS_HASH')
+        number, blockhash, prevhash = \
+            block.header.number, block.header.hash, block.header.prevhash
+        branch = []
+        while True:
+            branch.append((number, blockhash))
+            if number - 1 < genesis_number or prevhash == genesis_hash or \
+                    self.get_blockhash_by_number(number - 1) == prevhash:
+                break
+            header = self.load_header(prevhash)[0]
+            number, blockhash, prevhash = \
+                header.number, prevhash, header.prevhash
+        branch.reverse()
+        return number - 1, branch
+
+    # Makes a block whose post-state and changed accounts are given the new
+    # head, replacing the blocks of the main chain after the fork point.
+    # The block, tx and account indices are rewritten in one pass: the old
+    # and new branches are collected first, so a transaction or account
+    # touched by both is written once with its value on the new branch.
+    def reorganize(self, block, state, changed):
+        start = time.time()
+        fork_number, branch = self.find_fork_point(block)
+        old = []
+        for number in itertools.count(fork_number + 1):
+            blockhash = self.get_blockhash_by_number(number)
+            if blockhash is None:
+                break
+            old.append((number, blockhash))
+
+        changed_accts = set(changed)
+        old_txs = set()
+        for number, blockhash in old:
+            old_txs.update(tx.hash for tx in
+                           self.load_block(blockhash).transactions)
+            acct_list = self.db.get(b'changed:' + blockhash)
+            changed_accts.update(acct_list[j: j + 20]
+                                 for j in range(0, len(acct_list), 20))
+        new_txs = {}
+        for number, blockhash in branch:
+            if blockhash == block.hash:
+                b = block
+            else:
+                b = self.load_block(blockhash)
+                acct_list = self.db.get(b'changed:' + blockhash)
+                changed_accts.update(acct_list[j: j + 20]
+                                     for j in range(0, len(acct_list), 20))
+            for j, tx in enumerate(b.transactions):
+                new_txs[tx.hash] = rlp.encode([number, j])
+
+        for number, blockhash in old:
+            if number > block.header.number:
+                self.db.delete(b'block:%d' % number)
+        for number, blockhash in branch:
+            self.db.put(b'block:%d' % number, blockhash)
+        for txhash in old_txs:
+            if txhash not in new_txs and b'txindex:' + txhash in self.db:
+                self.db.delete(b'txindex:' + txhash)
+        for txhash, position in new_txs.items():
+            self.db.put(b'txindex:' + txhash, position)
+        self.update_account_index(state, changed_accts)
+
+        old_head = self.head_hash
+        self.head_hash = block.header.hash
+        self.state = state
+        self.state.executing_on_head = True
+        metrics = dict(number=block.header.number, fork_number=fork_number,
+                       old_head=old_head, new_head=block.header.hash,
+                       depth=len(old), length=len(branch),
+                       accounts=len(changed_accts),
+                       seconds=time.time() - start)
+        self.reorgs.append(metrics)
+        log.info('Reorg at #%d: %d blocks replaced by %d (%s -> %s), '
+                 '%d accounts reindexed in %.3fs' %
+                 (fork_number, metrics['depth'], metrics['length'],
+                  encode_hex(old_head[:4]), encode_hex(block.header.hash[:4]),
+                  metrics['accounts'], metrics['seconds']))
+        return metrics
+
+    def import_blocks(self, blocks, processes=None,
+                      batch_size=IMPORT_BATCH_SIZE, report_interval=10):
+        """Adds many blocks, e.g. when syncing or replaying an export.
+
+        The checks of prevalidate_block run in a process pool a few blocks
+        ahead of the block being executed, so signature recovery and PoW
+        verification use the other cores while this process runs the state
+        transitions. Writes are committed once per batch_size blocks rather
+        than once per block. Invalid blocks are logged and skipped; they
+        and the blocks add_block leaves aside (e.g. whose parent is not
+        known yet) are counted as rejected.
+
+        :param blocks: iterable of blocks or of their RLP encodings
+        :param processes: size of the pool, defaults to the number of CPUs;
+                          1 runs every check in this process
+        :param batch_size: blocks added between two database commits
+        :param report_interval: seconds between two progress log lines
+        :return: dict with the number of blocks added and rejected, the gas
+                 they used, the time taken and the resulting throughputs
+        """
+        import multiprocessing
+        pool = get_recovery_pool(processes) if processes != 1 else None
+        lookahead = IMPORT_LOOKAHEAD * (processes or
+                                        multiprocessing.cpu_count())
+        pending = deque()
+        stats = dict(blocks=0, rejected=0, gas=0)
+        start = time.time()
+        last_report = [start]
+
+        def add_next():
+            block, block_rlp, check = pending.popleft()
+            error, senders = check.get() if pool else check
+            if error is None:
+                # only blocks that passed are decoded here
+                if not isinstance(block, Block):
+                    block = rlp.decode(block_rlp, Block)
+                for tx, sender in zip(block.transactions, senders):
+                    tx._sender = sender
+                if self.add_block(block, prevalidated=True):
+                    stats['blocks'] += 1
+                    stats['gas'] += block.header.gas_used
+                    if stats['blocks'] % batch_size == 0:
+                        self.db.commit()
+                else:
+                    stats['rejected'] += 1
+            else:
+                # the input may not even decode, so name it by its rlp hash
+                log.info('Block with rlp hash %s invalid: %s' %
+                         (encode_hex(utils.sha3(block_rlp)[:4]), error))
+                stats['rejected'] += 1
+            now = time.time()
+            if now - last_report[0] >= report_interval:
+                last_report[0] = now
+                self.log_import_progress(stats, now - start)
+
+        self.autocommit = False
+        try:
+            for block in blocks:
+                block_rlp = rlp.encode(block) if isinstance(block, Block) \
+                    else block
+                if pool:
+                    check = pool.apply_async(prevalidate_block, (block_rlp,))
+                else:
+                    check = prevalidate_block(block_rlp)
+                pending.append((block, block_rlp, check))
+                if len(pending) > lookahead:
+                    add_next()
+            while pending:
+                add_next()
+        finally:
+            self.autocommit = True
+            self.db.commit()
+        elapsed = max(time.time() - start, 1e-9)
+        stats['seconds'] = elapsed
+        stats['blocks_per_second'] = stats['blocks'] / elapsed
+        stats['gas_per_second'] = stats['gas'] / elapsed
+        self.log_import_progress(stats, elapsed)
+        return stats
+
+    def log_import_progress(self, stats, elapsed):
+        elapsed = max(elapsed, 1e-9)
+        log.info('Imported %d blocks (%d rejected) in %.1fs: %.1f blocks/s, '
+                 '%.3f Mgas/s, head #%d' %
+                 (stats['blocks'], stats['rejected'], elapsed,
+                  stats['blocks'] / elapsed, stats['gas'] / elapsed / 1e6,
+                  self.state.block_number))
+
     def __contains__(self, blk):
         if isinstance(blk, (str, bytes)):
             try:
-                blk = rlp.decode(self.db.get(blk), Block)
+                blk = self.load_block(blk)
             except BaseException:
                 return False
         try:
@@ -507,17 +748,15 @@ class Chain(object):
 
     # Get blockhashes starting from a hash and going backwards
     def get_blockhashes_from_hash(self, blockhash, max_num):
-        block = self.get_block(blockhash)
-        if block is None:
+        header = self.get_header(blockhash)
+        if header is None:
             return []
 
-        header = block.header
         hashes = []
         for i in range(max_num):
-            block = self.get_block(header.prevhash)
-            if block is None:
+            header = self.get_header(header.prevhash)
+            if header is None:
                 break
-            header = block.header
             hashes.append(header.hash)
             if header.number == 0:
                 break
@@ -12,9 +12,20 @@ class SecureTrie(object):
         self.db.put(h, utils.str_to_bytes(k))
         self.trie.update(h, v)
 
+    def update_many(self, items):
+        o = {}
+        for k, v in dict(items).items():
+            h = utils.sha3(k)
+            self.db.put(h, utils.str_to_bytes(k))
+            o[h] = v
+        self.trie.update_many(o)
+
     def get(self, k):
         return self.trie.get(utils.sha3(k))
 
+    def get_many(self, ks):
+        return self.trie.get_many([utils.sha3(k) for k in ks])
+
     def delete(self, k):
         self.trie.delete(utils.sha3(k))
 
@@ -33,6 +44,9 @@ class SecureTrie(object):
     def root_hash_valid(self):
         return self.trie.root_hash_valid()
 
+    def commit(self):
+        self.trie.commit()
+
     @property
     def root_hash(self):
         return self.trie.root_hash
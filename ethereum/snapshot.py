@@ -155,13 +155,12 @@ def load_state(env, alloc):
         acct = Account.blank_account(db, env.config['ACCOUNT_INITIAL_NONCE'])
         if len(account['storage']) > 0:
             t = SecureTrie(Trie(db, BLANK_ROOT))
-            c = 0
-            for k in account['storage']:
-                v = account['storage'][k]
-                enckey = zpad(decode_hex(k), 32)
-                t.update(enckey, decode_hex(v))
-                c += 1
-                if c % 1000 and len(db.db_service.uncommitted) > 50000:
+            keys = list(account['storage'])
+            for c in range(0, len(keys), 1000):
+                t.update_many([(zpad(decode_hex(k), 32),
+                                decode_hex(account['storage'][k]))
+                               for k in keys[c:c + 1000]])
+                if len(db.db_service.uncommitted) > 50000:
                     print("%d uncommitted. committing..." % len(db.db_service.uncommitted))
                     db.commit()
             acct.storage = t.root_hash
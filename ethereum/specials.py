@@ -17,9 +17,9 @@ def proc_ecrecover(ext, msg):
     if msg.gas < gas_cost:
         return 0, 0, []
 
-    message_hash_bytes = [0] * 32
+    message_hash_bytes = bytearray(32)
     msg.data.extract_copy(message_hash_bytes, 0, 0, 32)
-    message_hash = b''.join(map(ascii_chr, message_hash_bytes))
+    message_hash = bytes(message_hash_bytes)
 
     # TODO: This conversion isn't really necessary.
     # TODO: Invesitage if the check below is really needed.
@@ -68,7 +68,7 @@ def proc_identity(ext, msg):
     gas_cost = OP_GAS
     if msg.gas < gas_cost:
         return 0, 0, []
-    o = [0] * msg.data.size
+    o = bytearray(msg.data.size)
     msg.data.extract_copy(o, 0, 0, len(o))
     return 1, msg.gas - gas_cost, o
 
@@ -8,7 +8,7 @@ from ethereum import utils
 from ethereum import trie
 from ethereum.trie import Trie
 from ethereum.securetrie import SecureTrie
-from ethereum.config import default_config, Env
+from ethereum.config import default_config, Env, ForkRules
 from ethereum.block import FakeHeader
 from ethereum.db import BaseDB, EphemDB, OverlayDB, RefcountDB
 from ethereum.specials import specials as default_specials
@@ -25,6 +25,16 @@ BLANK_ROOT = utils.sha3rlp(b'')
 
 THREE = b'\x00' * 19 + b'\x03'
 
+# Journal entries are tuples starting with one of these:
+# (JOURNAL_SETATTR, obj, attr, previous value)
+# (JOURNAL_STORAGE, account, key, previous value)
+# (JOURNAL_POP, attr) -- pop the last item of a list attribute of the state
+(
+    JOURNAL_SETATTR,
+    JOURNAL_STORAGE,
+    JOURNAL_POP
+) = tuple(range(3))
+
 
 def snapshot_form(val):
     if is_numeric(val):
@@ -72,7 +82,8 @@ class Account():
         self.code_hash = acc.code_hash
 
         self.storage_cache = {}
-        self.storage_trie = SecureTrie(Trie(RefcountDB(self.env.db)))
+        self.storage_trie = SecureTrie(
+            Trie(RefcountDB(self.env.db), deferred=True))
         self.storage_trie.root_hash = self.storage
         self.touched = False
         self.existent_at_start = True
@@ -80,11 +91,13 @@ class Account():
         self.deleted = False
 
     def commit(self):
+        updates = {}
         for k, v in self.storage_cache.items():
             if v:
-                self.storage_trie.update(utils.encode_int32(k), rlp.encode(v))
+                updates[utils.encode_int32(k)] = rlp.encode(v)
             else:
                 self.storage_trie.delete(utils.encode_int32(k))
+        self.storage_trie.update_many(updates)
         self.storage_cache = {}
         self.storage = self.storage_trie.root_hash
 
@@ -110,6 +123,18 @@ class Account():
     def set_storage_data(self, key, value):
         self.storage_cache[key] = value
 
+    def copy(self, env):
+        o = Account(self.nonce, self.balance, self.storage, self.code_hash,
+                    env, self.address)
+        # reset_storage may have moved the trie away from self.storage
+        if self.storage_trie.root_hash != self.storage:
+            o.storage_trie.root_hash = self.storage_trie.root_hash
+        o.storage_cache = dict(self.storage_cache)
+        o.touched = self.touched
+        o.existent_at_start = self.existent_at_start
+        o.deleted = self.deleted
+        return o
+
     @classmethod
     def blank_account(cls, env, address, initial_nonce=0):
         env.db.put(BLANK_HASH, b'')
@@ -141,15 +166,24 @@ class State():
 
     def __init__(self, root=b'', env=Env(), executing_on_head=False, **kwargs):
         self.env = env
-        self.trie = SecureTrie(Trie(RefcountDB(self.db), root))
+        self.trie = SecureTrie(Trie(RefcountDB(self.db), root, deferred=True))
         for k, v in STATE_DEFAULTS.items():
             setattr(self, k, kwargs.get(k, copy.copy(v)))
         self.journal = []
+        self.journal_reverted = 0
+        self.tx_journal_length = 0
         self.cache = {}
         self.log_listeners = []
         self.deletes = []
         self.changed = {}
         self.executing_on_head = executing_on_head
+        # Set on states created by fork()
+        self.parent_cache = None
+        self.account_rlp_cache = None
+        # Shared by the forks of this state, see fork()
+        self.fork_root = None
+        self.fork_reads = None
+        self.fork_rules_cache = None
 
     @property
     def db(self):
@@ -172,11 +206,24 @@ class State():
     def get_and_cache_account(self, address):
         if address in self.cache:
             return self.cache[address]
-        if self.executing_on_head and False:
+        if self.parent_cache is not None and address in self.parent_cache:
+            o = self.parent_cache[address].copy(self.env)
+            self.cache[address] = o
+            o._mutable = True
+            o._cached_rlp = None
+            return o
+        # The chain keeps b'address:' entries in step with the head block;
+        # accounts committed since then have to come from the trie
+        if self.executing_on_head and address not in self.changed:
             try:
                 rlpdata = self.db.get(b'address:' + address)
             except KeyError:
-                rlpdata = b''
+                rlpdata = self.trie.get(address)
+        elif self.account_rlp_cache is not None:
+            rlpdata = self.account_rlp_cache.get(address)
+            if rlpdata is None:
+                rlpdata = self.trie.get(address)
+                self.account_rlp_cache[address] = rlpdata
         else:
             rlpdata = self.trie.get(address)
         if rlpdata != trie.BLANK_NODE:
@@ -205,14 +252,17 @@ class State():
         return self.get_and_cache_account(
             utils.normalize_address(address)).code
 
+    def get_code_hash(self, address):
+        return self.get_and_cache_account(
+            utils.normalize_address(address)).code_hash
+
     def get_nonce(self, address):
         return self.get_and_cache_account(
             utils.normalize_address(address)).nonce
 
     def set_and_journal(self, acct, param, val):
-        # self.journal.append((acct, param, getattr(acct, param)))
-        preval = getattr(acct, param)
-        self.journal.append(lambda: setattr(acct, param, preval))
+        self.journal.append(
+            (JOURNAL_SETATTR, acct, param, getattr(acct, param)))
         setattr(acct, param, val)
 
     def set_balance(self, address, value):
@@ -253,27 +303,26 @@ class State():
         acct = self.get_and_cache_account(utils.normalize_address(address))
         preval = acct.get_storage_data(key)
         acct.set_storage_data(key, value)
-        self.journal.append(lambda: acct.set_storage_data(key, preval))
+        self.journal.append((JOURNAL_STORAGE, acct, key, preval))
         self.set_and_journal(acct, 'touched', True)
 
     def add_suicide(self, address):
         self.suicides.append(address)
-        self.journal.append(lambda: self.suicides.pop())
+        self.journal.append((JOURNAL_POP, 'suicides'))
 
     def add_log(self, log):
         for listener in self.log_listeners:
             listener(log)
         self.logs.append(log)
-        self.journal.append(lambda: self.logs.pop())
+        self.journal.append((JOURNAL_POP, 'logs'))
 
     def add_receipt(self, receipt):
         self.receipts.append(receipt)
-        self.journal.append(lambda: self.receipts.pop())
+        self.journal.append((JOURNAL_POP, 'receipts'))
 
     def add_refund(self, value):
-        preval = self.refunds
+        self.journal.append((JOURNAL_SETATTR, self, 'refunds', self.refunds))
         self.refunds += value
-        self.journal.append(lambda: setattr(self.refunds, preval))
 
     def snapshot(self):
         return (self.trie.root_hash, len(self.journal), {
@@ -283,12 +332,19 @@ class State():
         h, L, auxvars = snapshot
         # Compatibility with weird geth+parity bug
         three_touched = self.cache[THREE].touched if THREE in self.cache else False
-        while len(self.journal) > L:
-            try:
-                lastitem = self.journal.pop()
-                lastitem()
-            except Exception as e:
-                print(e)
+        entries = self.journal[L:]
+        del self.journal[L:]
+        self.journal_reverted += len(entries)
+        for entry in reversed(entries):
+            if entry[0] == JOURNAL_SETATTR:
+                setattr(entry[1], entry[2], entry[3])
+            elif entry[0] == JOURNAL_STORAGE:
+                entry[1].set_storage_data(entry[2], entry[3])
+            else:
+                # the list may have been replaced since, e.g. logs per tx
+                items = getattr(self, entry[1])
+                if items:
+                    items.pop()
         if h != self.trie.root_hash:
             assert L == 0
             self.trie.root_hash = h
@@ -299,51 +355,60 @@ class State():
             self.delta_balance(THREE, 0)
 
     def set_param(self, k, v):
-        preval = getattr(self, k)
-        self.journal.append(lambda: setattr(self, k, preval))
+        self.journal.append((JOURNAL_SETATTR, self, k, getattr(self, k)))
         setattr(self, k, v)
 
+    # Fork checks, resolved once per block number
+    @property
+    def fork_rules(self):
+        rules = self.fork_rules_cache
+        if rules is None or rules.block_number != self.block_number or \
+                rules.config is not self.config:
+            rules = self.fork_rules_cache = \
+                ForkRules(self.config, self.block_number)
+        return rules
+
     def is_SERENITY(self, at_fork_height=False):
         if at_fork_height:
             return self.block_number == self.config['SERENITY_FORK_BLKNUM']
         else:
-            return self.block_number >= self.config['SERENITY_FORK_BLKNUM']
+            return self.fork_rules.serenity
 
     def is_HOMESTEAD(self, at_fork_height=False):
         if at_fork_height:
             return self.block_number == self.config['HOMESTEAD_FORK_BLKNUM']
         else:
-            return self.block_number >= self.config['HOMESTEAD_FORK_BLKNUM']
+            return self.fork_rules.homestead
 
     def is_METROPOLIS(self, at_fork_height=False):
         if at_fork_height:
             return self.block_number == self.config['METROPOLIS_FORK_BLKNUM']
         else:
-            return self.block_number >= self.config['METROPOLIS_FORK_BLKNUM']
+            return self.fork_rules.metropolis
 
     def is_CONSTANTINOPLE(self, at_fork_height=False):
         if at_fork_height:
             return self.block_number == self.config['CONSTANTINOPLE_FORK_BLKNUM']
         else:
-            return self.block_number >= self.config['CONSTANTINOPLE_FORK_BLKNUM']
+            return self.fork_rules.constantinople
 
     def is_ANTI_DOS(self, at_fork_height=False):
         if at_fork_height:
             return self.block_number == self.config['ANTI_DOS_FORK_BLKNUM']
         else:
-            return self.block_number >= self.config['ANTI_DOS_FORK_BLKNUM']
+            return self.fork_rules.anti_dos
 
     def is_SPURIOUS_DRAGON(self, at_fork_height=False):
         if at_fork_height:
             return self.block_number == self.config['SPURIOUS_DRAGON_FORK_BLKNUM']
         else:
-            return self.block_number >= self.config['SPURIOUS_DRAGON_FORK_BLKNUM']
+            return self.fork_rules.spurious_dragon
 
     def is_DAO(self, at_fork_height=False):
         if at_fork_height:
             return self.block_number == self.config['DAO_FORK_BLKNUM']
         else:
-            return self.block_number >= self.config['DAO_FORK_BLKNUM']
+            return self.fork_rules.dao
 
     def account_exists(self, address):
         if self.is_SPURIOUS_DRAGON():
@@ -372,6 +437,14 @@ class State():
             utils.normalize_address(address)).to_dict()
 
     def commit(self, allow_empties=False):
+        if self.parent_cache is not None:
+            # Once the trie moves on, reads can no longer be served from
+            # the parent, so take over its pending accounts first
+            for addr in list(self.parent_cache):
+                self.get_and_cache_account(addr)
+            self.parent_cache = None
+            self.account_rlp_cache = None
+        updates = {}
         for addr, acct in self.cache.items():
             if acct.touched or acct.deleted:
                 acct.commit()
@@ -379,17 +452,10 @@ class State():
                 self.changed[addr] = True
                 if self.account_exists(addr) or allow_empties:
                     _acct = _Account(acct.nonce, acct.balance, acct.storage, acct.code_hash)
-                    self.trie.update(addr, rlp.encode(_acct))
-
-                    if self.executing_on_head:
-                        self.db.put(b'address:' + addr, rlp.encode(_acct))
+                    updates[addr] = rlp.encode(_acct)
                 else:
                     self.trie.delete(addr)
-                    if self.executing_on_head:
-                        try:
-                            self.db.delete(b'address:' + addr)
-                        except KeyError:
-                            pass
+        self.trie.update_many(updates)
         self.deletes.extend(self.trie.deletes)
         self.trie.deletes = []
         self.cache = {}
@@ -420,15 +486,11 @@ class State():
 
     def reset_storage(self, address):
         acct = self.get_and_cache_account(address)
-        pre_cache = acct.storage_cache
-        acct.storage_cache = {}
-        self.journal.append(lambda: setattr(acct, 'storage_cache', pre_cache))
-        pre_root = acct.storage_trie.root_hash
         self.journal.append(
-            lambda: setattr(
-                acct.storage_trie,
-                'root_hash',
-                pre_root))
+            (JOURNAL_SETATTR, acct, 'storage_cache', acct.storage_cache))
+        acct.storage_cache = {}
+        self.journal.append((JOURNAL_SETATTR, acct.storage_trie,
+                             'root_hash', acct.storage_trie.root_hash))
         acct.storage_trie.root_hash = BLANK_ROOT
 
     # Creates a snapshot from a state
@@ -516,6 +578,38 @@ class State():
         state.changed = {}
         return state
 
+    def fork(self):
+        """Creates a throwaway child state for eth_call-style execution.
+
+        The child starts from this state's trie root on an OverlayDB, copies
+        accounts from this state's cache the first time it touches them and
+        shares decoded account reads with the other forks of the same root,
+        so creating it does not depend on the size of the state. Nothing
+        done on the child is visible here. This state must not be modified
+        while the fork is in use. A fork of an uncommitted fork sees the
+        pending accounts of both.
+        """
+        root = self.trie.root_hash
+        if self.fork_root != root:
+            self.fork_root = root
+            self.fork_reads = {}
+        s = State(root, Env(OverlayDB(self.db), self.config,
+                            self.env.global_config))
+        for param in STATE_DEFAULTS:
+            v = getattr(self, param)
+            if param not in ('prev_headers', 'recent_uncles'):
+                v = copy.copy(v)
+            setattr(s, param, v)
+        if self.parent_cache is not None:
+            # this is itself a fork, whose trie root is its parent's, so the
+            # accounts pending in its parent have to be passed on too
+            s.parent_cache = dict(self.parent_cache)
+            s.parent_cache.update(self.cache)
+        else:
+            s.parent_cache = self.cache
+        s.account_rlp_cache = self.fork_reads
+        return s
+
     def ephemeral_clone(self):
         snapshot = self.to_snapshot(root_only=True, no_prevblocks=True)
         env2 = Env(OverlayDB(self.env.db), self.env.config)
@@ -9,7 +9,8 @@ from ethereum.utils import decode_hex, encode_hex
 import ethereum.pow.ethpow as ethpow
 import ethereum.utils as utils
 from ethereum.pow.chain import Chain
-from ethereum.db import EphemDB
+from ethereum.db import EphemDB, SQLiteDB
+from ethereum.config import Env, default_config
 from ethereum.tests.utils import new_db
 from ethereum.state import State
 from ethereum.block import Block
@@ -128,6 +129,87 @@ def test_failing_transfer(db):
     assert chain.state.get_balance(v2) == b_v2
 
 
+def test_journal_revert(db):
+    k, v, k2, v2 = accounts()
+    chain = Chain({v: {"balance": utils.denoms.ether * 1}}, difficulty=1)
+    state = chain.state
+    b_v = state.get_balance(v)
+    outer = state.snapshot()
+    state.set_storage_data(v2, 1, 5)
+    state.add_refund(10)
+    inner = state.snapshot()
+    assert state.transfer_value(v, v2, 42)
+    state.set_storage_data(v2, 1, 6)
+    state.add_log('log')
+    state.add_refund(10)
+    state.revert(inner)
+    assert state.get_balance(v) == b_v
+    assert state.get_storage_data(v2, 1) == 5
+    assert state.refunds == 10
+    assert state.logs == []
+    state.revert(outer)
+    assert state.get_storage_data(v2, 1) == 0
+    assert state.refunds == 0
+    assert len(state.journal) == outer[1]
+    assert state.journal_reverted > 0
+
+
+def test_state_fork(db):
+    k, v, k2, v2 = accounts()
+    chain = Chain({v: {"balance": utils.denoms.ether * 1}}, difficulty=1)
+    state = chain.state
+    b_v = state.get_balance(v)
+    # uncommitted changes in the parent are visible to the fork
+    state.set_storage_data(v2, 1, 5)
+    fork = state.fork()
+    assert fork.get_storage_data(v2, 1) == 5
+    assert fork.get_balance(v) == b_v
+    assert fork.transfer_value(v, v2, 42)
+    fork.set_storage_data(v2, 1, 6)
+    fork.set_code(v2, b'\x60\x00')
+    fork.commit()
+    assert fork.get_balance(v) == b_v - 42
+    assert fork.get_storage_data(v2, 1) == 6
+    assert fork.trie.root_hash != state.trie.root_hash
+    assert state.get_balance(v) == b_v
+    assert state.get_storage_data(v2, 1) == 5
+    assert state.get_code(v2) == b''
+    # forks of the same root share account reads
+    other = b'\x01' * 20
+    fork2 = state.fork()
+    assert fork2.account_rlp_cache is state.fork_reads
+    assert fork2.get_balance(other) == 0
+    assert other in state.fork_reads
+    assert other not in state.cache
+    state.commit()
+    assert state.fork().get_storage_data(v2, 1) == 5
+
+
+def test_nested_state_fork(db):
+    k, v, k2, v2 = accounts()
+    chain = Chain({v: {"balance": utils.denoms.ether * 1}}, difficulty=1)
+    state = chain.state
+    b_v = state.get_balance(v)
+    other = b'\x01' * 20
+    state.set_storage_data(v2, 1, 5)
+    state.set_storage_data(other, 1, 7)
+    fork = state.fork()
+    assert fork.transfer_value(v, v2, 42)
+    nested = fork.fork()
+    # pending changes of both the fork and its parent are visible, also
+    # for accounts the fork did not touch
+    assert other not in fork.cache
+    assert nested.get_storage_data(other, 1) == 7
+    assert nested.get_storage_data(v2, 1) == 5
+    assert nested.get_balance(v) == b_v - 42
+    nested.set_storage_data(v2, 1, 6)
+    nested.commit()
+    assert nested.get_storage_data(v2, 1) == 6
+    assert fork.get_storage_data(v2, 1) == 5
+    assert state.get_storage_data(v2, 1) == 5
+    assert state.get_balance(v) == b_v
+
+
 def test_mine_block(db):
     k, v, k2, v2 = accounts()
     chain = Chain({v: {"balance": utils.denoms.ether * 1}}, difficulty=1)
@@ -211,6 +293,68 @@ def test_transaction_serialization():
     assert tx in set([tx])
 
 
+def test_recover_senders():
+    keys = [utils.sha3(str(i).encode()) for i in range(20)]
+    txs = [rlp.decode(rlp.encode(transactions.Transaction(
+        0, 1, 21000, b'\x35' * 20, 0, b'').sign(k)), transactions.Transaction)
+        for k in keys]
+    bad = rlp.decode(rlp.encode(txs[0].copy(s=0)), transactions.Transaction)
+    txs.append(bad)
+    assert not any(tx._sender for tx in txs)
+    transactions.recover_senders(txs, processes=2)
+    for k, tx in zip(keys, txs):
+        assert tx._sender == utils.privtoaddr(k)
+    assert bad._sender is None
+    with pytest.raises(transactions.InvalidTransaction):
+        bad.sender
+    q = TransactionQueue()
+    q.add_transactions(txs[:5])
+    assert len(q) == 5
+    transactions.close_recovery_pools()
+    assert not transactions._recovery_pools
+    # recovery is serial unless asked for
+    q.add_transactions([rlp.decode(rlp.encode(tx), transactions.Transaction)
+                        for tx in txs])
+    assert len(q) == 26 and not transactions._recovery_pools
+    assert default_config['SENDER_RECOVERY_PROCESSES'] == 1
+
+
+def test_vmext_reuse(db):
+    keys = [utils.sha3(str(i).encode()) for i in range(2)]
+    target = b'\x10' * 20
+    state = State(env=Env(db))
+    state.gas_limit = 10**6
+    # ORIGIN PUSH1 0 SSTORE
+    state.set_code(target, decode_hex('32600055'))
+    for k in keys:
+        state.set_balance(utils.privtoaddr(k), utils.denoms.ether)
+    ext = messages.VMExt(state, None)
+    for k in keys:
+        tx = transactions.Transaction(0, 1, 50000, target, 0, b'').sign(k)
+        assert messages.apply_transaction(state, tx, ext=ext)[0]
+        assert ext.tx_origin == utils.privtoaddr(k)
+        assert state.get_storage_data(target, 0) == \
+            utils.big_endian_to_int(utils.privtoaddr(k))
+
+
+def test_fork_rules(db):
+    from ethereum import config
+    env = Env(db, dict(config.default_config))
+    state = State(env=env)
+    for number in (0, 1150000, 1919999, 1920000, 2463000, 2675000, 4370000,
+                   2**99):
+        state.block_number = number
+        rules = state.fork_rules
+        assert rules is state.fork_rules
+        for fork in config.FORKS:
+            assert getattr(rules, fork) == \
+                (number >= env.config[fork.upper() + '_FORK_BLKNUM'])
+        assert rules.homestead == state.is_HOMESTEAD()
+        assert rules.spurious_dragon == state.is_SPURIOUS_DRAGON()
+    with pytest.raises(AttributeError):
+        rules.homestead = False
+
+
 def test_invalid_transaction(db):
     k, v, k2, v2 = accounts()
     chain = Chain({v2: {"balance": utils.denoms.ether * 1}}, difficulty=1)
@@ -363,6 +507,27 @@ def test_reward_uncles(db):
         uncle_coinbase) == chain.env.config['BLOCK_REWARD'] * 7 // 8
 
 
+def test_account_index_reorg(db):
+    chain = Chain({}, difficulty=1)
+    blk0 = mine_on_chain(chain, coinbase=decode_hex('0' * 40))
+    old_coinbase = decode_hex('1' * 40)
+    new_coinbase = decode_hex('2' * 40)
+    mine_on_chain(chain, blk0, coinbase=old_coinbase)
+    assert chain.db.get(b'address:' + old_coinbase) == \
+        chain.state.trie.get(old_coinbase)
+    assert chain.state.get_balance(old_coinbase) == \
+        chain.env.config['BLOCK_REWARD']
+    # Reorg away the block paying old_coinbase
+    blk1 = mine_on_chain(chain, blk0, coinbase=new_coinbase)
+    blk2 = mine_on_chain(chain, blk1, coinbase=new_coinbase)
+    assert chain.head == blk2
+    for addr in (old_coinbase, new_coinbase):
+        assert chain.db.get(b'address:' + addr) == chain.state.trie.get(addr)
+    # old_coinbase now only gets the uncle reward
+    assert chain.state.get_balance(old_coinbase) == \
+        chain.env.config['BLOCK_REWARD'] * 7 // 8
+
+
 def test_genesis_from_state_snapshot():
     """
     Test if Chain could be initilaized from State snapshot
@@ -431,11 +596,157 @@ def test_get_blockhash_by_number():
 
     test_chain.chain.get_blockhash_by_number(2) == test_chain.chain.head.hash
 
+def test_block_cache():
+    test_chain = tester.Chain()
+    test_chain.mine(5)
+    chain = test_chain.chain
+    head = chain.head
+    assert chain.head is head
+    assert chain.get_block(head.hash) is head
+    header = head.header
+    assert header.hash is header.hash
+    assert header.hash == utils.sha3(rlp.encode(header))
+    assert rlp.decode(rlp.encode(head), Block).header.mining_hash == \
+        header.mining_hash
+    chain.block_cache_size = 2
+    chain.block_cache.clear()
+    for i in range(1, 6):
+        assert chain.get_block_by_number(i).number == i
+    assert list(chain.block_cache) == [chain.get_blockhash_by_number(4),
+                                       chain.get_blockhash_by_number(5)]
+    state = chain.mk_poststate_of_blockhash(head.hash)
+    assert [h.number for h in state.prev_headers[:6]] == [5, 4, 3, 2, 1, 0]
+    assert len(chain.block_cache) == 2
+
+
+def test_header_only_ancestors():
+    test_chain = tester.Chain()
+    test_chain.mine(5)
+    chain = test_chain.chain
+    head = chain.head
+    assert chain.db.get(b'header:' + head.hash)
+    chain.block_cache.clear()
+    chain.header_cache.clear()
+    state = chain.mk_poststate_of_blockhash(head.hash)
+    assert [h.number for h in state.prev_headers[:6]] == [5, 4, 3, 2, 1, 0]
+    # only the block itself is decoded in full
+    assert list(chain.block_cache) == [head.hash]
+    assert len(chain.header_cache) == 4
+    assert chain.get_header(chain.genesis.hash) == chain.genesis.header
+    assert chain.get_blockhashes_from_hash(head.hash, 10) == \
+        [chain.get_blockhash_by_number(i) for i in range(4, -1, -1)]
+    # blocks stored without a header entry are still walked
+    chain.db.delete(b'header:' + head.header.prevhash)
+    chain.header_cache.clear()
+    assert chain.mk_poststate_of_blockhash(head.hash).prev_headers[1] == \
+        chain.get_block_by_number(4).header
+
+
+@pytest.mark.parametrize('processes', [1, 2])
+def test_import_blocks(processes):
+    k, v, k2, v2 = accounts()
+    alloc = {v: {"balance": utils.denoms.ether * 1}}
+    chain = Chain(alloc, difficulty=1)
+    blocks = [mine_next_block(chain, transactions=[get_transaction(nonce=i)])
+              for i in range(3)]
+    bad_seal = blocks[1].copy(header=blocks[1].header.copy(nonce=b'\xff' * 8))
+    bad_txs = blocks[1].copy(transactions=[])
+    chain2 = Chain(alloc, difficulty=1)
+    stats = chain2.import_blocks(
+        [rlp.encode(blocks[0]), bad_seal, b'\xc0', bad_txs] + blocks[1:],
+        processes=processes, batch_size=2)
+    assert stats['blocks'] == 3 and stats['rejected'] == 3
+    assert stats['gas'] == sum(b.header.gas_used for b in blocks)
+    assert chain2.head_hash == chain.head_hash
+    assert chain2.state.trie.root_hash == chain.state.trie.root_hash
+    assert chain2.get_tx_position(blocks[2].transactions[0]) == (3, 0)
+    assert chain2.autocommit
+
+
+def test_score_index(db):
+    from ethereum.pow.chain import header_entry
+    chain = Chain({}, difficulty=1)
+    blocks = [mine_next_block(chain) for i in range(3)]
+    for i, blk in enumerate(blocks):
+        entry = rlp.decode(chain.db.get(b'header:' + blk.hash), header_entry)
+        assert entry[2] == i + 1
+    walked = []
+    get_parent = chain.get_parent
+    chain.get_parent = lambda blk: walked.append(blk) or get_parent(blk)
+    chain.header_cache.clear()
+    side = mine_on_chain(chain, parent=blocks[0], coinbase=b'\x01' * 20)
+    side = mine_on_chain(chain, parent=side, coinbase=b'\x01' * 20)
+    assert walked == [] and chain.head_hash == blocks[2].hash
+    assert chain.get_score(side) == 3
+    side = mine_on_chain(chain, parent=side, coinbase=b'\x01' * 20)
+    assert chain.head_hash == side.hash
+    assert chain.get_score(chain.head) == 4
+    # blocks saved with no score in their header entry
+    chain.db.delete(b'header:' + side.hash)
+    chain.db.delete(b'header:' + side.prevhash)
+    chain.header_cache.clear()
+    assert chain.get_score(side) == 4
+    for blockhash, score in ((side.hash, 4), (side.prevhash, 3)):
+        entry = rlp.decode(chain.db.get(b'header:' + blockhash), header_entry)
+        assert entry[2] == score
+        assert b'score:' + blockhash not in chain.db
+    # scores written separately by older versions are still read
+    chain.db.delete(b'header:' + side.hash)
+    chain.header_cache.clear()
+    chain.db.put(b'score:' + side.hash, b'5')
+    assert chain.lookup_score(side.hash) == 5
+
+
+def test_reorg_indices():
+    k, v, k2, v2 = accounts()
+    chain = Chain({v: {"balance": utils.denoms.ether * 1}}, difficulty=1)
+    base = mine_next_block(chain, transactions=[get_transaction(nonce=0)])
+    old = [mine_next_block(chain) for i in range(2)]
+    tx = get_transaction(nonce=1)
+    side = mine_on_chain(chain, parent=base, transactions=[tx],
+                         coinbase=b'\x01' * 20)
+    side = mine_on_chain(chain, parent=side, coinbase=b'\x01' * 20)
+    assert chain.head_hash == old[1].hash and not chain.reorgs
+    side = mine_on_chain(chain, parent=side, coinbase=b'\x01' * 20)
+    assert chain.head_hash == side.hash
+    metrics = chain.reorgs[-1]
+    assert (metrics['fork_number'], metrics['depth'], metrics['length']) == \
+        (1, 2, 3)
+    assert metrics['old_head'] == old[1].hash
+    assert chain.get_blockhash_by_number(4) == side.hash
+    assert chain.get_blockhash_by_number(3) == side.prevhash
+    assert chain.get_tx_position(tx) == (2, 0)
+    # the sender only changed in a block behind the new head
+    assert chain.db.get(b'address:' + v) == chain.state.trie.get(v)
+    assert chain.state.get_balance(v) == \
+        utils.denoms.ether * 1 - 2 * tx.value
+
+
 def test_sign_with_network_id():
     tx = get_transaction(network_id=66)
     assert tx.network_id == 66
 
 
+def test_persistent_chain(tmpdir):
+    k, v, k2, v2 = accounts()
+    path = str(tmpdir.join('chain.db'))
+    chain = Chain({v: {"balance": utils.denoms.ether * 1}},
+                  env=Env(SQLiteDB(path)), difficulty=1)
+    tx = get_transaction()
+    blk2 = mine_next_block(chain, transactions=[tx])
+    blk3 = mine_next_block(chain)
+    balance = chain.state.get_balance(v)
+    chain.db.close()
+
+    chain = Chain(env=Env(SQLiteDB(path)))
+    assert chain.head == blk3
+    assert chain.get_block_by_number(1) == blk2
+    assert chain.state.get_balance(v) == balance
+    assert chain.get_tx_position(tx.hash) == (blk2.number, 0)
+    blk4 = mine_next_block(chain)
+    assert chain.head == blk4
+
+
 # TODO ##########################################
 #
 # test for remote block with invalid transaction
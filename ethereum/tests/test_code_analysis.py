@@ -0,0 +1,42 @@
+from ethereum import vm
+from ethereum.code_analysis import CodeAnalysisCache
+from ethereum.db import EphemDB
+from ethereum.utils import sha3
+
+
+def test_bounded_by_bytes():
+    cache = CodeAnalysisCache(b'test', len, max_bytes=100)
+    for i in range(10):
+        assert cache.get(bytes(bytearray([i])) * 30) == 30
+    assert cache.size == 90
+    assert cache.stats()['evictions'] == 7
+    # the most recently used entries survive
+    assert cache.get(b'\x09' * 30) == 30
+    assert cache.hits == 1 and cache.misses == 10
+    cache.get(b'\x00' * 200)
+    assert cache.size == 90
+
+
+def test_keyed_by_code_hash():
+    calls = []
+    cache = CodeAnalysisCache(b'test', lambda code: calls.append(code) or 1)
+    cache.get(b'\x60\x00', b'h' * 32)
+    cache.get(b'\x60\x00', b'h' * 32)
+    cache.get(b'\x60\x00')
+    cache.get(b'\x60\x00', sha3(b'\x60\x00'))
+    assert len(calls) == 2
+
+
+def test_persisted_analysis():
+    db = EphemDB()
+    code = b'\x5b\x7f' + b'\x5b' * 32 + b'\x60\x00\x5b'
+    cache = CodeAnalysisCache(b'vm', vm.preprocess_code,
+                              encode=vm.encode_analysis,
+                              decode=vm.decode_analysis)
+    expected = cache.get(code, db=db)
+    restarted = CodeAnalysisCache(b'vm', None,
+                                  encode=vm.encode_analysis,
+                                  decode=vm.decode_analysis)
+    assert restarted.get(code, db=db) == expected
+    assert restarted.db_hits == 1
+    assert expected[1] == {1: int('5b' * 32, 16), 34: 0}
@@ -1,7 +1,7 @@
 import itertools
 import random
 import pytest
-from ethereum.db import _EphemDB
+from ethereum.db import _EphemDB, SQLiteDB
 from ethereum.utils import ascii_chr
 
 random.seed(0)
@@ -35,3 +35,46 @@ def test_ephem():
         assert key not in db
         with pytest.raises(KeyError):
             db.get(key)
+
+
+def test_sqlite(tmpdir):
+    db = SQLiteDB(str(tmpdir.join('test.db')))
+    for key in content:
+        assert key not in db
+        with pytest.raises(KeyError):
+            db.get(key)
+    for key, value in content.items():
+        db.put(key, value)
+        assert key in db
+        assert db.get(key) == value
+    db.commit()
+    for key in content:
+        db.put(key, alt_content[key])
+        assert key in db
+        assert db.get(key) == alt_content[key]
+    db.commit()
+    for key, value in content.items():
+        db.delete(key)
+        assert key not in db
+        with pytest.raises(KeyError):
+            db.get(key)
+    db.commit()
+    for key in content:
+        assert key not in db
+
+
+def test_sqlite_persistence(tmpdir):
+    path = str(tmpdir.join('test.db'))
+    db = SQLiteDB(path)
+    for key, value in content.items():
+        db.put(key, value)
+    db.commit()
+    for key in content:
+        db.put(key, alt_content[key])
+    db.close()
+    # Only committed writes survive a reopen
+    db = SQLiteDB(path)
+    for key, value in content.items():
+        assert db.get(key) == value
+    db.put(b'score:', '0')
+    assert db.get(b'score:') == b'0'
@@ -21,3 +21,127 @@ def test_eip150_opcode_gascost():
     assert opcode_gas['CALLCODE'] + opcodes.CALL_SUPPLEMENTAL_GAS == 700
 
     assert opcode_gas['SUICIDE'] + opcodes.SUICIDE_SUPPLEMENTAL_GAS == 5000
+
+
+def test_opcode_table():
+    from ethereum import vm
+    frontier = vm.mk_opcode_table(False, False, False, False)
+    tangerine = vm.mk_opcode_table(True, True, False, False)
+    metropolis = vm.mk_opcode_table(True, True, True, True)
+    for op in opcodes.opcodesMetropolis:
+        assert frontier[op] is None and tangerine[op] is None
+        assert metropolis[op] is not None
+    assert frontier[0xef] is None and metropolis[0xef] is None
+    sload = opcodes.reverse_opcodes['SLOAD']
+    assert frontier[sload][3] == opcode_gas['SLOAD']
+    assert tangerine[sload][3] == 200
+    name, in_args, max_stack, fee, handler = metropolis[0x90]
+    assert (name, in_args, max_stack) == ('SWAP1', 2, 1024)
+    stk = [1, 2, 3]
+    handler(None, stk, None, None, None)
+    assert stk == [1, 3, 2]
+    assert metropolis[0x60][4] is None
+
+
+def test_preprocess_code_jumpdests():
+    from ethereum import vm
+    # JUMPDEST, PUSH2 0x5b5b, JUMPDEST
+    jumpdests, pushcache = vm.preprocess_code(b'\x5b\x61\x5b\x5b\x5b')
+    assert [i for i in range(5) if jumpdests[i]] == [0, 4]
+    assert pushcache == {1: 0x5b5b}
+
+
+def test_fastvm_blocks():
+    from ethereum import fastvm, vm
+    table = vm.mk_opcode_table(True, True, True, True)
+    # PUSH1 4, JUMP, PUSH1 0x5b, JUMPDEST, PC, STOP
+    blocks, jumpdests = fastvm.preprocess_code(
+        b'\x60\x04\x56\x60\x5b\x5b\x58\x00', table)
+    assert sorted(blocks) == [0, 3, 5, 7]
+    ops, minstack, maxstack, gascost, nextpos = blocks[0]
+    assert (minstack, maxstack, gascost, nextpos) == (0, 1023, 11, 3)
+    assert [i for i in range(8) if jumpdests[i]] == [5]
+    fused, jumpdests = fastvm.preprocess_code(
+        b'\x60\x04\x56\x60\x5b\x5b\x58\x00', table, fuse=True)
+    assert len(fused[0][0]) == 1 and fused[0][1:] == blocks[0][1:]
+
+
+def test_fastvm_ngram_stats():
+    from ethereum import config, db, fastvm, vm
+    from ethereum.config import Env
+    from ethereum.messages import VMExt, apply_msg
+    from ethereum.state import State
+    from ethereum.utils import decode_hex
+    cfg = dict(config.config_metropolis)
+    cfg['VM_ENGINE'] = 'fastvm'
+    state = State(env=Env(db.EphemDB(), cfg))
+    state.set_code(b'\x10' * 20, decode_hex(
+        '60035b80156013576001900380905060025600' + '5b600051600055'))
+    fastvm.ngram_stats = fastvm.NgramStats()
+    try:
+        msg = vm.Message(b'\x33' * 20, b'\x10' * 20, 0, 100000, b'')
+        assert apply_msg(VMExt(state, None), msg)[0] == 1
+        stats = fastvm.ngram_stats
+    finally:
+        fastvm.ngram_stats = None
+    # the loop body runs three times and the exit test four times
+    assert stats.ngrams(2)[('PUSH1', 'JUMPI')] == 4
+    assert stats.ngrams(3)[('DUP1', 'SWAP1', 'POP')] == 3
+    assert stats.most_common(2, 1)[0][1] == 4
+
+
+def test_fastvm_matches_vm():
+    from ethereum import config, db, vm
+    from ethereum.config import Env
+    from ethereum.messages import VMExt, apply_msg
+    from ethereum.state import State
+    from ethereum.utils import decode_hex
+    programs = [
+        # jump into pushdata
+        '600456605b5b600160005500',
+        # PC, GAS and a LOG leaving the gas negative
+        '586000556000600060006000a15a6001555a60025500',
+        # RETURNDATASIZE before and after Metropolis
+        '3d600055',
+        # stack underflow in the middle of a block
+        '6001600155016000600255',
+        # out of gas in the middle of a block
+        '6001600155' + '6000' * 2000,
+        # countdown loop made of fusable sequences
+        '60035b80156013576001900380905060025600' + '5b600051600055',
+        # fused jumps to bad destinations
+        '600556', '6001600557',
+    ]
+    target = b'\x10' * 20
+    for fork in ('config_homestead', 'config_metropolis'):
+        for code in programs:
+            results = []
+            for engine in ('vm', 'fastvm', 'fastvm_fused'):
+                cfg = dict(getattr(config, fork))
+                cfg['VM_ENGINE'] = engine
+                state = State(env=Env(db.EphemDB(), cfg))
+                state.set_code(target, decode_hex(code))
+                msg = vm.Message(b'\x33' * 20, target, 0, 3000, b'')
+                res = apply_msg(VMExt(state, None), msg)
+                state.commit()
+                results.append((res, state.trie.root_hash))
+            assert results[0] == results[1] == results[2], code
+
+
+def test_calldata_copy_padding():
+    from ethereum import vm
+    parent = bytearray(b'\x00\x01\x02\x03\x04')
+    cd = vm.CallData(parent, 2, 5)
+    assert cd.extract_all() == b'\x02\x03\x04\x00\x00'
+    assert cd.extract32(1) == 0x0304 << 240
+    mem = bytearray(b'\xff' * 8)
+    cd.extract_copy(mem, 1, 1, 6)
+    assert mem == bytearray(b'\xff\x03\x04\x00\x00\x00\x00\xff')
+    cd.extract_copy(mem, 0, 2 ** 255, 2)
+    assert mem[:2] == bytearray(2)
+    assert vm.CallData([1, 2]).extract_all() == b'\x01\x02'
+    big = b'\x07' * 100000
+    mem = bytearray(100000)
+    vm.Message(b'\x00' * 20, b'\x00' * 20, data=big).data.extract_copy(
+        mem, 0, 0, 100000)
+    assert bytes(mem) == big
@@ -0,0 +1,101 @@
+from ethereum import config, db, vm
+from ethereum.config import Env
+from ethereum.messages import VMExt, apply_msg
+from ethereum.state import State
+from ethereum.tracers import StructLogTracer, CallTracer, ProfileTracer
+from ethereum.utils import decode_hex
+
+SENDER = b'\x33' * 20
+A = b'\x10' * 20
+B = b'\x20' * 20
+# CALL(0xffff, B, 0, 0, 0, 0, 0), STOP
+CODE_A = decode_hex('60006000600060006000' + '73' + '20' * 20 + '61fffff100')
+# SSTORE(1, 42), SLOAD(1), STOP
+CODE_B = decode_hex('602a6001556001545000')
+
+
+def run(tracer, engine='vm', data=b''):
+    cfg = dict(config.config_metropolis)
+    cfg['VM_ENGINE'] = engine
+    state = State(env=Env(db.EphemDB(), cfg))
+    state.set_code(A, CODE_A)
+    state.set_code(B, CODE_B)
+    msg = vm.Message(SENDER, A, 0, 100000, data)
+    return apply_msg(VMExt(state, None, tracer), msg)
+
+
+def test_struct_logs():
+    tracer = StructLogTracer(memory=True)
+    assert run(tracer)[0] == 1
+    ops = [(log['depth'], log['op']) for log in tracer.logs]
+    assert ops[5:8] == [(1, 'PUSH20'), (1, 'PUSH2'), (1, 'CALL')]
+    assert ops[8:] == [(2, 'PUSH1'), (2, 'PUSH1'), (2, 'SSTORE'),
+                       (2, 'PUSH1'), (2, 'SLOAD'), (2, 'POP'), (2, 'STOP'),
+                       (1, 'STOP')]
+    sstore, sload = tracer.logs[10], tracer.logs[12]
+    assert sstore['stack'] == [42, 1] and sstore['gasCost'] == 20000
+    assert sload['storage'] == {1: 42} and sload['gasCost'] == 200
+    assert tracer.logs[0]['gasCost'] == 3 and tracer.logs[0]['memory'] == b''
+    engine_logs = StructLogTracer(memory=True)
+    run(engine_logs, 'fastvm')
+    assert engine_logs.logs == tracer.logs
+
+
+def test_call_tree():
+    tracer = CallTracer()
+    run(tracer, data=b'\x12\x34\x56\x78\x00')
+    root = tracer.root
+    assert (root['type'], root['to'], root['input']) == \
+        ('CALL', A, b'\x12\x34\x56\x78\x00')
+    assert len(root['calls']) == 1
+    child = root['calls'][0]
+    assert (child['from'], child['to'], child['gas']) == (A, B, 0xffff)
+    assert child['gasUsed'] == 20000 + 200 + 3 * 3 + 2
+    assert root['gasUsed'] > child['gasUsed'] and 'error' not in root
+
+
+def test_profile():
+    tracer = ProfileTracer()
+    run(tracer, data=b'\x12\x34\x56\x78\x00')
+    assert tracer.op_counts['PUSH1'] == 8
+    assert tracer.op_gas['SSTORE'] == 20000
+    assert tracer.calls[(A, b'\x12\x34\x56\x78')] == 1
+    assert tracer.calls[(B, b'')] == 1
+    assert tracer.call_gas[(B, b'')] == 20000 + 200 + 3 * 3 + 2
+
+
+def test_profile_by_code():
+    from ethereum.utils import sha3
+    tracer = ProfileTracer()
+    run(tracer)
+    # the CALL step itself only pays its own fee, B's steps go to B
+    assert tracer.op_gas['CALL'] == 700
+    assert tracer.code_gas[sha3(CODE_B)] == 20000 + 200 + 3 * 3 + 2
+    assert tracer.code_calls[sha3(CODE_A)] == 1
+    assert sum(tracer.op_time.values()) > 0
+    report = tracer.report(3).split('\n')
+    assert report[0].split() == ['opcode', 'count', 'gas', 'ms']
+    assert len(report) == 1 + 3 + 1 + 1 + 2
+
+
+def test_profile_precompiles():
+    from ethereum.utils import sha3
+    special = b'\x00' * 19 + b'\x42'
+
+    def proc_custom(ext, msg):
+        return 1, msg.gas - 10, []
+    cfg = dict(config.config_metropolis)
+    cfg['CUSTOM_SPECIALS'] = [(special, proc_custom)]
+    state = State(env=Env(db.EphemDB(), cfg))
+    # CALL(0xffff, 0x04, 0, 0, 0, 0, 0), CALL(0xffff, 0x42, ...), STOP
+    state.set_code(A, decode_hex(
+        '6000' * 5 + '6004' + '61ffff' + 'f1' +
+        '6000' * 5 + '6042' + '61ffff' + 'f1' + '00'))
+    tracer = ProfileTracer()
+    msg = vm.Message(SENDER, A, 0, 100000, b'')
+    assert apply_msg(VMExt(state, None, tracer), msg)[0] == 1
+    identity = b'\x00' * 19 + b'\x04'
+    assert tracer.precompile_calls == {identity: 1, special: 1}
+    assert tracer.precompile_gas[special] == 10
+    assert sha3(b'') not in tracer.code_calls
+    assert list(tracer.code_calls.values()) == [1]
@@ -0,0 +1,65 @@
+import random
+from ethereum import trie
+from ethereum.db import EphemDB
+from ethereum.securetrie import SecureTrie
+from ethereum.utils import sha3
+
+
+def test_update_many():
+    rand = random.Random(0)
+    keys = [sha3(str(i).encode())[:rand.choice([0, 1, 2, 32])]
+            for i in range(200)]
+    for deferred in (False, True):
+        t1 = trie.Trie(EphemDB(), deferred=deferred)
+        t2 = trie.Trie(EphemDB(), deferred=deferred)
+        for n in (1, 2, 10, 100):
+            batch = {}
+            for i in range(n):
+                batch[rand.choice(keys)] = rand.choice([b'x', b'y' * 40])
+            for k, v in batch.items():
+                t1.update(k, v)
+            t2.update_many(batch.items())
+            assert t1.root_hash == t2.root_hash
+            for k in rand.sample(keys, 10):
+                t1.delete(k)
+                t2.delete(k)
+        assert t1.to_dict() == t2.to_dict()
+        assert t2.get_many(keys + [b'\xff' * 3]) == \
+            [t1.get(k) for k in keys] + [b'']
+
+
+def test_secure_get_many():
+    t = SecureTrie(trie.Trie(EphemDB()))
+    t.update_many([(b'dog', b'puppy'), (b'doge', b'coin')])
+    assert t.get_many([b'doge', b'cat', b'dog']) == [b'coin', b'', b'puppy']
+    assert t.to_dict() == {b'dog': b'puppy', b'doge': b'coin'}
+
+
+def test_mk_root_hash():
+    rand = random.Random(1)
+    for n in (0, 1, 2, 3, 20, 200):
+        items = {sha3(str(i).encode())[:rand.choice([0, 1, 2, 32])]:
+                 rand.choice([b'x', b'y' * 40]) for i in range(n)}
+        t = trie.Trie(EphemDB())
+        t.update_many(items)
+        assert trie.mk_root_hash(items.items()) == t.root_hash
+
+
+def test_update_delete_shared_prefixes():
+    # short keys sharing prefixes split and collapse nodes on odd and even
+    # nibble offsets
+    rand = random.Random(2)
+    keys = [b'', b'\x01', b'\x01\x02', b'\x01\x23', b'\x12', b'\x12\x34',
+            b'\x12\x35', b'\x12\x34\x56']
+    t = trie.Trie(EphemDB())
+    items = {}
+    for i in range(200):
+        k = rand.choice(keys)
+        if rand.random() < 0.3:
+            t.delete(k)
+            items.pop(k, None)
+        else:
+            items[k] = rand.choice([b'x', b'y' * 40])
+            t.update(k, items[k])
+        assert t.root_hash == trie.mk_root_hash(items.items())
+    assert t.to_dict() == items
@@ -0,0 +1,79 @@
+import pytest
+from ethereum import trie
+from ethereum.db import EphemDB, ListeningDB, OverlayDB, RefcountDB
+from ethereum.utils import sha3
+
+
+def mk_pairs(n):
+    return [(sha3(str(i).encode()), str(i).encode() * 10) for i in range(n)]
+
+
+def test_node_cache_shared():
+    db = EphemDB()
+    t = trie.Trie(db)
+    for k, v in mk_pairs(100):
+        t.update(k, v)
+    root = t.root_hash
+    t2 = trie.Trie(RefcountDB(db), root)
+    assert t2.node_cache is t.node_cache
+    assert t.node_cache is trie.get_node_cache(db)
+    hits = t.node_cache.hits
+    for k, v in mk_pairs(100):
+        assert t2.get(k) == v
+    assert t.node_cache.hits > hits
+    assert trie.Trie(EphemDB()).node_cache is not t.node_cache
+    assert trie.Trie(ListeningDB(db), root).node_cache is None
+
+
+def test_node_cache_copy_on_write():
+    db = EphemDB()
+    t = trie.Trie(db)
+    for k, v in mk_pairs(50):
+        t.update(k, v)
+    root = t.root_hash
+    t2 = trie.Trie(db, root)
+    for k, v in mk_pairs(50)[:25]:
+        t2.update(k, b'changed')
+    for k, v in mk_pairs(50)[25:]:
+        t2.delete(k)
+    assert t2.root_hash != root
+    # Mutating t2 must not leak into nodes shared with t
+    t3 = trie.Trie(db, root)
+    assert t3.to_dict() == dict(mk_pairs(50))
+    assert t.root_hash == root
+
+
+def test_node_cache_bounded():
+    size = trie.NODE_CACHE_SIZE
+    trie.NODE_CACHE_SIZE = 16
+    try:
+        t = trie.Trie(EphemDB())
+        for k, v in mk_pairs(200):
+            t.update(k, v)
+        assert len(t.node_cache.data) <= 16
+        assert t.node_cache.evictions > 0
+        for k, v in mk_pairs(200):
+            assert t.get(k) == v
+    finally:
+        trie.NODE_CACHE_SIZE = size
+
+
+def test_overlay_node_cache():
+    db = EphemDB()
+    t = trie.Trie(db)
+    for k, v in mk_pairs(50):
+        t.update(k, v)
+    root = t.root_hash
+    overlay = OverlayDB(db)
+    t2 = trie.Trie(overlay, root)
+    assert t2.node_cache.parent is t.node_cache
+    for k, v in mk_pairs(50):
+        assert t2.get(k) == v
+    for k, v in mk_pairs(10):
+        t2.update(k, b'forked')
+    fork_root = t2.root_hash
+    assert trie.Trie(OverlayDB(db)).node_cache is not t2.node_cache
+    # nodes written only to the overlay do not resolve on the parent
+    with pytest.raises(KeyError):
+        trie.Trie(db, fork_root).get(mk_pairs(1)[0][0])
+    assert trie.Trie(overlay, fork_root).get(mk_pairs(1)[0][0]) == b'forked'
@@ -0,0 +1,56 @@
+import random
+from ethereum import trie
+from ethereum.db import EphemDB, RefcountDB
+from ethereum.utils import sha3
+
+
+def run_ops(t, seed, n=500):
+    rand = random.Random(seed)
+    keys = [sha3(str(i).encode())[:rand.choice([1, 2, 32])]
+            for i in range(100)]
+    roots = []
+    for i in range(n):
+        k = rand.choice(keys)
+        if rand.random() < 0.3:
+            t.delete(k)
+        else:
+            t.update(k, rand.choice([b'x', b'y' * 40, sha3(k)]))
+        if i % 25 == 0:
+            roots.append(t.root_hash)
+    roots.append(t.root_hash)
+    return roots
+
+
+def test_deferred_same_roots():
+    for seed in range(3):
+        eager = trie.Trie(EphemDB())
+        deferred = trie.Trie(EphemDB(), deferred=True)
+        assert run_ops(eager, seed) == run_ops(deferred, seed)
+        assert eager.to_dict() == deferred.to_dict()
+
+
+def test_deferred_commit():
+    db = EphemDB()
+    t = trie.Trie(db, deferred=True)
+    for i in range(100):
+        t.update(sha3(str(i).encode()), str(i).encode() * 10)
+    assert len(db.kv) == 0
+    assert t.get(sha3(b'5')) == b'5' * 10
+    t.commit()
+    assert len(db.kv) > 0
+    t2 = trie.Trie(db, t.root_hash)
+    for i in range(100):
+        assert t2.get(sha3(str(i).encode())) == str(i).encode() * 10
+
+
+def test_deferred_deletes_stored_nodes_only():
+    db = EphemDB()
+    t = trie.Trie(RefcountDB(db), deferred=True)
+    run_ops(t, 0)
+    t.deletes = []
+    for i in range(50):
+        t.update(sha3(str(i).encode()), b'z' * 40)
+    t.commit()
+    assert t.deletes
+    for h in t.deletes:
+        assert h in db
@@ -149,7 +149,7 @@ class State(object):
         self.state.commit()
         sender_addr = privtoaddr(sender)
         result = apply_message(
-            self.state.ephemeral_clone(),
+            self.state.fork(),
             sender=sender_addr,
             to=to,
             code_address=to,
@@ -208,7 +208,7 @@ class Chain(object):
         to = normalize_address(to)
         sender_addr = privtoaddr(sender)
         result = apply_message(
-            self.head_state.ephemeral_clone(),
+            self.head_state.fork(),
             sender=sender_addr,
             to=to,
             code_address=to,
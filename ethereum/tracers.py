@@ -0,0 +1,247 @@
+import time
+from collections import Counter
+from ethereum.utils import encode_hex
+
+
+class Tracer(object):
+    """Receives callbacks while messages and VM code execute.
+
+    Attach a tracer with VMExt(state, tx, tracer) or
+    apply_transaction(state, tx, tracer); nothing is called and nothing is
+    copied when no tracer is attached. Subclasses override the callbacks
+    they need. Arguments are live VM objects (e.g. compustate.stack), so a
+    tracer keeping them must copy them.
+    """
+
+    def enter(self, msg, code, code_hash, special):
+        """a message starts executing code (the init code for creations),
+        whose sha3 is code_hash, or the precompile at msg.code_address if
+        special (code_hash is then None)"""
+        pass
+
+    def exit(self, msg, result, gas, data):
+        """a message finished with the given result, gas left and output"""
+        pass
+
+    def step(self, msg, compustate, pc, op, gas):
+        """the instruction op at pc is about to run with gas left"""
+        pass
+
+    def storage(self, msg, key, value, write):
+        """storage key of msg.to was read (write False) or set to value"""
+        pass
+
+
+class StepCostTracer(Tracer):
+    """Base for tracers needing the gas and time each instruction used.
+
+    The cost of a step is only known once the next step of the same frame
+    (or its exit) is seen, at which point step_cost is called. Costs
+    exclude the gas and time of the messages a step sends (CALL, CREATE),
+    which are accounted to the steps of those messages instead.
+    """
+
+    def __init__(self):
+        # per message: [pending step, nested gas, nested time, start time]
+        self.pending = []
+
+    def step_cost(self, msg, pc, op, cost, elapsed):
+        pass
+
+    def enter(self, msg, code, code_hash, special):
+        self.pending.append([None, 0, 0, time.time()])
+
+    def exit(self, msg, result, gas, data):
+        now = time.time()
+        if self.pending:
+            frame = self.pending.pop()
+            self.finish_step(frame, gas, now)
+            if self.pending:
+                self.pending[-1][1] += msg.gas - gas
+                self.pending[-1][2] += now - frame[3]
+
+    def step(self, msg, compustate, pc, op, gas):
+        now = time.time()
+        if not self.pending:
+            self.pending.append([None, 0, 0, now])
+        frame = self.pending[-1]
+        self.finish_step(frame, gas, now)
+        frame[0], frame[1], frame[2] = (msg, pc, op, gas, now), 0, 0
+
+    def finish_step(self, frame, gas, now):
+        if frame[0] is not None:
+            msg, pc, op, before, start = frame[0]
+            self.step_cost(msg, pc, op, before - gas - frame[1],
+                           now - start - frame[2])
+
+
+class StructLogTracer(StepCostTracer):
+    """Records one entry per executed instruction, as in geth struct logs.
+
+    Each entry of logs is a dict with pc, op, gas, gasCost, depth and,
+    unless disabled, stack (list of ints), memory (bytes) and storage (the
+    slots of the executing contract accessed so far).
+    """
+
+    def __init__(self, stack=True, memory=False, storage=True):
+        super(StructLogTracer, self).__init__()
+        self.with_stack = stack
+        self.with_memory = memory
+        self.with_storage = storage
+        self.logs = []
+        self.storages = {}
+        self.entries = {}
+
+    def step(self, msg, compustate, pc, op, gas):
+        super(StructLogTracer, self).step(msg, compustate, pc, op, gas)
+        entry = dict(pc=pc, op=op, gas=gas, gasCost=0, depth=msg.depth + 1)
+        if self.with_stack:
+            entry['stack'] = list(compustate.stack)
+        if self.with_memory:
+            entry['memory'] = bytes(compustate.memory)
+        if self.with_storage:
+            entry['storage'] = dict(self.storages.get(msg.to, {}))
+        self.entries[(msg.depth, pc)] = entry
+        self.logs.append(entry)
+
+    def step_cost(self, msg, pc, op, cost, elapsed):
+        self.entries.pop((msg.depth, pc))['gasCost'] = cost
+
+    def storage(self, msg, key, value, write):
+        if self.with_storage:
+            self.storages.setdefault(msg.to, {})[key] = value
+
+
+def call_type(msg, parent):
+    if msg.is_create:
+        return 'CREATE'
+    if msg.static and not (parent and parent['static']):
+        return 'STATICCALL'
+    if not msg.transfers_value:
+        return 'DELEGATECALL'
+    if msg.code_address != msg.to:
+        return 'CALLCODE'
+    return 'CALL'
+
+
+class CallTracer(Tracer):
+    """Builds the tree of messages of a transaction.
+
+    root is the outermost frame, a dict with type, from, to, value, gas,
+    input, output, gasUsed, static, error (only for failed frames) and
+    calls, the list of child frames.
+    """
+
+    def __init__(self):
+        self.root = None
+        self.frames = []
+
+    def enter(self, msg, code, code_hash, special):
+        parent = self.frames[-1] if self.frames else None
+        frame = {
+            'type': call_type(msg, parent),
+            'from': msg.sender,
+            'to': msg.to,
+            'value': msg.value,
+            'gas': msg.gas,
+            'input': code if msg.is_create else msg.data.extract_all(),
+            'static': msg.static,
+            'calls': [],
+        }
+        if parent is None:
+            self.root = frame
+        else:
+            parent['calls'].append(frame)
+        self.frames.append(frame)
+
+    def exit(self, msg, result, gas, data):
+        frame = self.frames.pop()
+        frame['gasUsed'] = frame['gas'] - gas
+        frame['output'] = bytes(bytearray(data)) \
+            if isinstance(data, (list, bytearray)) else data
+        if not result:
+            frame['error'] = True
+
+
+def selector(data):
+    return bytes(data.data[data.offset: data.offset + min(data.size, 4)])
+
+
+class ProfileTracer(StepCostTracer):
+    """Aggregates counts, gas and wall time by opcode, code and function.
+
+    All values are Counters:
+    - op_counts, op_gas and op_time are keyed by opcode name
+    - code_calls, code_gas and code_time by the sha3 of the code run,
+      counting only the steps of that code itself
+    - calls and call_gas by (address, 4-byte selector) of each message,
+      with gas used including that of nested calls
+    - precompile_calls, precompile_gas and precompile_time by address of
+      the precompiles (ext.specials) called, which have no code entries
+
+    Times are in seconds and include the overhead of the tracer.
+    """
+
+    def __init__(self):
+        super(ProfileTracer, self).__init__()
+        self.op_counts = Counter()
+        self.op_gas = Counter()
+        self.op_time = Counter()
+        self.code_calls = Counter()
+        self.code_gas = Counter()
+        self.code_time = Counter()
+        self.calls = Counter()
+        self.call_gas = Counter()
+        self.precompile_calls = Counter()
+        self.precompile_gas = Counter()
+        self.precompile_time = Counter()
+        self.frames = []
+
+    def enter(self, msg, code, code_hash, special):
+        super(ProfileTracer, self).enter(msg, code, code_hash, special)
+        key = (msg.to, b'' if msg.is_create else selector(msg.data))
+        self.calls[key] += 1
+        if not special:
+            self.code_calls[code_hash] += 1
+        self.frames.append((key, code_hash, special, msg.gas, time.time()))
+
+    def exit(self, msg, result, gas, data):
+        super(ProfileTracer, self).exit(msg, result, gas, data)
+        key, code_hash, special, startgas, start = self.frames.pop()
+        self.call_gas[key] += startgas - gas
+        if special:
+            self.precompile_calls[msg.code_address] += 1
+            self.precompile_gas[msg.code_address] += startgas - gas
+            self.precompile_time[msg.code_address] += time.time() - start
+
+    def step_cost(self, msg, pc, op, cost, elapsed):
+        self.op_counts[op] += 1
+        self.op_gas[op] += cost
+        self.op_time[op] += elapsed
+        code_hash = self.frames[-1][1] if self.frames else None
+        self.code_gas[code_hash] += cost
+        self.code_time[code_hash] += elapsed
+
+    def report(self, limit=20):
+        """the top limit opcodes and codes by time, and the precompiles"""
+        lines = ['%-16s %10s %12s %10s' % ('opcode', 'count', 'gas', 'ms')]
+        for op, elapsed in self.op_time.most_common(limit):
+            lines.append('%-16s %10d %12d %10.2f' % (
+                op, self.op_counts[op], self.op_gas[op], elapsed * 1000))
+        lines.append('')
+        lines.append('%-16s %10s %12s %10s' % ('code', 'calls', 'gas', 'ms'))
+        for code_hash, elapsed in self.code_time.most_common(limit):
+            lines.append('%-16s %10d %12d %10.2f' % (
+                encode_hex(code_hash)[:16] if code_hash else '-',
+                self.code_calls[code_hash], self.code_gas[code_hash],
+                elapsed * 1000))
+        if self.precompile_calls:
+            lines.append('')
+            lines.append('%-16s %10s %12s %10s' % (
+                'precompile', 'calls', 'gas', 'ms'))
+            for addr, elapsed in self.precompile_time.most_common(limit):
+                lines.append('%-16s %10d %12d %10.2f' % (
+                    encode_hex(addr.lstrip(b'\x00')) or '0',
+                    self.precompile_calls[addr], self.precompile_gas[addr],
+                    elapsed * 1000))
+        return '\n'.join(lines)
@@ -34,6 +34,12 @@ class TransactionQueue():
         heapq.heappush(self.txs, OrderableTx(prio, self.counter, tx))
         self.counter += 1
 
+    def add_transactions(self, txs, force=False, processes=1):
+        from ethereum.transactions import recover_senders
+        recover_senders(txs, processes)
+        for tx in txs:
+            self.add_transaction(tx, force)
+
     def pop_transaction(self, max_gas=9999999999,
                         max_seek_depth=16, min_gasprice=0):
         while len(self.aside) and max_gas >= heapq.heaptop(self.aside).prio:
@@ -214,3 +214,53 @@ def unsigned_tx_from_tx(tx):
         value=tx.value,
         data=tx.data,
     )
+
+
+# Batches smaller than this are not worth shipping to the process pool
+PARALLEL_RECOVERY_MIN_TXS = 16
+_recovery_pools = {}
+
+
+def _recover_sender(rlpdata):
+    try:
+        return rlp.decode(rlpdata, Transaction).sender
+    except Exception:
+        return None
+
+
+def get_recovery_pool(processes=None):
+    if processes not in _recovery_pools:
+        import multiprocessing
+        _recovery_pools[processes] = multiprocessing.Pool(processes)
+    return _recovery_pools[processes]
+
+
+def close_recovery_pools():
+    """Stop the worker processes started by recover_senders"""
+    for pool in _recovery_pools.values():
+        pool.close()
+        pool.join()
+    _recovery_pools.clear()
+
+
+def recover_senders(txs, processes=None):
+    """Recover the senders of many transactions at once.
+
+    Large batches are spread over a process pool, which pays off as
+    signature recovery dominates block import, especially without
+    coincurve. Transactions whose signature does not check out are left
+    alone, so accessing their sender still raises InvalidTransaction.
+
+    :param txs: transactions, e.g. of a block
+    :param processes: size of the pool, defaults to the number of CPUs;
+                      1 disables the pool. Pools are kept for later calls
+                      until close_recovery_pools() is called.
+    """
+    pending = [tx for tx in txs if not tx._sender]
+    if processes == 1 or len(pending) < PARALLEL_RECOVERY_MIN_TXS:
+        return
+    pool = get_recovery_pool(processes)
+    senders = pool.map(_recover_sender, [rlp.encode(tx) for tx in pending])
+    for tx, sender in zip(pending, senders):
+        if sender:
+            tx._sender = sender
@@ -1,19 +1,29 @@
 #!/usr/bin/env python
 import os
 import rlp
+from binascii import hexlify, unhexlify
 from ethereum import utils
 from ethereum.utils import to_string
 from ethereum.abi import is_string
 import copy
-from ethereum.utils import decode_hex, ascii_chr, str_to_bytes
+from itertools import groupby
+from ethereum.utils import decode_hex, ascii_chr, str_to_bytes, safe_ord
 from ethereum.utils import encode_hex
 from ethereum.fast_rlp import encode_optimized
+from ethereum.db import ListeningDB, OverlayDB, RefcountDB
+from repoze.lru import LRUCache
 rlp_encode = encode_optimized
 
+# Number of decoded nodes kept per database, see get_node_cache
+NODE_CACHE_SIZE = 20000
+# Number of decoded nodes kept per OverlayDB, on top of its parent's
+OVERLAY_NODE_CACHE_SIZE = 2000
+
 bin_to_nibbles_cache = {}
 
+hexdigits = b'0123456789abcdef'
 hti = {}
-for i, c in enumerate(b'0123456789abcdef'):
+for i, c in enumerate(hexdigits):
     hti[c] = i
 for i, c in enumerate('0123456789abcdef'):
     hti[c] = i
@@ -31,7 +41,19 @@ def bin_to_nibbles(s):
     >>> bin_to_nibbles("hello")
     [6, 8, 6, 5, 6, 12, 6, 12, 6, 15]
     """
-    return [hti[c] for c in encode_hex(s)]
+    return [hti[c] for c in hexlify(str_to_bytes(s))]
+
+
+def bin_to_hex_path(s):
+    """convert string s to its nibble path as hex digits
+
+    Trie lookups, updates and deletes walk this string with an offset
+    instead of slicing nibble lists at every level.
+
+    >>> bin_to_hex_path(b"he")
+    b'6865'
+    """
+    return hexlify(str_to_bytes(s))
 
 
 def nibbles_to_bin(nibbles):
@@ -89,10 +111,8 @@ def pack_nibbles(nibbles):
         nibbles = [flags] + nibbles
     else:
         nibbles = [flags, 0] + nibbles
-    o = b''
-    for i in range(0, len(nibbles), 2):
-        o += ascii_chr(16 * nibbles[i] + nibbles[i + 1])
-    return o
+    return bytes(bytearray(16 * nibbles[i] + nibbles[i + 1]
+                           for i in range(0, len(nibbles), 2)))
 
 
 def unpack_to_nibbles(bindata):
@@ -112,6 +132,30 @@ def unpack_to_nibbles(bindata):
     return o
 
 
+def pack_hex_path(path, has_terminator=False):
+    """pack a nibble path given as hex digits to binary
+
+    Same as `pack_nibbles`, for paths as returned by bin_to_hex_path.
+
+    >>> pack_hex_path(b'6865', True)
+    b' he'
+    """
+    flags = 2 if has_terminator else 0
+    if len(path) % 2:
+        return unhexlify(hexdigits[flags | 1:flags + 2] + path)
+    return unhexlify(hexdigits[flags:flags + 1] + b'0' + path)
+
+
+def unpack_to_hex_path(bindata):
+    """unpack packed binary data to a nibble path given as hex digits
+
+    :return: (path without the flags nibble and padding, has terminator)
+    """
+    path = hexlify(bindata)
+    flags = hti[path[0]]
+    return path[1:] if flags & 1 else path[2:], bool(flags & 2)
+
+
 def starts_with(full, part):
     """ test whether the items in the part is
     the leading items of the full
@@ -138,15 +182,67 @@ BLANK_NODE = b''
 BLANK_ROOT = utils.sha3rlp(b'')
 
 
+class OverlayNodeCache(LRUCache):
+    """Node cache of an OverlayDB.
+
+    Holds the nodes read or written through the overlay and falls back to
+    the cache of the wrapped database, which never sees the nodes written
+    only to the overlay.
+    """
+
+    def __init__(self, parent, size):
+        LRUCache.__init__(self, size)
+        self.parent = parent
+
+    def get(self, key, default=None):
+        o = LRUCache.get(self, key)
+        if o is None and self.parent is not None:
+            o = self.parent.get(key)
+        return default if o is None else o
+
+
+def get_node_cache(db):
+    """get the decoded-node cache shared by all tries over a database
+
+    Nodes are keyed by their hash, so a RefcountDB can share the cache of
+    the database it wraps. An OverlayDB gets its own OverlayNodeCache, as
+    its writes must not become visible through the wrapped database. A
+    ListeningDB must see every read, so it gets no cache. Cached nodes must
+    never be mutated in place.
+
+    :param db: key value database
+    :return: a repoze.lru LRUCache with hits/misses/evictions counters,
+             or None
+    """
+    while isinstance(db, RefcountDB):
+        db = db.db
+    if isinstance(db, ListeningDB):
+        return None
+    cache = getattr(db, 'node_cache', None)
+    if cache is None:
+        if isinstance(db, OverlayDB):
+            cache = OverlayNodeCache(get_node_cache(db.db),
+                                     OVERLAY_NODE_CACHE_SIZE)
+        else:
+            cache = LRUCache(NODE_CACHE_SIZE)
+        db.node_cache = cache
+    return cache
+
+
 class Trie(object):
 
-    def __init__(self, db, root_hash=BLANK_ROOT):
+    def __init__(self, db, root_hash=BLANK_ROOT, deferred=False):
         """it also present a dictionary like interface
 
         :param db key value database
         :root: blank or trie node in form of [key, value] or [v0,v1..v15,v]
+        :param deferred: if True, updated nodes are kept in memory and only
+            hashed and written to the db by `commit`, which runs implicitly
+            when the root hash is read
         """
         self.db = db  # Pass in a database object directly
+        self.node_cache = get_node_cache(db)
+        self.deferred = deferred
         self.set_root_hash(root_hash)
         self.deletes = []
 
@@ -167,15 +263,24 @@ class Trie(object):
     def root_hash(self):
         """always empty or a 32 bytes string
         """
+        if self._root_hash is None:
+            self.commit()
         return self._root_hash
 
     def get_root_hash(self):
-        return self._root_hash
+        return self.root_hash
 
     def _update_root_hash(self):
+        if self.deferred:
+            # the root is hashed and stored on commit
+            self.dirty_nodes[id(self.root_node)] = self.root_node
+            self._root_hash = None
+            return
         val = rlp_encode(self.root_node)
         key = utils.sha3(val)
         self.db.put(key, str_to_bytes(val))
+        if self.node_cache is not None and self.root_node != BLANK_NODE:
+            self.node_cache.put(key, self.root_node)
         self._root_hash = key
 
     @root_hash.setter
@@ -185,6 +290,7 @@ class Trie(object):
     def set_root_hash(self, root_hash):
         assert is_string(root_hash)
         assert len(root_hash) in [0, 32]
+        self.dirty_nodes = {}
         if root_hash == BLANK_ROOT:
             self.root_node = BLANK_NODE
             self._root_hash = BLANK_ROOT
@@ -199,6 +305,34 @@ class Trie(object):
         self._delete_node_storage(self.root_node)
         self.root_node = BLANK_NODE
         self._root_hash = BLANK_ROOT
+        self.dirty_nodes = {}
+
+    def commit(self):
+        """ hash and store the nodes changed since the last commit
+
+        Only needed for deferred tries, for others this is a no-op.
+        """
+        if self._root_hash is not None:
+            return
+        self.deferred, deferred = False, self.deferred
+        try:
+            self.root_node = self._commit_node(self.root_node)
+            self._update_root_hash()
+        finally:
+            self.deferred = deferred
+        self.dirty_nodes = {}
+
+    def _commit_node(self, node):
+        """replace the in-memory children of a node by their encodings
+        """
+        node_type = self._get_node_type(node)
+        if node_type == NODE_TYPE_BRANCH:
+            return [self._encode_node(self._commit_node(item))
+                    if isinstance(item, list) else item
+                    for item in node[:16]] + [node[16]]
+        if node_type == NODE_TYPE_EXTENSION and isinstance(node[1], list):
+            return [node[0], self._encode_node(self._commit_node(node[1]))]
+        return node
 
     def _delete_child_storage(self, node):
         node_type = self._get_node_type(node)
@@ -211,6 +345,10 @@ class Trie(object):
     def _encode_node(self, node, put_in_db=True):
         if node == BLANK_NODE:
             return BLANK_NODE
+        if self.deferred and put_in_db:
+            # keep the node itself as the reference until commit
+            self.dirty_nodes[id(node)] = node
+            return node
         # assert isinstance(node, list)
         rlpnode = rlp_encode(node)
         if len(rlpnode) < 32:
@@ -219,6 +357,8 @@ class Trie(object):
         hashkey = utils.sha3(rlpnode)
         if put_in_db:
             self.db.put(hashkey, str_to_bytes(rlpnode))
+            if self.node_cache is not None:
+                self.node_cache.put(hashkey, node)
         return hashkey
 
     def _decode_to_node(self, encoded):
@@ -226,7 +366,12 @@ class Trie(object):
             return BLANK_NODE
         if isinstance(encoded, list):
             return encoded
-        o = rlp.decode(self.db.get(encoded))
+        if self.node_cache is None:
+            return rlp.decode(self.db.get(encoded))
+        o = self.node_cache.get(encoded)
+        if o is None:
+            o = rlp.decode(self.db.get(encoded))
+            self.node_cache.put(encoded, o)
         return o
 
     def _get_node_type(self, node):
@@ -239,8 +384,8 @@ class Trie(object):
             return NODE_TYPE_BLANK
 
         if len(node) == 2:
-            nibbles = unpack_to_nibbles(node[0])
-            has_terminator = (nibbles and nibbles[-1] == NIBBLE_TERMINATOR)
+            # the terminator flag is stored in the first nibble of the path
+            has_terminator = safe_ord(node[0][0]) & 0x20
             return NODE_TYPE_LEAF if has_terminator\
                 else NODE_TYPE_EXTENSION
         if len(node) == 17:
@@ -250,41 +395,86 @@ class Trie(object):
         """ get value inside a node
 
         :param node: node in form of list, or BLANK_NODE
-        :param key: nibble list without terminator
+        :param key: nibble path as returned by bin_to_hex_path
         :return:
             BLANK_NODE if does not exist, otherwise value or hash
         """
-        node_type = self._get_node_type(node)
-
-        if node_type == NODE_TYPE_BLANK:
-            return BLANK_NODE
-
-        if node_type == NODE_TYPE_BRANCH:
-            # already reach the expected node
-            if not key:
-                return node[-1]
-            sub_node = self._decode_to_node(node[key[0]])
-            return self._get(sub_node, key[1:])
+        pos = 0
+        while True:
+            if node == BLANK_NODE:
+                return BLANK_NODE
 
-        # key value node
-        curr_key = without_terminator(unpack_to_nibbles(node[0]))
-        if node_type == NODE_TYPE_LEAF:
-            return node[1] if key == curr_key else BLANK_NODE
+            if len(node) == 17:
+                # already reach the expected node
+                if pos == len(key):
+                    return node[-1]
+                node = self._decode_to_node(node[hti[key[pos]]])
+                pos += 1
+                continue
+
+            # key value node, skip the flags nibble and the padding
+            path = hexlify(node[0])
+            flags = hti[path[0]]
+            curr_key = path[1:] if flags & 1 else path[2:]
+            if flags & 2:
+                if len(key) - pos == len(curr_key) and \
+                        key.startswith(curr_key, pos):
+                    return node[1]
+                return BLANK_NODE
 
-        if node_type == NODE_TYPE_EXTENSION:
             # traverse child nodes
-            if starts_with(key, curr_key):
-                sub_node = self._decode_to_node(node[1])
-                return self._get(sub_node, key[len(curr_key):])
-            else:
+            if not key.startswith(curr_key, pos):
                 return BLANK_NODE
+            node = self._decode_to_node(node[1])
+            pos += len(curr_key)
+
+    def _get_many(self, node, items, pos, out):
+        """ get values of many keys inside a node
 
-    def _update(self, node, key, value):
+        :param node: node in form of list, or BLANK_NODE
+        :param items: (nibble path, index) pairs sorted by path, all paths
+            sharing the first `pos` nibbles
+        :param out: list the value for each index is written to
+        """
+        if node == BLANK_NODE:
+            return
+
+        if len(node) == 17:
+            for nibble, group in groupby(
+                    items, lambda item: item[0][pos:pos + 1]):
+                if not nibble:
+                    # already reach the expected node
+                    for path, i in group:
+                        out[i] = node[-1]
+                else:
+                    self._get_many(self._decode_to_node(node[hti[nibble[0]]]),
+                                   list(group), pos + 1, out)
+            return
+
+        # key value node, skip the flags nibble and the padding
+        path = hexlify(node[0])
+        flags = hti[path[0]]
+        curr_key = path[1:] if flags & 1 else path[2:]
+        if flags & 2:
+            for key, i in items:
+                if len(key) - pos == len(curr_key) and \
+                        key.startswith(curr_key, pos):
+                    out[i] = node[1]
+            return
+
+        # traverse child nodes
+        items = [item for item in items if item[0].startswith(curr_key, pos)]
+        if items:
+            self._get_many(self._decode_to_node(node[1]), items,
+                           pos + len(curr_key), out)
+
+    def _update(self, node, key, pos, value):
         """ update item inside a node
 
         :param node: node in form of list, or BLANK_NODE
-        :param key: nibble list without terminator
-            .. note:: key may be []
+        :param key: nibble path as returned by bin_to_hex_path
+        :param pos: number of nibbles of key already consumed above node
+            .. note:: pos may be len(key)
         :param value: value string
         :return: new node
 
@@ -295,82 +485,129 @@ class Trie(object):
         node_type = self._get_node_type(node)
 
         if node_type == NODE_TYPE_BLANK:
-            return [pack_nibbles(with_terminator(key)), value]
+            return [pack_hex_path(key[pos:], True), value]
 
         elif node_type == NODE_TYPE_BRANCH:
-            if not key:
+            # copy first, the node may be shared through the node cache
+            node = node[:]
+            if pos == len(key):
                 node[-1] = value
             else:
+                nibble = hti[key[pos]]
                 new_node = self._update_and_delete_storage(
-                    self._decode_to_node(node[key[0]]),
-                    key[1:], value)
-                node[key[0]] = self._encode_node(new_node)
+                    self._decode_to_node(node[nibble]),
+                    key, pos + 1, value)
+                node[nibble] = self._encode_node(new_node)
             return node
 
         elif is_key_value_type(node_type):
-            return self._update_kv_node(node, key, value)
+            return self._update_kv_node(node, key, pos, value)
 
-    def _update_and_delete_storage(self, node, key, value):
-        old_node = node[:]
-        new_node = self._update(node, key, value)
-        if old_node != new_node:
-            self._delete_node_storage(old_node)
+    def _update_and_delete_storage(self, node, key, pos, value):
+        new_node = self._update(node, key, pos, value)
+        if node != new_node:
+            self._delete_node_storage(node)
         return new_node
 
-    def _update_kv_node(self, node, key, value):
+    def _update_many(self, node, items, pos):
+        """ update many items inside a node
+
+        :param node: node in form of list, or BLANK_NODE
+        :param items: (nibble path, value) pairs sorted by path, no path
+            twice, all paths sharing the first `pos` nibbles
+        :return: new node
+
+        nodes on paths shared by several keys are only decoded and encoded
+        once, otherwise this is the same as calling `_update` for each item
+        """
+        if len(items) == 1:
+            return self._update(node, items[0][0], pos, items[0][1])
+
         node_type = self._get_node_type(node)
-        curr_key = without_terminator(unpack_to_nibbles(node[0]))
-        is_inner = node_type == NODE_TYPE_EXTENSION
+
+        if node_type == NODE_TYPE_BRANCH:
+            # copy first, the node may be shared through the node cache
+            node = node[:]
+            for nibble, group in groupby(
+                    items, lambda item: item[0][pos:pos + 1]):
+                if not nibble:
+                    node[-1] = list(group)[-1][1]
+                    continue
+                nibble = hti[nibble[0]]
+                new_node = self._update_many_and_delete_storage(
+                    self._decode_to_node(node[nibble]), list(group), pos + 1)
+                node[nibble] = self._encode_node(new_node)
+            return node
+
+        if node_type == NODE_TYPE_EXTENSION:
+            curr_key, _ = unpack_to_hex_path(node[0])
+            if all(key.startswith(curr_key, pos) for key, value in items):
+                new_node = self._update_many_and_delete_storage(
+                    self._decode_to_node(node[1]), items,
+                    pos + len(curr_key))
+                return [node[0], self._encode_node(new_node)]
+
+        # let the first item split this node, then continue below it
+        node = self._update(node, items[0][0], pos, items[0][1])
+        return self._update_many(node, items[1:], pos)
+
+    def _update_many_and_delete_storage(self, node, items, pos):
+        new_node = self._update_many(node, items, pos)
+        if node != new_node:
+            self._delete_node_storage(node)
+        return new_node
+
+    def _update_kv_node(self, node, key, pos, value):
+        curr_key, is_leaf = unpack_to_hex_path(node[0])
+        is_inner = not is_leaf
 
         # find longest common prefix
         prefix_length = 0
-        for i in range(min(len(curr_key), len(key))):
-            if key[i] != curr_key[i]:
-                break
-            prefix_length = i + 1
+        max_length = min(len(curr_key), len(key) - pos)
+        while prefix_length < max_length and \
+                key[pos + prefix_length] == curr_key[prefix_length]:
+            prefix_length += 1
 
-        remain_key = key[prefix_length:]
+        pos += prefix_length
         remain_curr_key = curr_key[prefix_length:]
 
-        if remain_key == [] == remain_curr_key:
+        if pos == len(key) and not remain_curr_key:
             if not is_inner:
                 return [node[0], value]
             new_node = self._update_and_delete_storage(
-                self._decode_to_node(node[1]), remain_key, value)
+                self._decode_to_node(node[1]), key, pos, value)
 
-        elif remain_curr_key == []:
+        elif not remain_curr_key:
             if is_inner:
                 new_node = self._update_and_delete_storage(
-                    self._decode_to_node(node[1]), remain_key, value)
+                    self._decode_to_node(node[1]), key, pos, value)
             else:
                 new_node = [BLANK_NODE] * 17
                 new_node[-1] = node[1]
-                new_node[remain_key[0]] = self._encode_node([
-                    pack_nibbles(with_terminator(remain_key[1:])),
+                new_node[hti[key[pos]]] = self._encode_node([
+                    pack_hex_path(key[pos + 1:], True),
                     value
                 ])
         else:
             new_node = [BLANK_NODE] * 17
             if len(remain_curr_key) == 1 and is_inner:
-                new_node[remain_curr_key[0]] = node[1]
+                new_node[hti[remain_curr_key[0]]] = node[1]
             else:
-                new_node[remain_curr_key[0]] = self._encode_node([
-                    pack_nibbles(
-                        adapt_terminator(remain_curr_key[1:], not is_inner)
-                    ),
+                new_node[hti[remain_curr_key[0]]] = self._encode_node([
+                    pack_hex_path(remain_curr_key[1:], not is_inner),
                     node[1]
                 ])
 
-            if remain_key == []:
+            if pos == len(key):
                 new_node[-1] = value
             else:
-                new_node[remain_key[0]] = self._encode_node([
-                    pack_nibbles(with_terminator(remain_key[1:])), value
+                new_node[hti[key[pos]]] = self._encode_node([
+                    pack_hex_path(key[pos + 1:], True), value
                 ])
 
         if prefix_length:
             # create node for key prefix
-            return [pack_nibbles(curr_key[:prefix_length]),
+            return [pack_hex_path(curr_key[:prefix_length]),
                     self._encode_node(new_node)]
         else:
             return new_node
@@ -617,6 +854,9 @@ class Trie(object):
         """
         if node == BLANK_NODE:
             return
+        if id(node) in self.dirty_nodes:
+            # never stored
+            return
         # assert isinstance(node, list)
         encoded = self._encode_node(node, put_in_db=False)
         if len(encoded) < 32:
@@ -629,12 +869,13 @@ class Trie(object):
         self.deletes.append(encoded)
         # print('del', encoded, self.db.get_refcount(encoded))
 
-    def _delete(self, node, key):
+    def _delete(self, node, key, pos):
         """ update item inside a node
 
         :param node: node in form of list, or BLANK_NODE
-        :param key: nibble list without terminator
-            .. note:: key may be []
+        :param key: nibble path as returned by bin_to_hex_path
+        :param pos: number of nibbles of key already consumed above node
+            .. note:: pos may be len(key)
         :return: new node
 
         if this node is changed to a new node, it's parent will take the
@@ -646,10 +887,10 @@ class Trie(object):
             return BLANK_NODE
 
         if node_type == NODE_TYPE_BRANCH:
-            return self._delete_branch_node(node, key)
+            return self._delete_branch_node(node, key, pos)
 
         if is_key_value_type(node_type):
-            return self._delete_kv_node(node, key)
+            return self._delete_kv_node(node, key, pos)
 
     def _normalize_branch_node(self, node):
         """node should have only one item changed
@@ -682,50 +923,56 @@ class Trie(object):
                     self._encode_node(sub_node)]
         assert False
 
-    def _delete_and_delete_storage(self, node, key):
-        old_node = node[:]
-        new_node = self._delete(node, key)
-        if old_node != new_node:
-            self._delete_node_storage(old_node)
+    def _delete_and_delete_storage(self, node, key, pos):
+        new_node = self._delete(node, key, pos)
+        if node != new_node:
+            self._delete_node_storage(node)
         return new_node
 
-    def _delete_branch_node(self, node, key):
+    def _delete_branch_node(self, node, key, pos):
         # already reach the expected node
-        if not key:
+        if pos == len(key):
+            # copy first, the node may be shared through the node cache
+            node = node[:]
             node[-1] = BLANK_NODE
             return self._normalize_branch_node(node)
 
-        encoded_new_sub_node = self._encode_node(
-            self._delete_and_delete_storage(
-                self._decode_to_node(node[key[0]]), key[1:])
-        )
+        nibble = hti[key[pos]]
+        sub_node = self._decode_to_node(node[nibble])
+        new_sub_node = self._delete_and_delete_storage(
+            sub_node, key, pos + 1)
+        if new_sub_node is sub_node:
+            return node
+
+        encoded_new_sub_node = self._encode_node(new_sub_node)
 
-        if encoded_new_sub_node == node[key[0]]:
+        if encoded_new_sub_node == node[nibble]:
             return node
 
-        node[key[0]] = encoded_new_sub_node
+        node = node[:]
+        node[nibble] = encoded_new_sub_node
         if encoded_new_sub_node == BLANK_NODE:
             return self._normalize_branch_node(node)
 
         return node
 
-    def _delete_kv_node(self, node, key):
-        node_type = self._get_node_type(node)
-        assert is_key_value_type(node_type)
-        curr_key = without_terminator(unpack_to_nibbles(node[0]))
+    def _delete_kv_node(self, node, key, pos):
+        curr_key, is_leaf = unpack_to_hex_path(node[0])
 
-        if not starts_with(key, curr_key):
+        if not key.startswith(curr_key, pos):
             # key not found
             return node
 
-        if node_type == NODE_TYPE_LEAF:
-            return BLANK_NODE if key == curr_key else node
+        if is_leaf:
+            return BLANK_NODE if len(key) - pos == len(curr_key) else node
 
         # for inner key value type
+        sub_node = self._decode_to_node(node[1])
         new_sub_node = self._delete_and_delete_storage(
-            self._decode_to_node(node[1]), key[len(curr_key):])
+            sub_node, key, pos + len(curr_key))
 
-        if self._encode_node(new_sub_node) == node[1]:
+        if new_sub_node is sub_node or \
+                self._encode_node(new_sub_node) == node[1]:
             return node
 
         # new sub node is BLANK_NODE
@@ -740,11 +987,12 @@ class Trie(object):
         if is_key_value_type(new_sub_node_type):
             # collape subnode to this node, not this node will have same
             # terminator with the new sub node, and value does not change
-            new_key = curr_key + unpack_to_nibbles(new_sub_node[0])
-            return [pack_nibbles(new_key), new_sub_node[1]]
+            sub_key, sub_is_leaf = unpack_to_hex_path(new_sub_node[0])
+            return [pack_hex_path(curr_key + sub_key, sub_is_leaf),
+                    new_sub_node[1]]
 
         if new_sub_node_type == NODE_TYPE_BRANCH:
-            return [pack_nibbles(curr_key), self._encode_node(new_sub_node)]
+            return [pack_hex_path(curr_key), self._encode_node(new_sub_node)]
 
         # should be no more cases
         assert False
@@ -761,7 +1009,7 @@ class Trie(object):
 
         self.root_node = self._delete_and_delete_storage(
             self.root_node,
-            bin_to_nibbles(to_string(key)))
+            bin_to_hex_path(to_string(key)), 0)
         self._update_root_hash()
 
     def _get_size(self, node):
@@ -893,7 +1141,20 @@ class Trie(object):
         return res
 
     def get(self, key):
-        return self._get(self.root_node, bin_to_nibbles(to_string(key)))
+        return self._get(self.root_node, bin_to_hex_path(to_string(key)))
+
+    def get_many(self, keys):
+        """ get the values of many keys at once
+
+        :param keys: a list of strings
+        :return: list of values, in the order of `keys`
+        """
+        out = [BLANK_NODE] * len(keys)
+        items = sorted((bin_to_hex_path(to_string(key)), i)
+                       for i, key in enumerate(keys))
+        if items:
+            self._get_many(self.root_node, items, 0, out)
+        return out
 
     def __len__(self):
         return self._get_size(self.root_node)
@@ -931,16 +1192,95 @@ class Trie(object):
         #     return self.delete(key)
         self.root_node = self._update_and_delete_storage(
             self.root_node,
-            bin_to_nibbles(to_string(key)),
+            bin_to_hex_path(to_string(key)), 0,
             to_string(value))
         self._update_root_hash()
 
+    def update_many(self, items):
+        """ update many keys at once
+
+        Gives the same trie as calling `update` for each item, but shared
+        nodes near the root are only decoded and encoded once.
+
+        :param items: a dict or a list of (key, value) pairs
+        """
+        items = dict(items)
+        for key, value in items.items():
+            if not is_string(key):
+                raise Exception("Key must be string")
+            if not is_string(value):
+                raise Exception("Value must be string")
+        if not items:
+            return
+        self.root_node = self._update_many_and_delete_storage(
+            self.root_node,
+            sorted((bin_to_hex_path(to_string(key)), to_string(value))
+                   for key, value in items.items()), 0)
+        self._update_root_hash()
+
     def root_hash_valid(self):
         if self.root_hash == BLANK_ROOT:
             return True
         return self.root_hash in self.db
 
 
+def _build_node(items, lo, hi, pos):
+    """build the node holding items[lo:hi], whose paths share their first
+    pos nibbles
+    """
+    path, value = items[lo]
+    if hi - lo == 1:
+        return [pack_nibbles(with_terminator([hti[c] for c in path[pos:]])),
+                value]
+
+    # items are sorted, so the first and last path share the common prefix
+    last = items[hi - 1][0]
+    end = pos
+    while end < min(len(path), len(last)) and path[end] == last[end]:
+        end += 1
+    if end > pos:
+        return [pack_nibbles([hti[c] for c in path[pos:end]]),
+                _node_ref(_build_node(items, lo, hi, end))]
+
+    node = [BLANK_NODE] * 17
+    if len(path) == pos:
+        node[16] = value
+        lo += 1
+    while lo < hi:
+        nibble = items[lo][0][pos]
+        mid = lo + 1
+        while mid < hi and items[mid][0][pos] == nibble:
+            mid += 1
+        node[hti[nibble]] = _node_ref(_build_node(items, lo, mid, pos + 1))
+        lo = mid
+    return node
+
+
+def _node_ref(node):
+    rlpnode = rlp_encode(node)
+    if len(rlpnode) < 32:
+        return node
+    return utils.sha3(rlpnode)
+
+
+def mk_root_hash(items):
+    """root hash of a trie holding the given items, without storing it
+
+    Each node is built and hashed exactly once, working depth first over
+    the sorted keys, so only the nodes on the current path are in memory.
+    Used for the transaction and receipt roots, where nothing but the root
+    hash is needed.
+
+    :param items: (key, value) pairs, keys must be unique
+    :return: the same root hash a `Trie` updated with the items would have
+    """
+    items = sorted((bin_to_hex_path(to_string(key)), to_string(value))
+                   for key, value in items)
+    if not items:
+        return BLANK_ROOT
+    return utils.sha3(rlp_encode(_build_node(items, 0, len(items), 0)))
+
+
 if __name__ == "__main__":
     import sys
     from . import db
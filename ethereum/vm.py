@@ -7,19 +7,17 @@ import sys
 sys.setrecursionlimit(10000)
 
 import copy
+import rlp
 
 from ethereum.utils import encode_hex, ascii_chr
 from ethereum import utils
 from ethereum.abi import is_numeric
 from ethereum import opcodes
+from ethereum.config import ForkRules, default_config
+from ethereum.code_analysis import CodeAnalysisCache
 from ethereum.slogging import get_logger
 from ethereum.utils import to_string, encode_int, zpad, bytearray_to_bytestr, safe_ord
 
-if sys.version_info.major == 2:
-    from repoze.lru import lru_cache
-else:
-    from functools import lru_cache
-
 log_log = get_logger('eth.vm.log')
 log_msg = get_logger('eth.pb.msg')
 log_vm_exit = get_logger('eth.vm.exit')
@@ -41,8 +39,16 @@ MAX_DEPTH = 1024
 # copying. Instead we just copy the reference to the parent memory
 # slice plus the start and end of the slice
 class CallData(object):
+    """A window of size bytes starting at offset into parent_memory.
+
+    The data is not copied: parent_memory (bytes, a bytearray or the memory
+    of the calling frame) is only sliced when read, and reads past its end
+    are zero padded.
+    """
 
     def __init__(self, parent_memory, offset=0, size=None):
+        if isinstance(parent_memory, list):
+            parent_memory = bytearray(parent_memory)
         self.data = parent_memory
         self.offset = offset
         self.size = len(self.data) if size is None else size
@@ -50,25 +56,37 @@ class CallData(object):
 
     # Convert calldata to bytes
     def extract_all(self):
-        d = self.data[self.offset: self.offset + self.size]
-        d.extend(bytearray(self.size - len(d)))
-        return bytes(bytearray(d))
+        d = bytes(self.data[self.offset: self.rlimit])
+        return d + b'\x00' * (self.size - len(d))
 
     # Extract 32 bytes as integer
     def extract32(self, i):
         if i >= self.size:
             return 0
         o = self.data[self.offset + i: min(self.offset + i + 32, self.rlimit)]
-        o.extend(bytearray(32 - len(o)))
-        return utils.bytearray_to_int(o)
+        return utils.big_endian_to_int(bytes(o) + b'\x00' * (32 - len(o)))
 
     # Extract a slice and copy it to memory
     def extract_copy(self, mem, memstart, datastart, size):
-        for i in range(size):
-            if datastart + i < self.size:
-                mem[memstart + i] = self.data[self.offset + datastart + i]
-            else:
-                mem[memstart + i] = 0
+        if datastart < self.size:
+            end = self.offset + min(datastart + size, self.size)
+            copy_padded(mem, memstart, self.data, self.offset + datastart,
+                        size, end)
+        else:
+            copy_padded(mem, memstart, b'', 0, size)
+
+
+# Copies size bytes of data from datastart into mem in one slice
+# assignment, zero padding whatever lies past end (default: the end of data)
+def copy_padded(mem, memstart, data, datastart, size, end=None):
+    if not size:
+        return
+    end = datastart + size if end is None else min(end, datastart + size)
+    chunk = data[datastart: end] if datastart < end else b''
+    copied = len(chunk)
+    mem[memstart: memstart + copied] = chunk
+    if copied < size:
+        mem[memstart + copied: memstart + size] = bytes(size - copied)
 
 
 # Stores a message object, including context data like sender,
@@ -81,7 +99,7 @@ class Message(object):
         self.to = to
         self.value = value
         self.gas = gas
-        self.data = CallData(list(map(utils.safe_ord, data))) if isinstance(
+        self.data = CallData(utils.str_to_bytes(data)) if isinstance(
             data, (str, bytes)) else data
         self.depth = depth
         self.logs = []
@@ -121,25 +139,42 @@ class Compustate():
         self.prev_gas = self.gas
 
 
-# Preprocesses code, and determines which locations are in the middle
-# of pushdata and thus invalid
-@lru_cache(128)
+# Preprocesses code, and determines which locations are valid jump
+# destinations (a JUMPDEST not in the middle of pushdata). Returns a
+# bytearray with a nonzero byte at every valid destination, so checking
+# a jump costs the same whatever the size of the code
 def preprocess_code(code):
-    o = 0
+    jumpdests = bytearray(len(code))
     i = 0
     pushcache = {}
     code = code + b'\x00' * 32
     while i < len(code) - 32:
         codebyte = safe_ord(code[i])
         if codebyte == 0x5b:
-            o |= 1 << i
+            jumpdests[i] = 1
         if 0x60 <= codebyte <= 0x7f:
             pushcache[i] = utils.big_endian_to_int(
                 code[i + 1: i + codebyte - 0x5e])
             i += codebyte - 0x5e
         else:
             i += 1
-    return o, pushcache
+    return jumpdests, pushcache
+
+
+def encode_analysis(analysis):
+    jumpdests, pushcache = analysis
+    return rlp.encode([bytes(jumpdests), sorted(pushcache.items())])
+
+
+def decode_analysis(data):
+    jumpdests, pushes = rlp.decode(data)
+    return bytearray(jumpdests), {utils.big_endian_to_int(k): utils.big_endian_to_int(v)
+                                  for k, v in pushes}
+
+
+analysis_cache = CodeAnalysisCache(b'vm', preprocess_code,
+                                   encode=encode_analysis,
+                                   decode=decode_analysis)
 
 
 # Extends memory, and pays gas for it
@@ -242,11 +277,632 @@ def vm_trace(ext, msg, compustate, opcode, pushcache, tracer=log_vm_op):
     compustate.prev_prev_op = op
 
 
+# Opcode handlers. Each one is called as handler(compustate, stack, memory,
+# ext, msg) after the base fee has been paid and the stack height checked,
+# and returns None to carry on or a (result, gas, data) tuple to exit
+def op_noop(compustate, stk, mem, ext, msg):
+    pass
+
+
+def op_stop(compustate, stk, mem, ext, msg):
+    return peaceful_exit('STOP', compustate.gas, [])
+
+
+def op_add(compustate, stk, mem, ext, msg):
+    stk.append((stk.pop() + stk.pop()) & TT256M1)
+
+
+def op_sub(compustate, stk, mem, ext, msg):
+    stk.append((stk.pop() - stk.pop()) & TT256M1)
+
+
+def op_mul(compustate, stk, mem, ext, msg):
+    stk.append((stk.pop() * stk.pop()) & TT256M1)
+
+
+def op_div(compustate, stk, mem, ext, msg):
+    s0, s1 = stk.pop(), stk.pop()
+    stk.append(0 if s1 == 0 else s0 // s1)
+
+
+def op_mod(compustate, stk, mem, ext, msg):
+    s0, s1 = stk.pop(), stk.pop()
+    stk.append(0 if s1 == 0 else s0 % s1)
+
+
+def op_sdiv(compustate, stk, mem, ext, msg):
+    s0, s1 = utils.to_signed(stk.pop()), utils.to_signed(stk.pop())
+    stk.append(0 if s1 == 0 else (abs(s0) // abs(s1) *
+                                  (-1 if s0 * s1 < 0 else 1)) & TT256M1)
+
+
+def op_smod(compustate, stk, mem, ext, msg):
+    s0, s1 = utils.to_signed(stk.pop()), utils.to_signed(stk.pop())
+    stk.append(0 if s1 == 0 else (abs(s0) % abs(s1) *
+                                  (-1 if s0 < 0 else 1)) & TT256M1)
+
+
+def op_addmod(compustate, stk, mem, ext, msg):
+    s0, s1, s2 = stk.pop(), stk.pop(), stk.pop()
+    stk.append((s0 + s1) % s2 if s2 else 0)
+
+
+def op_mulmod(compustate, stk, mem, ext, msg):
+    s0, s1, s2 = stk.pop(), stk.pop(), stk.pop()
+    stk.append((s0 * s1) % s2 if s2 else 0)
+
+
+def mk_op_exp(byte_fee):
+    def op_exp(compustate, stk, mem, ext, msg):
+        base, exponent = stk.pop(), stk.pop()
+        # fee for exponent is dependent on its bytes
+        # calc n bytes to represent exponent
+        expfee = len(utils.encode_int(exponent)) * byte_fee
+        if compustate.gas < expfee:
+            compustate.gas = 0
+            return vm_exception('OOG EXPONENT')
+        compustate.gas -= expfee
+        stk.append(pow(base, exponent, TT256))
+    return op_exp
+
+
+def op_signextend(compustate, stk, mem, ext, msg):
+    s0, s1 = stk.pop(), stk.pop()
+    if s0 <= 31:
+        testbit = s0 * 8 + 7
+        if s1 & (1 << testbit):
+            stk.append(s1 | (TT256 - (1 << testbit)))
+        else:
+            stk.append(s1 & ((1 << testbit) - 1))
+    else:
+        stk.append(s1)
+
+
+def op_lt(compustate, stk, mem, ext, msg):
+    stk.append(1 if stk.pop() < stk.pop() else 0)
+
+
+def op_gt(compustate, stk, mem, ext, msg):
+    stk.append(1 if stk.pop() > stk.pop() else 0)
+
+
+def op_slt(compustate, stk, mem, ext, msg):
+    s0, s1 = utils.to_signed(stk.pop()), utils.to_signed(stk.pop())
+    stk.append(1 if s0 < s1 else 0)
+
+
+def op_sgt(compustate, stk, mem, ext, msg):
+    s0, s1 = utils.to_signed(stk.pop()), utils.to_signed(stk.pop())
+    stk.append(1 if s0 > s1 else 0)
+
+
+def op_eq(compustate, stk, mem, ext, msg):
+    stk.append(1 if stk.pop() == stk.pop() else 0)
+
+
+def op_iszero(compustate, stk, mem, ext, msg):
+    stk.append(0 if stk.pop() else 1)
+
+
+def op_and(compustate, stk, mem, ext, msg):
+    stk.append(stk.pop() & stk.pop())
+
+
+def op_or(compustate, stk, mem, ext, msg):
+    stk.append(stk.pop() | stk.pop())
+
+
+def op_xor(compustate, stk, mem, ext, msg):
+    stk.append(stk.pop() ^ stk.pop())
+
+
+def op_not(compustate, stk, mem, ext, msg):
+    stk.append(TT256M1 - stk.pop())
+
+
+def op_byte(compustate, stk, mem, ext, msg):
+    s0, s1 = stk.pop(), stk.pop()
+    if s0 >= 32:
+        stk.append(0)
+    else:
+        stk.append((s1 // 256 ** (31 - s0)) % 256)
+
+
+def op_sha3(compustate, stk, mem, ext, msg):
+    s0, s1 = stk.pop(), stk.pop()
+    compustate.gas -= opcodes.GSHA3WORD * (utils.ceil32(s1) // 32)
+    if compustate.gas < 0:
+        return vm_exception('OOG PAYING FOR SHA3')
+    if not mem_extend(mem, compustate, 'SHA3', s0, s1):
+        return vm_exception('OOG EXTENDING MEMORY')
+    data = bytearray_to_bytestr(mem[s0: s0 + s1])
+    stk.append(utils.big_endian_to_int(utils.sha3(data)))
+
+
+def op_address(compustate, stk, mem, ext, msg):
+    stk.append(utils.coerce_to_int(msg.to))
+
+
+def op_balance(compustate, stk, mem, ext, msg):
+    addr = utils.coerce_addr_to_hex(stk.pop() % 2**160)
+    stk.append(ext.get_balance(addr))
+
+
+def op_origin(compustate, stk, mem, ext, msg):
+    stk.append(utils.coerce_to_int(ext.tx_origin))
+
+
+def op_caller(compustate, stk, mem, ext, msg):
+    stk.append(utils.coerce_to_int(msg.sender))
+
+
+def op_callvalue(compustate, stk, mem, ext, msg):
+    stk.append(msg.value)
+
+
+def op_calldataload(compustate, stk, mem, ext, msg):
+    stk.append(msg.data.extract32(stk.pop()))
+
+
+def op_calldatasize(compustate, stk, mem, ext, msg):
+    stk.append(msg.data.size)
+
+
+def op_calldatacopy(compustate, stk, mem, ext, msg):
+    mstart, dstart, size = stk.pop(), stk.pop(), stk.pop()
+    if not mem_extend(mem, compustate, 'CALLDATACOPY', mstart, size):
+        return vm_exception('OOG EXTENDING MEMORY')
+    if not data_copy(compustate, size):
+        return vm_exception('OOG COPY DATA')
+    msg.data.extract_copy(mem, mstart, dstart, size)
+
+
+def op_codesize(compustate, stk, mem, ext, msg):
+    stk.append(compustate.codelen)
+
+
+def op_codecopy(compustate, stk, mem, ext, msg):
+    mstart, dstart, size = stk.pop(), stk.pop(), stk.pop()
+    if not mem_extend(mem, compustate, 'CODECOPY', mstart, size):
+        return vm_exception('OOG EXTENDING MEMORY')
+    if not data_copy(compustate, size):
+        return vm_exception('OOG COPY DATA')
+    copy_padded(mem, mstart, compustate.code, dstart, size)
+
+
+def op_returndatacopy(compustate, stk, mem, ext, msg):
+    mstart, dstart, size = stk.pop(), stk.pop(), stk.pop()
+    if not mem_extend(mem, compustate, 'RETURNDATACOPY', mstart, size):
+        return vm_exception('OOG EXTENDING MEMORY')
+    if not data_copy(compustate, size):
+        return vm_exception('OOG COPY DATA')
+    if dstart + size > len(compustate.last_returned):
+        return vm_exception('RETURNDATACOPY out of range')
+    mem[mstart: mstart + size] = compustate.last_returned[dstart: dstart + size]
+
+
+def op_returndatasize(compustate, stk, mem, ext, msg):
+    stk.append(len(compustate.last_returned))
+
+
+def op_gasprice(compustate, stk, mem, ext, msg):
+    stk.append(ext.tx_gasprice)
+
+
+def op_extcodesize(compustate, stk, mem, ext, msg):
+    addr = utils.coerce_addr_to_hex(stk.pop() % 2**160)
+    stk.append(len(ext.get_code(addr) or b''))
+
+
+def op_extcodecopy(compustate, stk, mem, ext, msg):
+    addr = utils.coerce_addr_to_hex(stk.pop() % 2**160)
+    start, s2, size = stk.pop(), stk.pop(), stk.pop()
+    extcode = ext.get_code(addr) or b''
+    assert utils.is_string(extcode)
+    if not mem_extend(mem, compustate, 'EXTCODECOPY', start, size):
+        return vm_exception('OOG EXTENDING MEMORY')
+    if not data_copy(compustate, size):
+        return vm_exception('OOG COPY DATA')
+    copy_padded(mem, start, extcode, s2, size)
+
+
+def op_blockhash(compustate, stk, mem, ext, msg):
+    stk.append(utils.big_endian_to_int(ext.block_hash(stk.pop())))
+
+
+def op_coinbase(compustate, stk, mem, ext, msg):
+    stk.append(utils.big_endian_to_int(ext.block_coinbase))
+
+
+def op_timestamp(compustate, stk, mem, ext, msg):
+    stk.append(ext.block_timestamp)
+
+
+def op_number(compustate, stk, mem, ext, msg):
+    stk.append(ext.block_number)
+
+
+def op_difficulty(compustate, stk, mem, ext, msg):
+    stk.append(ext.block_difficulty)
+
+
+def op_gaslimit(compustate, stk, mem, ext, msg):
+    stk.append(ext.block_gas_limit)
+
+
+def op_pop(compustate, stk, mem, ext, msg):
+    stk.pop()
+
+
+def op_mload(compustate, stk, mem, ext, msg):
+    s0 = stk.pop()
+    if not mem_extend(mem, compustate, 'MLOAD', s0, 32):
+        return vm_exception('OOG EXTENDING MEMORY')
+    stk.append(utils.bytes_to_int(mem[s0: s0 + 32]))
+
+
+def op_mstore(compustate, stk, mem, ext, msg):
+    s0, s1 = stk.pop(), stk.pop()
+    if not mem_extend(mem, compustate, 'MSTORE', s0, 32):
+        return vm_exception('OOG EXTENDING MEMORY')
+    mem[s0: s0 + 32] = utils.encode_int32(s1)
+
+
+def op_mstore8(compustate, stk, mem, ext, msg):
+    s0, s1 = stk.pop(), stk.pop()
+    if not mem_extend(mem, compustate, 'MSTORE8', s0, 1):
+        return vm_exception('OOG EXTENDING MEMORY')
+    mem[s0] = s1 % 256
+
+
+def op_sload(compustate, stk, mem, ext, msg):
+    key = stk.pop()
+    value = ext.get_storage_data(msg.to, key)
+    if ext.tracer is not None:
+        ext.tracer.storage(msg, key, value, False)
+    stk.append(value)
+
+
+def op_sstore(compustate, stk, mem, ext, msg):
+    s0, s1 = stk.pop(), stk.pop()
+    if msg.static:
+        return vm_exception('Cannot SSTORE inside a static context')
+    if ext.get_storage_data(msg.to, s0):
+        gascost = opcodes.GSTORAGEMOD if s1 else opcodes.GSTORAGEKILL
+        refund = 0 if s1 else opcodes.GSTORAGEREFUND
+    else:
+        gascost = opcodes.GSTORAGEADD if s1 else opcodes.GSTORAGEMOD
+        refund = 0
+    if compustate.gas < gascost:
+        return vm_exception('OUT OF GAS')
+    compustate.gas -= gascost
+    # adds neg gascost as a refund if below zero
+    ext.add_refund(refund)
+    ext.set_storage_data(msg.to, s0, s1)
+    if ext.tracer is not None:
+        ext.tracer.storage(msg, s0, s1, True)
+
+
+def op_jump(compustate, stk, mem, ext, msg):
+    compustate.pc = stk.pop()
+    if compustate.pc >= compustate.codelen or \
+            not compustate.jumpdests[compustate.pc]:
+        return vm_exception('BAD JUMPDEST')
+
+
+def op_jumpi(compustate, stk, mem, ext, msg):
+    s0, s1 = stk.pop(), stk.pop()
+    if s1:
+        compustate.pc = s0
+        if compustate.pc >= compustate.codelen or \
+                not compustate.jumpdests[compustate.pc]:
+            return vm_exception('BAD JUMPDEST')
+
+
+def op_pc(compustate, stk, mem, ext, msg):
+    stk.append(compustate.pc - 1)
+
+
+def op_msize(compustate, stk, mem, ext, msg):
+    stk.append(len(mem))
+
+
+def op_gas(compustate, stk, mem, ext, msg):
+    stk.append(compustate.gas)  # AFTER subtracting cost 1
+
+
+# DUPn (eg. DUP1: a b c -> a b c c, DUP3: a b c -> a b c a)
+def mk_op_dup(n):
+    def op_dup(compustate, stk, mem, ext, msg):
+        stk.append(stk[-n])
+    return op_dup
+
+
+# SWAPn (eg. SWAP1: a b c d -> a b d c, SWAP3: a b c d -> d b c a)
+def mk_op_swap(n):
+    def op_swap(compustate, stk, mem, ext, msg):
+        temp = stk[-n - 1]
+        stk[-n - 1] = stk[-1]
+        stk[-1] = temp
+    return op_swap
+
+
+def mk_op_log(depth):
+    """
+    0xa0 ... 0xa4, 32/64/96/128/160 + len(data) gas
+    a. Opcodes LOG0...LOG4 are added, takes 2-6 stack arguments
+            MEMSTART MEMSZ (TOPIC1) (TOPIC2) (TOPIC3) (TOPIC4)
+    b. Logs are kept track of during tx execution exactly the same way as suicides
+       (except as an ordered list, not a set).
+       Each log is in the form [address, [topic1, ... ], data] where:
+       * address is what the ADDRESS opcode would output
+       * data is mem[MEMSTART: MEMSTART + MEMSZ]
+       * topics are as provided by the opcode
+    c. The ordered list of logs in the transaction are expressed as [log0, log1, ..., logN].
+    """
+    op = 'LOG%d' % depth
+
+    def op_log(compustate, stk, mem, ext, msg):
+        mstart, msz = stk.pop(), stk.pop()
+        topics = [stk.pop() for x in range(depth)]
+        compustate.gas -= msz * opcodes.GLOGBYTE
+        if msg.static:
+            return vm_exception('Cannot LOG inside a static context')
+        if not mem_extend(mem, compustate, op, mstart, msz):
+            return vm_exception('OOG EXTENDING MEMORY')
+        data = bytearray_to_bytestr(mem[mstart: mstart + msz])
+        ext.log(msg.to, topics, data)
+        log_log.trace('LOG', to=msg.to, topics=topics,
+                      data=list(map(utils.safe_ord, data)))
+    return op_log
+
+
+# Create a new contract
+def mk_op_create(anti_dos):
+    def op_create(compustate, stk, mem, ext, msg):
+        value, mstart, msz = stk.pop(), stk.pop(), stk.pop()
+        if not mem_extend(mem, compustate, 'CREATE', mstart, msz):
+            return vm_exception('OOG EXTENDING MEMORY')
+        if msg.static:
+            return vm_exception('Cannot CREATE inside a static context')
+        if ext.get_balance(msg.to) >= value and msg.depth < MAX_DEPTH:
+            cd = CallData(mem, mstart, msz)
+            ingas = compustate.gas
+            if anti_dos:
+                ingas = all_but_1n(ingas, opcodes.CALL_CHILD_LIMIT_DENOM)
+            create_msg = Message(msg.to, b'', value, ingas, cd, msg.depth + 1)
+            o, gas, data = ext.create(create_msg)
+            if o:
+                stk.append(utils.coerce_to_int(data))
+                compustate.last_returned = bytearray(b'')
+            else:
+                stk.append(0)
+                compustate.last_returned = bytearray(data)
+            compustate.gas = compustate.gas - ingas + gas
+        else:
+            stk.append(0)
+            compustate.last_returned = bytearray(b'')
+    return op_create
+
+
+# CALL, CALLCODE, DELEGATECALL and STATICCALL
+def mk_op_call(op, homestead, anti_dos, spurious_dragon, metropolis):
+    def op_call(compustate, stk, mem, ext, msg):
+        # Pull arguments from the stack
+        if op in ('CALL', 'CALLCODE'):
+            gas, to, value, meminstart, meminsz, memoutstart, memoutsz = \
+                stk.pop(), stk.pop(), stk.pop(), stk.pop(), stk.pop(), stk.pop(), stk.pop()
+        else:
+            gas, to, meminstart, meminsz, memoutstart, memoutsz = \
+                stk.pop(), stk.pop(), stk.pop(), stk.pop(), stk.pop(), stk.pop()
+            value = 0
+        # Static context prohibition
+        if msg.static and value > 0 and op == 'CALL':
+            return vm_exception(
+                'Cannot make a non-zero-value call inside a static context')
+        # Expand memory
+        if not mem_extend(mem, compustate, op, meminstart, meminsz) or \
+                not mem_extend(mem, compustate, op, memoutstart, memoutsz):
+            return vm_exception('OOG EXTENDING MEMORY')
+        to = utils.int_to_addr(to)
+        # Extra gas costs based on various factors
+        extra_gas = 0
+        # Creating a new account
+        if op == 'CALL' and not ext.account_exists(to) and (
+                value > 0 or not spurious_dragon):
+            extra_gas += opcodes.GCALLNEWACCOUNT
+        # Value transfer
+        if value > 0:
+            extra_gas += opcodes.GCALLVALUETRANSFER
+        # Cost increased from 40 to 700 in Tangerine Whistle
+        if anti_dos:
+            extra_gas += opcodes.CALL_SUPPLEMENTAL_GAS
+        # Compute child gas limit
+        if anti_dos:
+            if compustate.gas < extra_gas:
+                return vm_exception('OUT OF GAS', needed=extra_gas)
+            gas = min(
+                gas,
+                all_but_1n(
+                    compustate.gas -
+                    extra_gas,
+                    opcodes.CALL_CHILD_LIMIT_DENOM))
+        else:
+            if compustate.gas < gas + extra_gas:
+                return vm_exception('OUT OF GAS', needed=gas + extra_gas)
+        submsg_gas = gas + opcodes.GSTIPEND * (value > 0)
+        # Verify that there is sufficient balance and depth
+        if ext.get_balance(msg.to) < value or msg.depth >= MAX_DEPTH:
+            compustate.gas -= (gas + extra_gas - submsg_gas)
+            stk.append(0)
+            compustate.last_returned = bytearray(b'')
+            return
+        # Subtract gas from parent
+        compustate.gas -= (gas + extra_gas)
+        assert compustate.gas >= 0
+        cd = CallData(mem, meminstart, meminsz)
+        # Generate the message
+        if op == 'CALL':
+            call_msg = Message(msg.to, to, value, submsg_gas, cd,
+                               msg.depth + 1, code_address=to, static=msg.static)
+        elif homestead and op == 'DELEGATECALL':
+            call_msg = Message(msg.sender, msg.to, msg.value, submsg_gas, cd,
+                               msg.depth + 1, code_address=to, transfers_value=False, static=msg.static)
+        elif metropolis and op == 'STATICCALL':
+            call_msg = Message(msg.to, to, value, submsg_gas, cd,
+                               msg.depth + 1, code_address=to, static=True)
+        elif op in ('DELEGATECALL', 'STATICCALL'):
+            return vm_exception('OPCODE %s INACTIVE' % op)
+        elif op == 'CALLCODE':
+            call_msg = Message(msg.to, msg.to, value, submsg_gas, cd,
+                               msg.depth + 1, code_address=to, static=msg.static)
+        else:
+            raise Exception("Lolwut")
+        # Get result
+        result, gas, data = ext.msg(call_msg)
+        if result == 0:
+            stk.append(0)
+        else:
+            stk.append(1)
+        # Set output memory
+        copied = min(len(data), memoutsz)
+        mem[memoutstart: memoutstart + copied] = data[:copied]
+        compustate.gas += gas
+        compustate.last_returned = bytearray(data)
+    return op_call
+
+
+def op_return(compustate, stk, mem, ext, msg):
+    s0, s1 = stk.pop(), stk.pop()
+    if not mem_extend(mem, compustate, 'RETURN', s0, s1):
+        return vm_exception('OOG EXTENDING MEMORY')
+    return peaceful_exit('RETURN', compustate.gas, mem[s0: s0 + s1])
+
+
+def op_revert(compustate, stk, mem, ext, msg):
+    s0, s1 = stk.pop(), stk.pop()
+    if not mem_extend(mem, compustate, 'REVERT', s0, s1):
+        return vm_exception('OOG EXTENDING MEMORY')
+    return revert(compustate.gas, mem[s0: s0 + s1])
+
+
+# SUICIDE opcode (also called SELFDESTRUCT)
+def mk_op_suicide(anti_dos, spurious_dragon):
+    def op_suicide(compustate, stk, mem, ext, msg):
+        if msg.static:
+            return vm_exception('Cannot SUICIDE inside a static context')
+        to = utils.encode_int(stk.pop())
+        to = ((b'\x00' * (32 - len(to))) + to)[12:]
+        xfer = ext.get_balance(msg.to)
+        if anti_dos:
+            extra_gas = opcodes.SUICIDE_SUPPLEMENTAL_GAS + \
+                (not ext.account_exists(to)) * (xfer > 0 or not spurious_dragon) * \
+                opcodes.GCALLNEWACCOUNT
+            if not eat_gas(compustate, extra_gas):
+                return vm_exception("OUT OF GAS")
+        ext.set_balance(to, ext.get_balance(to) + xfer)
+        ext.set_balance(msg.to, 0)
+        ext.add_suicide(msg.to)
+        log_msg.debug(
+            'SUICIDING',
+            addr=utils.checksum_encode(
+                msg.to),
+            to=utils.checksum_encode(to),
+            xferring=xfer)
+        return peaceful_exit('SUICIDED', compustate.gas, [])
+    return op_suicide
+
+
+# Handlers that do not depend on the fork. Opcodes without a handler
+# (JUMPDEST, CALLBLACKBOX) do nothing; pushes are handled inline
+OP_HANDLERS = {
+    'STOP': op_stop, 'ADD': op_add, 'MUL': op_mul, 'SUB': op_sub,
+    'DIV': op_div, 'SDIV': op_sdiv, 'MOD': op_mod, 'SMOD': op_smod,
+    'ADDMOD': op_addmod, 'MULMOD': op_mulmod, 'SIGNEXTEND': op_signextend,
+    'LT': op_lt, 'GT': op_gt, 'SLT': op_slt, 'SGT': op_sgt, 'EQ': op_eq,
+    'ISZERO': op_iszero, 'AND': op_and, 'OR': op_or, 'XOR': op_xor,
+    'NOT': op_not, 'BYTE': op_byte, 'SHA3': op_sha3,
+    'ADDRESS': op_address, 'BALANCE': op_balance, 'ORIGIN': op_origin,
+    'CALLER': op_caller, 'CALLVALUE': op_callvalue,
+    'CALLDATALOAD': op_calldataload, 'CALLDATASIZE': op_calldatasize,
+    'CALLDATACOPY': op_calldatacopy, 'CODESIZE': op_codesize,
+    'CODECOPY': op_codecopy, 'GASPRICE': op_gasprice,
+    'EXTCODESIZE': op_extcodesize, 'EXTCODECOPY': op_extcodecopy,
+    'RETURNDATASIZE': op_returndatasize,
+    'RETURNDATACOPY': op_returndatacopy,
+    'BLOCKHASH': op_blockhash, 'COINBASE': op_coinbase,
+    'TIMESTAMP': op_timestamp, 'NUMBER': op_number,
+    'DIFFICULTY': op_difficulty, 'GASLIMIT': op_gaslimit,
+    'POP': op_pop, 'MLOAD': op_mload, 'MSTORE': op_mstore,
+    'MSTORE8': op_mstore8, 'SLOAD': op_sload, 'SSTORE': op_sstore,
+    'JUMP': op_jump, 'JUMPI': op_jumpi, 'PC': op_pc, 'MSIZE': op_msize,
+    'GAS': op_gas, 'RETURN': op_return, 'REVERT': op_revert,
+}
+for i in range(1, 17):
+    OP_HANDLERS['DUP%d' % i] = mk_op_dup(i)
+    OP_HANDLERS['SWAP%d' % i] = mk_op_swap(i)
+for i in range(5):
+    OP_HANDLERS['LOG%d' % i] = mk_op_log(i)
+
+# Flat fees added to the base fee from Tangerine Whistle on
+ANTI_DOS_SUPPLEMENTAL_FEES = {
+    'BALANCE': opcodes.BALANCE_SUPPLEMENTAL_GAS,
+    'EXTCODESIZE': opcodes.EXTCODELOAD_SUPPLEMENTAL_GAS,
+    'EXTCODECOPY': opcodes.EXTCODELOAD_SUPPLEMENTAL_GAS,
+    'SLOAD': opcodes.SLOAD_SUPPLEMENTAL_GAS,
+}
+
+
+def mk_opcode_table(homestead, anti_dos, spurious_dragon, metropolis):
+    """Builds the dispatch table for one combination of forks.
+
+    :return: a list indexed by opcode holding either None for an invalid
+             opcode or (op, in_args, max_stack_height, fee, handler), where
+             max_stack_height is the highest stack the opcode accepts and
+             handler is None for pushes
+    """
+    handlers = dict(OP_HANDLERS)
+    expbytefee = opcodes.GEXPONENTBYTE
+    if spurious_dragon:
+        expbytefee += opcodes.EXP_SUPPLEMENTAL_GAS
+    handlers['EXP'] = mk_op_exp(expbytefee)
+    handlers['CREATE'] = mk_op_create(anti_dos)
+    for op in ('CALL', 'CALLCODE', 'DELEGATECALL', 'STATICCALL'):
+        handlers[op] = mk_op_call(
+            op, homestead, anti_dos, spurious_dragon, metropolis)
+    handlers['SUICIDE'] = mk_op_suicide(anti_dos, spurious_dragon)
+    table = [None] * 256
+    for opcode, (op, in_args, out_args, fee) in opcodes.opcodes.items():
+        if opcode in opcodes.opcodesMetropolis and not metropolis:
+            continue
+        if anti_dos:
+            fee += ANTI_DOS_SUPPLEMENTAL_FEES.get(op, 0)
+        if 0x60 <= opcode <= 0x7f:
+            handler = None
+        else:
+            handler = handlers.get(op, op_noop)
+        table[opcode] = (op, in_args, 1024 + in_args - out_args, fee, handler)
+    return table
+
+
+opcode_tables = {}
+
+
+def get_opcode_table(ext):
+    rules = ext.fork_rules
+    key = (rules.homestead, rules.anti_dos, rules.spurious_dragon,
+           rules.metropolis)
+    if key not in opcode_tables:
+        opcode_tables[key] = mk_opcode_table(*key)
+    return opcode_tables[key]
+
+
 # Main function
-def vm_execute(ext, msg, code):
+def vm_execute(ext, msg, code, code_hash=None):
     # precompute trace flag
     # if we trace vm, we're in slow mode anyway
     trace_vm = log_vm_op.is_active('trace')
+    tracer = ext.tracer
 
     # Initialize stack, memory, program counter, etc
     compustate = Compustate(gas=msg.gas)
@@ -254,8 +910,13 @@ def vm_execute(ext, msg, code):
     mem = compustate.memory
 
     # Compute
-    jumpdest_mask, pushcache = preprocess_code(code)
+    jumpdests, pushcache = analysis_cache.get(
+        code, code_hash, ext.code_analysis_db)
     codelen = len(code)
+    compustate.code = code
+    compustate.codelen = codelen
+    compustate.jumpdests = jumpdests
+    table = get_opcode_table(ext)
 
     # For tracing purposes
     op = None
@@ -264,15 +925,20 @@ def vm_execute(ext, msg, code):
     while compustate.pc < codelen:
 
         opcode = safe_ord(code[compustate.pc])
+        entry = table[opcode]
+
+        if tracer is not None:
+            tracer.step(msg, compustate, compustate.pc,
+                        entry[0] if entry else 'INVALID', compustate.gas)
 
         # Invalid operation
-        if opcode not in opcodes.opcodes:
+        if entry is None:
+            if opcode in opcodes.opcodes:
+                return vm_exception('INVALID OP (not yet enabled)',
+                                    opcode=opcode)
             return vm_exception('INVALID OP', opcode=opcode)
 
-        if opcode in opcodes.opcodesMetropolis and not ext.post_metropolis_hardfork():
-            return vm_exception('INVALID OP (not yet enabled)', opcode=opcode)
-
-        op, in_args, out_args, fee = opcodes.opcodes[opcode]
+        op, in_args, max_stack, fee, handler = entry
 
         # Apply operation
         if trace_vm:
@@ -322,455 +988,26 @@ def vm_execute(ext, msg, code):
             return vm_exception('OUT OF GAS')
 
         # empty stack error
-        if in_args > len(compustate.stack):
+        if in_args > len(stk):
             return vm_exception('INSUFFICIENT STACK',
                                 op=op, needed=to_string(in_args),
-                                available=to_string(len(compustate.stack)))
+                                available=to_string(len(stk)))
 
         # overfull stack error
-        if len(compustate.stack) - in_args + out_args > 1024:
+        if len(stk) > max_stack:
             return vm_exception('STACK SIZE LIMIT EXCEEDED',
                                 op=op,
-                                pre_height=to_string(len(compustate.stack)))
+                                pre_height=to_string(len(stk)))
 
-        # Valid operations
-        # Pushes first because they are very frequent
-        if 0x60 <= opcode <= 0x7f:
+        # Pushes are inlined because they are very frequent
+        if handler is None:
             stk.append(pushcache[compustate.pc - 1])
             # Move 1 byte forward for 0x60, up to 32 bytes for 0x7f
             compustate.pc += opcode - 0x5f
-        # Arithmetic
-        elif opcode < 0x10:
-            if op == 'STOP':
-                return peaceful_exit('STOP', compustate.gas, [])
-            elif op == 'ADD':
-                stk.append((stk.pop() + stk.pop()) & TT256M1)
-            elif op == 'SUB':
-                stk.append((stk.pop() - stk.pop()) & TT256M1)
-            elif op == 'MUL':
-                stk.append((stk.pop() * stk.pop()) & TT256M1)
-            elif op == 'DIV':
-                s0, s1 = stk.pop(), stk.pop()
-                stk.append(0 if s1 == 0 else s0 // s1)
-            elif op == 'MOD':
-                s0, s1 = stk.pop(), stk.pop()
-                stk.append(0 if s1 == 0 else s0 % s1)
-            elif op == 'SDIV':
-                s0, s1 = utils.to_signed(stk.pop()), utils.to_signed(stk.pop())
-                stk.append(0 if s1 == 0 else (abs(s0) // abs(s1) *
-                                              (-1 if s0 * s1 < 0 else 1)) & TT256M1)
-            elif op == 'SMOD':
-                s0, s1 = utils.to_signed(stk.pop()), utils.to_signed(stk.pop())
-                stk.append(0 if s1 == 0 else (abs(s0) % abs(s1) *
-                                              (-1 if s0 < 0 else 1)) & TT256M1)
-            elif op == 'ADDMOD':
-                s0, s1, s2 = stk.pop(), stk.pop(), stk.pop()
-                stk.append((s0 + s1) % s2 if s2 else 0)
-            elif op == 'MULMOD':
-                s0, s1, s2 = stk.pop(), stk.pop(), stk.pop()
-                stk.append((s0 * s1) % s2 if s2 else 0)
-            elif op == 'EXP':
-                base, exponent = stk.pop(), stk.pop()
-                # fee for exponent is dependent on its bytes
-                # calc n bytes to represent exponent
-                nbytes = len(utils.encode_int(exponent))
-                expfee = nbytes * opcodes.GEXPONENTBYTE
-                if ext.post_spurious_dragon_hardfork():
-                    expfee += opcodes.EXP_SUPPLEMENTAL_GAS * nbytes
-                if compustate.gas < expfee:
-                    compustate.gas = 0
-                    return vm_exception('OOG EXPONENT')
-                compustate.gas -= expfee
-                stk.append(pow(base, exponent, TT256))
-            elif op == 'SIGNEXTEND':
-                s0, s1 = stk.pop(), stk.pop()
-                if s0 <= 31:
-                    testbit = s0 * 8 + 7
-                    if s1 & (1 << testbit):
-                        stk.append(s1 | (TT256 - (1 << testbit)))
-                    else:
-                        stk.append(s1 & ((1 << testbit) - 1))
-                else:
-                    stk.append(s1)
-        # Comparisons
-        elif opcode < 0x20:
-            if op == 'LT':
-                stk.append(1 if stk.pop() < stk.pop() else 0)
-            elif op == 'GT':
-                stk.append(1 if stk.pop() > stk.pop() else 0)
-            elif op == 'SLT':
-                s0, s1 = utils.to_signed(stk.pop()), utils.to_signed(stk.pop())
-                stk.append(1 if s0 < s1 else 0)
-            elif op == 'SGT':
-                s0, s1 = utils.to_signed(stk.pop()), utils.to_signed(stk.pop())
-                stk.append(1 if s0 > s1 else 0)
-            elif op == 'EQ':
-                stk.append(1 if stk.pop() == stk.pop() else 0)
-            elif op == 'ISZERO':
-                stk.append(0 if stk.pop() else 1)
-            elif op == 'AND':
-                stk.append(stk.pop() & stk.pop())
-            elif op == 'OR':
-                stk.append(stk.pop() | stk.pop())
-            elif op == 'XOR':
-                stk.append(stk.pop() ^ stk.pop())
-            elif op == 'NOT':
-                stk.append(TT256M1 - stk.pop())
-            elif op == 'BYTE':
-                s0, s1 = stk.pop(), stk.pop()
-                if s0 >= 32:
-                    stk.append(0)
-                else:
-                    stk.append((s1 // 256 ** (31 - s0)) % 256)
-        # SHA3 and environment info
-        elif opcode < 0x40:
-            if op == 'SHA3':
-                s0, s1 = stk.pop(), stk.pop()
-                compustate.gas -= opcodes.GSHA3WORD * (utils.ceil32(s1) // 32)
-                if compustate.gas < 0:
-                    return vm_exception('OOG PAYING FOR SHA3')
-                if not mem_extend(mem, compustate, op, s0, s1):
-                    return vm_exception('OOG EXTENDING MEMORY')
-                data = bytearray_to_bytestr(mem[s0: s0 + s1])
-                stk.append(utils.big_endian_to_int(utils.sha3(data)))
-            elif op == 'ADDRESS':
-                stk.append(utils.coerce_to_int(msg.to))
-            elif op == 'BALANCE':
-                if ext.post_anti_dos_hardfork():
-                    if not eat_gas(compustate,
-                                   opcodes.BALANCE_SUPPLEMENTAL_GAS):
-                        return vm_exception("OUT OF GAS")
-                addr = utils.coerce_addr_to_hex(stk.pop() % 2**160)
-                stk.append(ext.get_balance(addr))
-            elif op == 'ORIGIN':
-                stk.append(utils.coerce_to_int(ext.tx_origin))
-            elif op == 'CALLER':
-                stk.append(utils.coerce_to_int(msg.sender))
-            elif op == 'CALLVALUE':
-                stk.append(msg.value)
-            elif op == 'CALLDATALOAD':
-                stk.append(msg.data.extract32(stk.pop()))
-            elif op == 'CALLDATASIZE':
-                stk.append(msg.data.size)
-            elif op == 'CALLDATACOPY':
-                mstart, dstart, size = stk.pop(), stk.pop(), stk.pop()
-                if not mem_extend(mem, compustate, op, mstart, size):
-                    return vm_exception('OOG EXTENDING MEMORY')
-                if not data_copy(compustate, size):
-                    return vm_exception('OOG COPY DATA')
-                msg.data.extract_copy(mem, mstart, dstart, size)
-            elif op == 'CODESIZE':
-                stk.append(codelen)
-            elif op == 'CODECOPY':
-                mstart, dstart, size = stk.pop(), stk.pop(), stk.pop()
-                if not mem_extend(mem, compustate, op, mstart, size):
-                    return vm_exception('OOG EXTENDING MEMORY')
-                if not data_copy(compustate, size):
-                    return vm_exception('OOG COPY DATA')
-                for i in range(size):
-                    if dstart + i < codelen:
-                        mem[mstart + i] = safe_ord(code[dstart + i])
-                    else:
-                        mem[mstart + i] = 0
-            elif op == 'RETURNDATACOPY':
-                mstart, dstart, size = stk.pop(), stk.pop(), stk.pop()
-                if not mem_extend(mem, compustate, op, mstart, size):
-                    return vm_exception('OOG EXTENDING MEMORY')
-                if not data_copy(compustate, size):
-                    return vm_exception('OOG COPY DATA')
-                if dstart + size > len(compustate.last_returned):
-                    return vm_exception('RETURNDATACOPY out of range')
-                mem[mstart: mstart + size] = compustate.last_returned[dstart: dstart + size]
-            elif op == 'RETURNDATASIZE':
-                stk.append(len(compustate.last_returned))
-            elif op == 'GASPRICE':
-                stk.append(ext.tx_gasprice)
-            elif op == 'EXTCODESIZE':
-                if ext.post_anti_dos_hardfork():
-                    if not eat_gas(compustate,
-                                   opcodes.EXTCODELOAD_SUPPLEMENTAL_GAS):
-                        return vm_exception("OUT OF GAS")
-                addr = utils.coerce_addr_to_hex(stk.pop() % 2**160)
-                stk.append(len(ext.get_code(addr) or b''))
-            elif op == 'EXTCODECOPY':
-                if ext.post_anti_dos_hardfork():
-                    if not eat_gas(compustate,
-                                   opcodes.EXTCODELOAD_SUPPLEMENTAL_GAS):
-                        return vm_exception("OUT OF GAS")
-                addr = utils.coerce_addr_to_hex(stk.pop() % 2**160)
-                start, s2, size = stk.pop(), stk.pop(), stk.pop()
-                extcode = ext.get_code(addr) or b''
-                assert utils.is_string(extcode)
-                if not mem_extend(mem, compustate, op, start, size):
-                    return vm_exception('OOG EXTENDING MEMORY')
-                if not data_copy(compustate, size):
-                    return vm_exception('OOG COPY DATA')
-                for i in range(size):
-                    if s2 + i < len(extcode):
-                        mem[start + i] = safe_ord(extcode[s2 + i])
-                    else:
-                        mem[start + i] = 0
-        # Block info
-        elif opcode < 0x50:
-            if op == 'BLOCKHASH':
-                if ext.post_constantinople_hardfork() and False:
-                    bh_addr = ext.blockhash_store
-                    stk.append(ext.get_storage_data(bh_addr, stk.pop()))
-                else:
-                    stk.append(
-                        utils.big_endian_to_int(
-                            ext.block_hash(
-                                stk.pop())))
-            elif op == 'COINBASE':
-                stk.append(utils.big_endian_to_int(ext.block_coinbase))
-            elif op == 'TIMESTAMP':
-                stk.append(ext.block_timestamp)
-            elif op == 'NUMBER':
-                stk.append(ext.block_number)
-            elif op == 'DIFFICULTY':
-                stk.append(ext.block_difficulty)
-            elif op == 'GASLIMIT':
-                stk.append(ext.block_gas_limit)
-        # VM state manipulations
-        elif opcode < 0x60:
-            if op == 'POP':
-                stk.pop()
-            elif op == 'MLOAD':
-                s0 = stk.pop()
-                if not mem_extend(mem, compustate, op, s0, 32):
-                    return vm_exception('OOG EXTENDING MEMORY')
-                stk.append(utils.bytes_to_int(mem[s0: s0 + 32]))
-            elif op == 'MSTORE':
-                s0, s1 = stk.pop(), stk.pop()
-                if not mem_extend(mem, compustate, op, s0, 32):
-                    return vm_exception('OOG EXTENDING MEMORY')
-                mem[s0: s0 + 32] = utils.encode_int32(s1)
-            elif op == 'MSTORE8':
-                s0, s1 = stk.pop(), stk.pop()
-                if not mem_extend(mem, compustate, op, s0, 1):
-                    return vm_exception('OOG EXTENDING MEMORY')
-                mem[s0] = s1 % 256
-            elif op == 'SLOAD':
-                if ext.post_anti_dos_hardfork():
-                    if not eat_gas(compustate, opcodes.SLOAD_SUPPLEMENTAL_GAS):
-                        return vm_exception("OUT OF GAS")
-                stk.append(ext.get_storage_data(msg.to, stk.pop()))
-            elif op == 'SSTORE':
-                s0, s1 = stk.pop(), stk.pop()
-                if msg.static:
-                    return vm_exception(
-                        'Cannot SSTORE inside a static context')
-                if ext.get_storage_data(msg.to, s0):
-                    gascost = opcodes.GSTORAGEMOD if s1 else opcodes.GSTORAGEKILL
-                    refund = 0 if s1 else opcodes.GSTORAGEREFUND
-                else:
-                    gascost = opcodes.GSTORAGEADD if s1 else opcodes.GSTORAGEMOD
-                    refund = 0
-                if compustate.gas < gascost:
-                    return vm_exception('OUT OF GAS')
-                compustate.gas -= gascost
-                # adds neg gascost as a refund if below zero
-                ext.add_refund(refund)
-                ext.set_storage_data(msg.to, s0, s1)
-            elif op == 'JUMP':
-                compustate.pc = stk.pop()
-                if compustate.pc >= codelen or not (
-                        (1 << compustate.pc) & jumpdest_mask):
-                    return vm_exception('BAD JUMPDEST')
-            elif op == 'JUMPI':
-                s0, s1 = stk.pop(), stk.pop()
-                if s1:
-                    compustate.pc = s0
-                    if compustate.pc >= codelen or not (
-                            (1 << compustate.pc) & jumpdest_mask):
-                        return vm_exception('BAD JUMPDEST')
-            elif op == 'PC':
-                stk.append(compustate.pc - 1)
-            elif op == 'MSIZE':
-                stk.append(len(mem))
-            elif op == 'GAS':
-                stk.append(compustate.gas)  # AFTER subtracting cost 1
-        # DUPn (eg. DUP1: a b c -> a b c c, DUP3: a b c -> a b c a)
-        elif op[:3] == 'DUP':
-            # 0x7f - opcode is a negative number, -1 for 0x80 ... -16 for 0x8f
-            stk.append(stk[0x7f - opcode])
-        # SWAPn (eg. SWAP1: a b c d -> a b d c, SWAP3: a b c d -> d b c a)
-        elif op[:4] == 'SWAP':
-            # 0x8e - opcode is a negative number, -2 for 0x90 ... -17 for 0x9f
-            temp = stk[0x8e - opcode]
-            stk[0x8e - opcode] = stk[-1]
-            stk[-1] = temp
-        # Logs (aka "events")
-        elif op[:3] == 'LOG':
-            """
-            0xa0 ... 0xa4, 32/64/96/128/160 + len(data) gas
-            a. Opcodes LOG0...LOG4 are added, takes 2-6 stack arguments
-                    MEMSTART MEMSZ (TOPIC1) (TOPIC2) (TOPIC3) (TOPIC4)
-            b. Logs are kept track of during tx execution exactly the same way as suicides
-               (except as an ordered list, not a set).
-               Each log is in the form [address, [topic1, ... ], data] where:
-               * address is what the ADDRESS opcode would output
-               * data is mem[MEMSTART: MEMSTART + MEMSZ]
-               * topics are as provided by the opcode
-            c. The ordered list of logs in the transaction are expressed as [log0, log1, ..., logN].
-            """
-            depth = int(op[3:])
-            mstart, msz = stk.pop(), stk.pop()
-            topics = [stk.pop() for x in range(depth)]
-            compustate.gas -= msz * opcodes.GLOGBYTE
-            if msg.static:
-                return vm_exception('Cannot LOG inside a static context')
-            if not mem_extend(mem, compustate, op, mstart, msz):
-                return vm_exception('OOG EXTENDING MEMORY')
-            data = bytearray_to_bytestr(mem[mstart: mstart + msz])
-            ext.log(msg.to, topics, data)
-            log_log.trace('LOG', to=msg.to, topics=topics,
-                          data=list(map(utils.safe_ord, data)))
-            # print('LOG', msg.to, topics, list(map(ord, data)))
-        # Create a new contract
-        elif op == 'CREATE':
-            value, mstart, msz = stk.pop(), stk.pop(), stk.pop()
-            if not mem_extend(mem, compustate, op, mstart, msz):
-                return vm_exception('OOG EXTENDING MEMORY')
-            if msg.static:
-                return vm_exception('Cannot CREATE inside a static context')
-            if ext.get_balance(msg.to) >= value and msg.depth < MAX_DEPTH:
-                cd = CallData(mem, mstart, msz)
-                ingas = compustate.gas
-                if ext.post_anti_dos_hardfork():
-                    ingas = all_but_1n(ingas, opcodes.CALL_CHILD_LIMIT_DENOM)
-                create_msg = Message(msg.to, b'', value, ingas, cd, msg.depth + 1)
-                o, gas, data = ext.create(create_msg)
-                if o:
-                    stk.append(utils.coerce_to_int(data))
-                    compustate.last_returned = bytearray(b'')
-                else:
-                    stk.append(0)
-                    compustate.last_returned = bytearray(data)
-                compustate.gas = compustate.gas - ingas + gas
-            else:
-                stk.append(0)
-                compustate.last_returned = bytearray(b'')
-        # Calls
-        elif op in ('CALL', 'CALLCODE', 'DELEGATECALL', 'STATICCALL'):
-            # Pull arguments from the stack
-            if op in ('CALL', 'CALLCODE'):
-                gas, to, value, meminstart, meminsz, memoutstart, memoutsz = \
-                    stk.pop(), stk.pop(), stk.pop(), stk.pop(), stk.pop(), stk.pop(), stk.pop()
-            else:
-                gas, to, meminstart, meminsz, memoutstart, memoutsz = \
-                    stk.pop(), stk.pop(), stk.pop(), stk.pop(), stk.pop(), stk.pop()
-                value = 0
-            # Static context prohibition
-            if msg.static and value > 0 and op == 'CALL':
-                return vm_exception(
-                    'Cannot make a non-zero-value call inside a static context')
-            # Expand memory
-            if not mem_extend(mem, compustate, op, meminstart, meminsz) or \
-                    not mem_extend(mem, compustate, op, memoutstart, memoutsz):
-                return vm_exception('OOG EXTENDING MEMORY')
-            to = utils.int_to_addr(to)
-            # Extra gas costs based on various factors
-            extra_gas = 0
-            # Creating a new account
-            if op == 'CALL' and not ext.account_exists(to) and (
-                    value > 0 or not ext.post_spurious_dragon_hardfork()):
-                extra_gas += opcodes.GCALLNEWACCOUNT
-            # Value transfer
-            if value > 0:
-                extra_gas += opcodes.GCALLVALUETRANSFER
-            # Cost increased from 40 to 700 in Tangerine Whistle
-            if ext.post_anti_dos_hardfork():
-                extra_gas += opcodes.CALL_SUPPLEMENTAL_GAS
-            # Compute child gas limit
-            if ext.post_anti_dos_hardfork():
-                if compustate.gas < extra_gas:
-                    return vm_exception('OUT OF GAS', needed=extra_gas)
-                gas = min(
-                    gas,
-                    all_but_1n(
-                        compustate.gas -
-                        extra_gas,
-                        opcodes.CALL_CHILD_LIMIT_DENOM))
-            else:
-                if compustate.gas < gas + extra_gas:
-                    return vm_exception('OUT OF GAS', needed=gas + extra_gas)
-            submsg_gas = gas + opcodes.GSTIPEND * (value > 0)
-            # Verify that there is sufficient balance and depth
-            if ext.get_balance(msg.to) < value or msg.depth >= MAX_DEPTH:
-                compustate.gas -= (gas + extra_gas - submsg_gas)
-                stk.append(0)
-                compustate.last_returned = bytearray(b'')
-            else:
-                # Subtract gas from parent
-                compustate.gas -= (gas + extra_gas)
-                assert compustate.gas >= 0
-                cd = CallData(mem, meminstart, meminsz)
-                # Generate the message
-                if op == 'CALL':
-                    call_msg = Message(msg.to, to, value, submsg_gas, cd,
-                                       msg.depth + 1, code_address=to, static=msg.static)
-                elif ext.post_homestead_hardfork() and op == 'DELEGATECALL':
-                    call_msg = Message(msg.sender, msg.to, msg.value, submsg_gas, cd,
-                                       msg.depth + 1, code_address=to, transfers_value=False, static=msg.static)
-                elif ext.post_metropolis_hardfork() and op == 'STATICCALL':
-                    call_msg = Message(msg.to, to, value, submsg_gas, cd,
-                                       msg.depth + 1, code_address=to, static=True)
-                elif op in ('DELEGATECALL', 'STATICCALL'):
-                    return vm_exception('OPCODE %s INACTIVE' % op)
-                elif op == 'CALLCODE':
-                    call_msg = Message(msg.to, msg.to, value, submsg_gas, cd,
-                                       msg.depth + 1, code_address=to, static=msg.static)
-                else:
-                    raise Exception("Lolwut")
-                # Get result
-                result, gas, data = ext.msg(call_msg)
-                if result == 0:
-                    stk.append(0)
-                else:
-                    stk.append(1)
-                # Set output memory
-                for i in range(min(len(data), memoutsz)):
-                    mem[memoutstart + i] = data[i]
-                compustate.gas += gas
-                compustate.last_returned = bytearray(data)
-        # Return opcode
-        elif op == 'RETURN':
-            s0, s1 = stk.pop(), stk.pop()
-            if not mem_extend(mem, compustate, op, s0, s1):
-                return vm_exception('OOG EXTENDING MEMORY')
-            return peaceful_exit('RETURN', compustate.gas, mem[s0: s0 + s1])
-        # Revert opcode (Metropolis)
-        elif op == 'REVERT':
-            if not ext.post_metropolis_hardfork():
-                return vm_exception('Opcode not yet enabled')
-            s0, s1 = stk.pop(), stk.pop()
-            if not mem_extend(mem, compustate, op, s0, s1):
-                return vm_exception('OOG EXTENDING MEMORY')
-            return revert(compustate.gas, mem[s0: s0 + s1])
-        # SUICIDE opcode (also called SELFDESTRUCT)
-        elif op == 'SUICIDE':
-            if msg.static:
-                return vm_exception('Cannot SUICIDE inside a static context')
-            to = utils.encode_int(stk.pop())
-            to = ((b'\x00' * (32 - len(to))) + to)[12:]
-            xfer = ext.get_balance(msg.to)
-            if ext.post_anti_dos_hardfork():
-                extra_gas = opcodes.SUICIDE_SUPPLEMENTAL_GAS + \
-                    (not ext.account_exists(to)) * (xfer >
-                                                    0 or not ext.post_spurious_dragon_hardfork()) * opcodes.GCALLNEWACCOUNT
-                if not eat_gas(compustate, extra_gas):
-                    return vm_exception("OUT OF GAS")
-            ext.set_balance(to, ext.get_balance(to) + xfer)
-            ext.set_balance(msg.to, 0)
-            ext.add_suicide(msg.to)
-            log_msg.debug(
-                'SUICIDING',
-                addr=utils.checksum_encode(
-                    msg.to),
-                to=utils.checksum_encode(to),
-                xferring=xfer)
-            return peaceful_exit('SUICIDED', compustate.gas, [])
+        else:
+            res = handler(compustate, stk, mem, ext, msg)
+            if res is not None:
+                return res
 
         if trace_vm:
             vm_trace(ext, msg, compustate, opcode, pushcache)
@@ -803,6 +1040,10 @@ class VmExtBase():
         self.log = lambda addr, topics, data: 0
         self.tx_origin = b'0' * 40
         self.tx_gasprice = 0
+        self.code_analysis_db = None
+        self.vm_execute = vm_execute
+        self.tracer = None
+        self.fork_rules = ForkRules(default_config, 0)
         self.create = lambda msg: 0, 0, 0
         self.call = lambda msg: 0, 0, 0
         self.sendmsg = lambda msg: 0, 0, 0
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+"""Replays a block with the VM profiler and prints where the time went.
+
+Usage: profile_block.py -s parent_snapshot.json -b block.rlp [-n 20] [-p 4]
+
+The snapshot is the JSON from State.to_snapshot() of the state the block
+is built on, and the block file holds the hex encoded RLP of the block.
+Headers, seals and the resulting state root are not checked, only the
+transactions are run, each with a ProfileTracer attached.
+"""
+import click
+import json
+import time
+import rlp
+
+from ethereum import config
+from ethereum.block import Block
+from ethereum.config import Env
+from ethereum.consensus_strategy import get_consensus_strategy
+from ethereum.db import EphemDB
+from ethereum.messages import apply_transaction, VMExt
+from ethereum.state import State
+from ethereum.tracers import ProfileTracer
+from ethereum.transactions import recover_senders, close_recovery_pools
+from ethereum.utils import decode_hex
+
+FORKS = {
+    'frontier': config.config_frontier,
+    'homestead': config.config_homestead,
+    'tangerine': config.config_tangerine,
+    'spurious': config.config_spurious,
+    'metropolis': config.config_metropolis,
+}
+
+
+def profile_block(state, block, processes=1):
+    tracer = ProfileTracer()
+    get_consensus_strategy(state.config).initialize(state, block)
+    recover_senders(block.transactions, processes)
+    st = time.time()
+    ext = VMExt(state, None)
+    for tx in block.transactions:
+        apply_transaction(state, tx, tracer, ext)
+    return tracer, time.time() - st
+
+
+@click.command()
+@click.option('-s', '--snapshot', type=click.File(), required=True,
+              help='Snapshot of the parent state.')
+@click.option('-b', '--block', type=click.File(), required=True,
+              help='Hex encoded RLP of the block.')
+@click.option('-f', '--fork', type=click.Choice(sorted(FORKS)),
+              help='Rules to apply (default: by block number).')
+@click.option('-n', '--limit', type=int, default=20,
+              help='Number of opcodes and contracts to show.')
+@click.option('-p', '--processes', type=int, default=None,
+              help='Processes recovering senders (default: one per CPU).')
+def main(snapshot, block, fork, limit, processes):
+    env = Env(EphemDB(), FORKS[fork] if fork else config.default_config)
+    state = State.from_snapshot(json.load(snapshot), env)
+    block = rlp.decode(decode_hex(block.read().strip()), Block)
+    try:
+        tracer, elapsed = profile_block(state, block, processes)
+    finally:
+        close_recovery_pools()
+    print('block %d: %d transactions, %d gas in %.3fs' % (
+        block.number, len(block.transactions), state.gas_used, elapsed))
+    print('')
+    print(tracer.report(limit))
+
+
+if __name__ == '__main__':
+    main()
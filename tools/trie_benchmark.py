@@ -0,0 +1,44 @@
+#!/usr/bin/env python
+"""Microbenchmark for trie get/update throughput.
+
+Usage: trie_benchmark.py [number of keys]
+
+Run it against two checkouts (e.g. with PYTHONPATH pointing at each) to
+compare the trie internals before and after a change.
+"""
+import sys
+import time
+from ethereum import trie, db, utils
+
+
+def mk_keys(n):
+    return [utils.sha3(utils.to_string(i)) for i in range(n)]
+
+
+def bench_update(keys):
+    t = trie.Trie(db.EphemDB())
+    st = time.time()
+    for k in keys:
+        t.update(k, k)
+    return t, time.time() - st
+
+
+def bench_get(t, keys):
+    st = time.time()
+    for k in keys:
+        assert t.get(k) == k
+    return time.time() - st
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    keys = mk_keys(n)
+    t, elapsed = bench_update(keys)
+    print('update: %d keys in %.3fs, %d/s' % (n, elapsed, n / elapsed))
+    elapsed = bench_get(t, keys)
+    print('get:    %d keys in %.3fs, %d/s' % (n, elapsed, n / elapsed))
+    print('root:  ', utils.encode_hex(t.root_hash))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+"""Microbenchmark for interpreter throughput on loop-heavy contracts.
+
+Usage: vm_benchmark.py [loop iterations] [engine]
+
+Runs the same jump-heavy loop padded out to several code sizes. The cost
+of a jump should not depend on the size of the contract, so the rates
+should stay flat. The engine is a VM_ENGINE value, 'vm' (the default),
+'fastvm' or 'fastvm_fused'. Run it against two checkouts (e.g. with PYTHONPATH pointing at
+each) to compare interpreter changes.
+"""
+import sys
+import time
+from ethereum import config, db, utils, vm
+from ethereum.config import Env
+from ethereum.messages import VMExt, apply_msg
+from ethereum.state import State
+from ethereum.transactions import Transaction
+
+SENDER = b'\x33' * 20
+TARGET = b'\x10' * 20
+
+# i = n; do { x = (x * 3 + i) ^ i; mem[0] = x; i -= 1 } while (i)
+LOOP = bytes(bytearray([
+    0x5b,                                # JUMPDEST (loop start, pc 5)
+    0x81, 0x90, 0x60, 0x03, 0x02, 0x01,  # DUP2 SWAP1 PUSH1 3 MUL ADD
+    0x81, 0x18,                          # DUP2 XOR
+    0x80, 0x60, 0x00, 0x52,              # DUP1 PUSH1 0 MSTORE
+    0x90, 0x60, 0x01, 0x90, 0x03, 0x90,  # SWAP1 PUSH1 1 SWAP1 SUB SWAP1
+    0x81, 0x60, 0x05, 0x57,              # DUP2 PUSH1 5 JUMPI
+    0x00,                                # STOP
+]))
+LOOP_OPS = 20
+
+
+def mk_code(n, size):
+    code = b'\x61' + utils.zpad(utils.encode_int(n), 2) + b'\x60\x00' + LOOP
+    # pad with JUMPDESTs so the analysis has to track all of them
+    return code + b'\x5b' * max(0, size - len(code))
+
+
+def bench(code, engine='vm', rounds=3):
+    cfg = dict(config.config_metropolis)
+    cfg['VM_ENGINE'] = engine
+    state = State(env=Env(db.EphemDB(), cfg))
+    state.set_code(TARGET, code)
+    state.commit()
+    tx = Transaction(0, 1, 100000, TARGET, 0, b'')
+    tx.sender = SENDER
+    best = None
+    for i in range(rounds):
+        msg = vm.Message(SENDER, TARGET, 0, 10**9, b'')
+        st = time.time()
+        result, gas, data = apply_msg(VMExt(state, tx), msg)
+        elapsed = time.time() - st
+        assert result
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    engine = sys.argv[2] if len(sys.argv) > 2 else 'vm'
+    for size in (100, 1000, 10000, 24000):
+        elapsed = bench(mk_code(n, size), engine)
+        print('code size %5d: %d iterations in %.3fs, %d ops/s' %
+              (size, n, elapsed, n * LOOP_OPS / elapsed))
+
+
+if __name__ == '__main__':
+    main()